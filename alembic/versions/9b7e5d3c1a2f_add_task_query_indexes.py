@@ -0,0 +1,59 @@
+"""Add composite and trigram indexes for task queries
+
+Revision ID: 9b7e5d3c1a2f
+Revises: 4f1c2a9d7e31
+Create Date: 2024-09-23 09:41:17.220184
+
+The indexes follow the access paths of TaskActivityImpl.query_tasks, see the
+"Task query indexes" section of the README for which filter uses which index.
+They are built CONCURRENTLY so the table stays writable while they build,
+which means they have to run outside of the migration transaction.
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9b7e5d3c1a2f'
+down_revision: Union[str, None] = '4f1c2a9d7e31'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (index name, columns), every owner index ends with the (created_on, task_id) sort key
+COMPOSITE_INDEXES = [
+    ('ix_tasks_activity_created_by_created_on', ['created_by_id', 'created_on', 'task_id']),
+    ('ix_tasks_activity_assigned_to_created_on', ['assigned_to_id', 'created_on', 'task_id']),
+    ('ix_tasks_activity_created_by_status_created_on', ['created_by_id', 'status', 'created_on', 'task_id']),
+    ('ix_tasks_activity_assigned_to_status_created_on', ['assigned_to_id', 'status', 'created_on', 'task_id']),
+    ('ix_tasks_activity_created_by_activity_type_created_on',
+     ['created_by_id', 'activity_type_id', 'created_on', 'task_id']),
+    ('ix_tasks_activity_assigned_to_activity_type_created_on',
+     ['assigned_to_id', 'activity_type_id', 'created_on', 'task_id']),
+    ('ix_tasks_activity_created_by_due_date', ['created_by_id', 'due_date']),
+    ('ix_tasks_activity_assigned_to_due_date', ['assigned_to_id', 'due_date']),
+]
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+        for name, columns in COMPOSITE_INDEXES:
+            op.create_index(name, 'tasks_activity', columns, unique=False, postgresql_concurrently=True,
+                            if_not_exists=True)
+
+        # Trigram index so task_name ILIKE '%...%' can avoid a sequential scan
+        op.create_index('ix_tasks_activity_task_name_trgm', 'tasks_activity', ['task_name'], unique=False,
+                        postgresql_using='gin', postgresql_ops={'task_name': 'gin_trgm_ops'},
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_tasks_activity_task_name_trgm', table_name='tasks_activity',
+                      postgresql_concurrently=True, if_exists=True)
+
+        for name, _ in reversed(COMPOSITE_INDEXES):
+            op.drop_index(name, table_name='tasks_activity', postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,106 @@
+"""Partition tasks_history by month on created_at
+
+Revision ID: a8d3e6f9c2b4
+Revises: f2c6d8a1b3e7
+Create Date: 2024-09-30 15:27:09.340816
+
+The existing table is renamed, a range partitioned tasks_history is created
+with one partition per month that holds rows (plus the upcoming ones and a
+default partition), the rows are copied over and the old table is dropped.
+The primary key becomes (id, created_at) because a partitioned table's keys
+must contain the partition key; ids keep coming from the same sequence.
+
+"""
+from datetime import date, datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a8d3e6f9c2b4'
+down_revision: Union[str, None] = 'f2c6d8a1b3e7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MONTHS_AHEAD = 3
+
+COLUMNS = 'id, task_id, action, previous_data, new_data, version, is_snapshot, created_at, modified_by_id'
+
+INDEXES = [
+    ('ix_tasks_history_id', ['id']),
+    ('ix_tasks_history_task_id_version', ['task_id', 'version']),
+    ('ix_tasks_history_task_id_created_at', ['task_id', 'created_at', 'id']),
+    ('ix_tasks_history_modified_by_created_at', ['modified_by_id', 'created_at', 'id']),
+    ('ix_tasks_history_created_at', ['created_at', 'id']),
+]
+
+
+def _add_months(value: date, months: int) -> date:
+    month = value.month - 1 + months
+    return date(value.year + month // 12, month % 12 + 1, 1)
+
+
+def _create_history_table(partition_by: str = '') -> None:
+    op.execute(f"""
+        CREATE TABLE tasks_history (
+            id integer NOT NULL DEFAULT nextval('tasks_history_id_seq'),
+            task_id integer NOT NULL REFERENCES tasks_activity (task_id) ON DELETE CASCADE,
+            action varchar(50) NOT NULL,
+            previous_data jsonb,
+            new_data jsonb,
+            version integer NOT NULL,
+            is_snapshot boolean NOT NULL DEFAULT false,
+            created_at timestamp without time zone NOT NULL,
+            modified_by_id integer NOT NULL REFERENCES users (id),
+            PRIMARY KEY ({'id, created_at' if partition_by else 'id'})
+        ) {partition_by}
+    """)
+    op.execute("ALTER SEQUENCE tasks_history_id_seq OWNED BY tasks_history.id")
+
+
+def _move_to_legacy() -> None:
+    op.execute('ALTER TABLE tasks_history RENAME TO tasks_history_legacy')
+    op.execute('ALTER TABLE tasks_history_legacy RENAME CONSTRAINT tasks_history_pkey TO tasks_history_legacy_pkey')
+    # Index names are global to the schema, free them for the new table
+    for name, _ in INDEXES:
+        op.execute(f'DROP INDEX IF EXISTS {name}')
+    op.execute('ALTER SEQUENCE tasks_history_id_seq OWNED BY NONE')
+
+
+def _copy_from_legacy() -> None:
+    op.execute(f'INSERT INTO tasks_history ({COLUMNS}) SELECT {COLUMNS} FROM tasks_history_legacy')
+    op.execute('DROP TABLE tasks_history_legacy')
+    for name, columns in INDEXES:
+        op.create_index(name, 'tasks_history', columns, unique=False)
+
+
+def upgrade() -> None:
+    _move_to_legacy()
+    _create_history_table('PARTITION BY RANGE (created_at)')
+
+    # One partition per month from the oldest entry up to a few months ahead
+    oldest = op.get_bind().execute(sa.text('SELECT min(created_at) FROM tasks_history_legacy')).scalar()
+    current = datetime.utcnow().date().replace(day=1)
+    month = (oldest or datetime.utcnow()).date().replace(day=1)
+    last = _add_months(current, MONTHS_AHEAD)
+    while month <= last:
+        op.execute(
+            f"CREATE TABLE tasks_history_y{month.year:04d}m{month.month:02d} PARTITION OF tasks_history "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_add_months(month, 1).isoformat()}')"
+        )
+        month = _add_months(month, 1)
+    op.execute('CREATE TABLE tasks_history_default PARTITION OF tasks_history DEFAULT')
+
+    _copy_from_legacy()
+
+
+def downgrade() -> None:
+    # Archived partitions are not restored, only the rows still in the table are kept
+    _move_to_legacy()
+    _create_history_table()
+    _copy_from_legacy()
+    # Without partitions the (task_id, version) index can be unique again
+    op.drop_index('ix_tasks_history_task_id_version', table_name='tasks_history')
+    op.create_index('ix_tasks_history_task_id_version', 'tasks_history', ['task_id', 'version'], unique=True)
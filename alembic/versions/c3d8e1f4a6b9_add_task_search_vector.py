@@ -0,0 +1,45 @@
+"""Add full-text search vector to tasks
+
+Revision ID: c3d8e1f4a6b9
+Revises: 9b7e5d3c1a2f
+Create Date: 2024-09-25 14:03:52.671940
+
+search_vector is a stored generated column, so Postgres keeps it in sync with
+task_name, task_description and notes on every insert and update.
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3d8e1f4a6b9'
+down_revision: Union[str, None] = '9b7e5d3c1a2f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TASK_SEARCH_VECTOR = (
+    "setweight(to_tsvector('english', coalesce(task_name, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(task_description, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(notes, '')), 'C')"
+)
+
+
+def upgrade() -> None:
+    op.add_column('tasks_activity', sa.Column('search_vector', postgresql.TSVECTOR(),
+                                              sa.Computed(TASK_SEARCH_VECTOR, persisted=True), nullable=True))
+
+    with op.get_context().autocommit_block():
+        op.create_index('ix_tasks_activity_search_vector', 'tasks_activity', ['search_vector'], unique=False,
+                        postgresql_using='gin', postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_tasks_activity_search_vector', table_name='tasks_activity',
+                      postgresql_concurrently=True, if_exists=True)
+
+    op.drop_column('tasks_activity', 'search_vector')
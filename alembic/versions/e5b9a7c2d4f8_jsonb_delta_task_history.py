@@ -0,0 +1,67 @@
+"""Store task history as JSONB deltas
+
+Revision ID: e5b9a7c2d4f8
+Revises: c3d8e1f4a6b9
+Create Date: 2024-09-27 09:41:18.225904
+
+previous_data and new_data become JSONB. Existing rows keep their full
+snapshots and are marked as such; run `python -m api.history_backfill` to
+rewrite them as deltas in batches.
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5b9a7c2d4f8'
+down_revision: Union[str, None] = 'c3d8e1f4a6b9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.alter_column('tasks_history', 'previous_data', type_=postgresql.JSONB(),
+                    postgresql_using='previous_data::jsonb', existing_nullable=True)
+    op.alter_column('tasks_history', 'new_data', type_=postgresql.JSONB(),
+                    postgresql_using='new_data::jsonb', existing_nullable=True)
+
+    op.add_column('tasks_history', sa.Column('version', sa.Integer(), nullable=True))
+    op.add_column('tasks_history', sa.Column('is_snapshot', sa.Boolean(), server_default=sa.false(), nullable=False))
+    op.add_column('tasks_activity', sa.Column('history_version', sa.Integer(), server_default='0', nullable=False))
+
+    # Number the existing entries per task; every one of them holds a full snapshot
+    op.execute("""
+        UPDATE tasks_history AS h
+        SET version = numbered.version, is_snapshot = true
+        FROM (
+            SELECT id, row_number() OVER (PARTITION BY task_id ORDER BY id) AS version
+            FROM tasks_history
+        ) AS numbered
+        WHERE h.id = numbered.id
+    """)
+    op.execute("""
+        UPDATE tasks_activity AS t
+        SET history_version = latest.version
+        FROM (SELECT task_id, max(version) AS version FROM tasks_history GROUP BY task_id) AS latest
+        WHERE t.task_id = latest.task_id
+    """)
+
+    op.alter_column('tasks_history', 'version', existing_type=sa.Integer(), nullable=False)
+    op.create_index('ix_tasks_history_task_id_version', 'tasks_history', ['task_id', 'version'], unique=True)
+
+
+def downgrade() -> None:
+    # Delta entries are kept as they are, only their type goes back to text
+    op.drop_index('ix_tasks_history_task_id_version', table_name='tasks_history')
+    op.drop_column('tasks_activity', 'history_version')
+    op.drop_column('tasks_history', 'is_snapshot')
+    op.drop_column('tasks_history', 'version')
+
+    op.alter_column('tasks_history', 'new_data', type_=sa.Text(),
+                    postgresql_using='new_data::text', existing_nullable=True)
+    op.alter_column('tasks_history', 'previous_data', type_=sa.Text(),
+                    postgresql_using='previous_data::text', existing_nullable=True)
@@ -0,0 +1,39 @@
+"""Add indexes for the task history timeline and feed filters
+
+Revision ID: f2c6d8a1b3e7
+Revises: e5b9a7c2d4f8
+Create Date: 2024-09-28 11:06:52.813409
+
+Every index ends with the (created_at, id) keyset used to page through
+history. They are built CONCURRENTLY, outside of the migration transaction.
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2c6d8a1b3e7'
+down_revision: Union[str, None] = 'e5b9a7c2d4f8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+HISTORY_INDEXES = [
+    ('ix_tasks_history_task_id_created_at', ['task_id', 'created_at', 'id']),
+    ('ix_tasks_history_modified_by_created_at', ['modified_by_id', 'created_at', 'id']),
+    ('ix_tasks_history_created_at', ['created_at', 'id']),
+]
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, columns in HISTORY_INDEXES:
+            op.create_index(name, 'tasks_history', columns, unique=False, postgresql_concurrently=True,
+                            if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, _ in reversed(HISTORY_INDEXES):
+            op.drop_index(name, table_name='tasks_history', postgresql_concurrently=True, if_exists=True)
@@ -1,18 +1,21 @@
 import logging
 import os
+from typing import Optional
 
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 
-from .database import get_db
+from .database import get_async_db
 from .models import User
-from .schemas import AccessToken
+from .password_hasher import password_hasher
+from .principal_cache import principal_cache
+from .schemas import AccessToken, UserPrincipal
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -23,16 +26,20 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 logger = logging.getLogger(__name__)
 
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 
+def is_active_user(user) -> bool:
+    # Rows from before is_active had a default hold NULL, they count as active
+    return user.is_active is not False
+
+
 async def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return await password_hasher.verify(plain_password, hashed_password)
 
 
 async def get_password_hash(password):
-    return pwd_context.hash(password)
+    return await password_hasher.hash(password)
 
 
 async def create_access_token(data: dict):
@@ -55,15 +62,20 @@ async def create_access_token(data: dict):
 
 
 # Function to authenticate user by querying the database and verifying the password
-async def authenticate_user_and_create_token(db: Session, username: str, password: str):
+async def authenticate_user_and_create_token(db: AsyncSession, username: str, password: str):
     try:
         # Check if the user exists by querying the database
-        user = db.query(User).filter(User.email == username).first()
+        result = await db.execute(select(User).where(User.email == username))
+        user = result.scalars().first()
+        # Give the connection back to the pool while argon2 runs
+        await db.close()
         if not user or not await verify_password(password, user.hashed_password):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Incorrect username or password",
             )
+        if not is_active_user(user):
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Inactive user")
 
         # create jwt token
         response = await create_access_token(data={"sub": str(user.id)})
@@ -87,21 +99,41 @@ async def authenticate_user_and_create_token(db: Session, username: str, passwor
         )
 
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    """based on the token, get the user from the database"""
+def token_user_id(token: str) -> Optional[int]:
+    """User id of a valid token, from its signature alone: no database and no auth cache involved"""
+    try:
+        return int(jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])["sub"])
+    except (JWTError, KeyError, TypeError, ValueError):
+        return None
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)) -> UserPrincipal:
+    """based on the token, get the user principal from the cache or the database"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
+    user_id = principal_cache.get_token(token)
+    if user_id is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            user_id: str = payload.get("sub")
+            if user_id is None:
+                raise credentials_exception
+            user_id = int(user_id)
+        except (JWTError, ValueError):
+            raise credentials_exception
+        principal_cache.put_token(token, user_id, payload.get("exp"))
+
+    principal = principal_cache.get_principal(user_id)
+    if principal is None:
+        result = await db.execute(select(User).where(User.id == user_id))
+        user = result.scalars().first()
+        if user is None:
             raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    user = db.query(User).filter(User.id == user_id).first()
-    if user is None:
-        raise credentials_exception
-    return user
+        principal = UserPrincipal.from_orm(user)
+        principal_cache.put_principal(principal)
+    if not is_active_user(principal):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Inactive user")
+    return principal
@@ -11,4 +11,8 @@ due_data = 'due_date'
 Modified = 'Modified'
 Added = 'Added'
 
+outbox_pending = 'pending'
+outbox_sent = 'sent'
+outbox_dead = 'dead'
+
 your_jwt_secret_key = 'your_jwt'
\ No newline at end of file
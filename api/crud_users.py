@@ -1,8 +1,9 @@
 import logging
 from fastapi import HTTPException
 from fastapi.responses import JSONResponse
+from sqlalchemy import select
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 
 from .models import User
@@ -18,10 +19,11 @@ class UserImpl:
         pass
 
     # Create user
-    async def create_user(self,db: Session, user_data: UserCreate):
+    async def create_user(self,db: AsyncSession, user_data: UserCreate):
         try:
             # Check if the email already exists in the database
-            existing_user = db.query(User).filter(User.email == user_data.email).first()
+            result = await db.execute(select(User).where(User.email == user_data.email))
+            existing_user = result.scalars().first()
             if existing_user:
                 logger.warning(f"Attempt to create user with existing email: {user_data.email}")
                 raise HTTPException(
@@ -29,6 +31,9 @@ class UserImpl:
                     detail="Email is already registered",
                 )
 
+            # Give the connection back to the pool while argon2 runs
+            await db.close()
+
             # Hash the password
             hashed_password = await get_password_hash(user_data.password)
 
@@ -43,8 +48,7 @@ class UserImpl:
             )
 
             db.add(db_user)
-            db.commit()
-            db.refresh(db_user)
+            await db.commit()
 
             logger.info(f"User created successfully: {db_user.email}")
 
@@ -66,7 +70,7 @@ class UserImpl:
             raise http_exc
 
         except SQLAlchemyError as e:
-            db.rollback()
+            await db.rollback()
             logger.error(f"Database error during user creation: {str(e)}")
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -80,9 +84,10 @@ class UserImpl:
             )
 
     # Get user by ID
-    async def get_user(self,db: Session, user_id: int):
+    async def get_user(self,db: AsyncSession, user_id: int):
         try:
-            user = db.query(User).filter(User.id == user_id).first()
+            result = await db.execute(select(User).where(User.id == user_id))
+            user = result.scalars().first()
 
             if not user:
                 logger.warning(f"User with ID {user_id} not found")
@@ -97,7 +102,7 @@ class UserImpl:
             raise http_exc
 
         except SQLAlchemyError as e:
-            db.rollback()
+            await db.rollback()
             logger.error(f"Database error while fetching user ID {user_id}: {str(e)}")
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -111,9 +116,10 @@ class UserImpl:
             )
 
     # Get all users
-    async def get_users(self,db: Session, skip: int = 0, limit: int = 10):
+    async def get_users(self,db: AsyncSession, skip: int = 0, limit: int = 10):
         try:
-            users = db.query(User).offset(skip).limit(limit).all()
+            result = await db.execute(select(User).offset(skip).limit(limit))
+            users = result.scalars().all()
 
             if not users:
                 logger.info("No users found in the database")
@@ -121,8 +127,12 @@ class UserImpl:
 
             return users
 
+        except HTTPException as http_exc:
+            logger.error(f"HTTP error while fetching users: {str(http_exc.detail)}")
+            raise http_exc
+
         except SQLAlchemyError as e:
-            db.rollback()
+            await db.rollback()
             logger.error(f"Database error while fetching users: {str(e)}")
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
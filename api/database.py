@@ -1,17 +1,141 @@
+import asyncio
+import logging
 import os
+import time
 
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy import create_engine, exc, text
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 DATABASE_URL = os.getenv('DATABASE_URL')
 
-engine = create_engine(DATABASE_URL)
+# asyncpg caches prepared statements per connection; repeated queries skip the parse/plan step
+DB_PREPARED_STATEMENT_CACHE_SIZE = int(os.getenv('DB_PREPARED_STATEMENT_CACHE_SIZE', '500'))
+
+# Connections kept per engine and per worker process, plus the overflow opened under load
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '20'))
+# Seconds a request waits for a free connection before it is answered with a 503
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '3'))
+# Connections older than this (seconds) are replaced, -1 keeps them forever
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+DB_POOL_RETRY_AFTER_SECONDS = int(os.getenv('DB_POOL_RETRY_AFTER_SECONDS', '1'))
+# Connections opened at startup, so the first requests do not pay for the connection setup
+DB_POOL_WARMUP_CONNECTIONS = int(os.getenv('DB_POOL_WARMUP_CONNECTIONS', str(DB_POOL_SIZE)))
+
+# Server side limits of the API connections, 0 disables them
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', '30000'))
+DB_IDLE_IN_TRANSACTION_TIMEOUT_MS = int(os.getenv('DB_IDLE_IN_TRANSACTION_TIMEOUT_MS', '60000'))
+
+
+def to_async_url(url: str) -> str:
+    """Convert a plain postgres DSN to its asyncpg equivalent"""
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+
+class _WaitTimingPoolMixin:
+    """Records how long checkouts wait for a free connection, read by the metrics endpoint"""
+    checkouts = 0
+    timeouts = 0
+    wait_seconds_total = 0.0
+    max_wait_seconds = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+
+class TimedQueuePool(_WaitTimingPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(_WaitTimingPoolMixin, AsyncAdaptedQueuePool):
+    def _do_get(self):
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            # Requests get a 503 from pool_timeout_exception_handler, background callers the plain error
+            logger.warning(f"Database pool exhausted: {self.checkedout()} connections in use, "
+                           f"no connection freed within {DB_POOL_TIMEOUT}s")
+            raise
+
+
+def _server_settings() -> dict:
+    settings = {}
+    if DB_STATEMENT_TIMEOUT_MS:
+        settings["statement_timeout"] = str(DB_STATEMENT_TIMEOUT_MS)
+    if DB_IDLE_IN_TRANSACTION_TIMEOUT_MS:
+        settings["idle_in_transaction_session_timeout"] = str(DB_IDLE_IN_TRANSACTION_TIMEOUT_MS)
+    return settings
+
+
+# asyncpg options of every API engine, the primary and the read replicas
+ASYNC_CONNECT_ARGS = {
+    "prepared_statement_cache_size": DB_PREPARED_STATEMENT_CACHE_SIZE,
+    "server_settings": _server_settings(),
+}
+
+
+POOL_OPTIONS = dict(
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING,
+)
+
+# Synchronous engine, kept for Alembic and offline scripts, without the statement timeouts of the API
+engine = create_engine(DATABASE_URL, poolclass=TimedQueuePool, **POOL_OPTIONS)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
+
+# Async engine used by the API request path
+async_engine = create_async_engine(
+    to_async_url(DATABASE_URL),
+    poolclass=TimedAsyncQueuePool,
+    connect_args=ASYNC_CONNECT_ARGS,
+    **POOL_OPTIONS,
+)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+
+async def warm_pool(async_db_engine, connections: int = DB_POOL_WARMUP_CONNECTIONS) -> int:
+    """Open up to `connections` connections at once and return them to the pool, which keeps them open"""
+    results = await asyncio.gather(
+        *(async_db_engine.connect().start() for _ in range(min(connections, DB_POOL_SIZE))), return_exceptions=True
+    )
+    opened = [result for result in results if not isinstance(result, BaseException)]
+    try:
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        await asyncio.gather(*(conn.execute(text("SELECT 1")) for conn in opened))
+    finally:
+        await asyncio.gather(*(conn.close() for conn in opened))
+    return len(opened)
+
+
+async def disable_statement_timeout(conn):
+    """Lift the statement timeout for the rest of the transaction, for maintenance work on the async engine"""
+    await conn.execute(text("SET LOCAL statement_timeout = 0"))
 
 
 def get_db():
@@ -21,3 +145,9 @@ def get_db():
         yield db  # Pause the execution of the function and return the db connection
     finally:
         db.close()
+
+
+async def get_async_db():
+    """This function is used to get an async database session for the request"""
+    async with AsyncSessionLocal() as db:
+        yield db
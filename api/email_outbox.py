@@ -0,0 +1,308 @@
+import asyncio
+import logging
+import math
+import os
+import smtplib
+import time
+from datetime import datetime, timedelta
+from email.mime.text import MIMEText
+from typing import List, Optional
+
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .constant import outbox_pending, outbox_sent, outbox_dead
+from .database import AsyncSessionLocal
+from .metrics import SMTP_SEND_SECONDS
+from .models import EmailOutbox
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# SMTP settings, point these at a local stand-in (e.g. aiosmtpd) to run offline
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_USE_TLS = os.getenv("SMTP_USE_TLS", "true").lower() == "true"
+SMTP_USERNAME = os.getenv("SMTP_USERNAME")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+SMTP_FROM = os.getenv("SMTP_FROM", SMTP_USERNAME or "")
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "2"))
+SMTP_TIMEOUT_SECONDS = float(os.getenv("SMTP_TIMEOUT_SECONDS", "30"))
+SMTP_IDLE_CHECK_SECONDS = float(os.getenv("SMTP_IDLE_CHECK_SECONDS", "60"))
+
+# Outbox dispatcher settings
+EMAIL_DISPATCHER_ENABLED = os.getenv("EMAIL_DISPATCHER_ENABLED", "true").lower() == "true"
+EMAIL_OUTBOX_BATCH_SIZE = int(os.getenv("EMAIL_OUTBOX_BATCH_SIZE", "50"))
+EMAIL_OUTBOX_POLL_INTERVAL = float(os.getenv("EMAIL_OUTBOX_POLL_INTERVAL", "1.0"))
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.getenv("EMAIL_OUTBOX_MAX_ATTEMPTS", "5"))
+EMAIL_OUTBOX_BACKOFF_SECONDS = float(os.getenv("EMAIL_OUTBOX_BACKOFF_SECONDS", "30"))
+EMAIL_OUTBOX_MAX_BACKOFF_SECONDS = float(os.getenv("EMAIL_OUTBOX_MAX_BACKOFF_SECONDS", "3600"))
+# How long claimed rows stay hidden from other dispatchers while they are sent. Must cover a whole batch
+# (connect and send may each take SMTP_TIMEOUT_SECONDS), otherwise another worker picks the rows up again
+EMAIL_OUTBOX_LEASE_SECONDS = float(os.getenv(
+    "EMAIL_OUTBOX_LEASE_SECONDS",
+    str(2 * SMTP_TIMEOUT_SECONDS * math.ceil(EMAIL_OUTBOX_BATCH_SIZE / max(SMTP_POOL_SIZE, 1)) + 60),
+))
+
+
+def build_task_assigned_email(task_name: str, due_date: Optional[datetime], description: str, assignor: str):
+    """Return the subject and body of the task assignment notification"""
+    due_date_text = due_date.strftime('%Y-%m-%d %H:%M:%S') if due_date else "Not set"
+    body = f"""
+        Hello,
+
+        You have been assigned a new task by: {assignor}
+        Task Name: {task_name}
+        Description: {description}
+        Due Date: {due_date_text}
+
+        Please complete it before the due date.
+
+        Best Regards,
+        Task Management System
+        """
+    return f"New Task Assigned: {task_name}", body
+
+
+def enqueue_email(db: AsyncSession, to_email: str, subject: str, body: str) -> EmailOutbox:
+    """Add an email to the outbox, it is committed together with the caller's transaction"""
+    entry = EmailOutbox(
+        to_email=to_email,
+        subject=subject,
+        body=body,
+        status=outbox_pending,
+        attempts=0,
+        next_attempt_at=datetime.utcnow(),
+        created_at=datetime.utcnow(),
+    )
+    db.add(entry)
+    return entry
+
+
+class SMTPConnectionPool:
+    """Keeps a small set of long-lived SMTP connections and reuses them across batches"""
+
+    def __init__(self, host: str = SMTP_HOST, port: int = SMTP_PORT, username: Optional[str] = SMTP_USERNAME,
+                 password: Optional[str] = SMTP_PASSWORD, use_tls: bool = SMTP_USE_TLS, size: int = SMTP_POOL_SIZE,
+                 timeout: float = SMTP_TIMEOUT_SECONDS, idle_check_seconds: float = SMTP_IDLE_CHECK_SECONDS):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.size = size
+        self.timeout = timeout
+        self.idle_check_seconds = idle_check_seconds
+        self._idle = []  # list of (connection, last_used) tuples
+        self._semaphore = asyncio.Semaphore(size)
+
+    def _connect(self) -> smtplib.SMTP:
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        server.ehlo()  # Identify yourself to the server
+        if self.use_tls:
+            server.starttls()  # Secure the connection
+            server.ehlo()  # Re-identify yourself after starting TLS
+        if self.username and self.password:
+            server.login(self.username, self.password)
+        return server
+
+    @staticmethod
+    def _is_alive(server: smtplib.SMTP) -> bool:
+        try:
+            return server.noop()[0] == 250
+        except smtplib.SMTPException:
+            return False
+        except OSError:
+            return False
+
+    @staticmethod
+    def _quit(server: smtplib.SMTP):
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+    def _acquire_blocking(self) -> smtplib.SMTP:
+        while True:
+            try:
+                server, last_used = self._idle.pop()
+            except IndexError:
+                return self._connect()
+            if time.monotonic() - last_used < self.idle_check_seconds or self._is_alive(server):
+                return server
+            self._quit(server)
+
+    def _send_blocking(self, message: MIMEText):
+        server = self._acquire_blocking()
+        try:
+            try:
+                server.send_message(message)
+            except smtplib.SMTPServerDisconnected:
+                # The server dropped an idle connection, reconnect once and retry
+                server.close()
+                server = self._connect()
+                server.send_message(message)
+        except (smtplib.SMTPException, OSError):
+            self._quit(server)
+            raise
+        self._idle.append((server, time.monotonic()))
+
+    async def send(self, message: MIMEText):
+        async with self._semaphore:
+            started = time.perf_counter()
+            outcome = "failed"
+            try:
+                await asyncio.to_thread(self._send_blocking, message)
+                outcome = "sent"
+            finally:
+                SMTP_SEND_SECONDS.labels(outcome).observe(time.perf_counter() - started)
+
+    async def send_many(self, messages: List[MIMEText]) -> List[Optional[str]]:
+        """Send messages concurrently over the pool, returning an error string (or None) per message"""
+        results = await asyncio.gather(*(self.send(message) for message in messages), return_exceptions=True)
+        return [str(result) if isinstance(result, Exception) else None for result in results]
+
+    async def close(self):
+        while self._idle:
+            server, _ = self._idle.pop()
+            await asyncio.to_thread(self._quit, server)
+
+
+class EmailOutboxDispatcher:
+    """Background task that drains the email outbox in batches with retries and a dead-letter state"""
+
+    def __init__(self, session_factory=AsyncSessionLocal, pool: Optional[SMTPConnectionPool] = None,
+                 batch_size: int = EMAIL_OUTBOX_BATCH_SIZE, poll_interval: float = EMAIL_OUTBOX_POLL_INTERVAL,
+                 max_attempts: int = EMAIL_OUTBOX_MAX_ATTEMPTS, backoff_seconds: float = EMAIL_OUTBOX_BACKOFF_SECONDS,
+                 max_backoff_seconds: float = EMAIL_OUTBOX_MAX_BACKOFF_SECONDS,
+                 lease_seconds: float = EMAIL_OUTBOX_LEASE_SECONDS):
+        self.session_factory = session_factory
+        self.pool = pool or SMTPConnectionPool()
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.lease_seconds = lease_seconds
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+
+    def _backoff(self, attempts: int) -> timedelta:
+        delay = min(self.backoff_seconds * (2 ** (attempts - 1)), self.max_backoff_seconds)
+        return timedelta(seconds=delay)
+
+    @staticmethod
+    def _build_message(entry: EmailOutbox) -> MIMEText:
+        msg = MIMEText(entry.body)
+        msg['Subject'] = entry.subject
+        msg['From'] = SMTP_FROM
+        msg['To'] = entry.to_email
+        return msg
+
+    async def _claim(self) -> List[EmailOutbox]:
+        """Lease a batch of due rows in a short transaction, so no lock is held while sending"""
+        now = datetime.utcnow()
+        lease_until = now + timedelta(seconds=self.lease_seconds)
+        async with self.session_factory() as db:
+            # SKIP LOCKED lets several workers claim at once without picking the same row; the pushed back
+            # next_attempt_at hides the row from them until the lease runs out (e.g. the worker died mid-send)
+            due = (
+                select(EmailOutbox.id)
+                .where(EmailOutbox.status == outbox_pending, EmailOutbox.next_attempt_at <= now)
+                .order_by(EmailOutbox.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            result = await db.execute(
+                update(EmailOutbox)
+                .where(EmailOutbox.id.in_(due.scalar_subquery()))
+                .values(next_attempt_at=lease_until)
+                .returning(EmailOutbox)
+                .execution_options(synchronize_session=False)
+            )
+            entries = sorted(result.scalars().all(), key=lambda entry: entry.id)
+            await db.commit()
+        return entries
+
+    async def _record(self, entries: List[EmailOutbox], errors: List[Optional[str]]):
+        """Store the outcome of each send, skipping rows whose lease ran out and were claimed again"""
+        now = datetime.utcnow()
+        outcomes = []
+        for entry, error in zip(entries, errors):
+            attempts = entry.attempts + 1
+            # Every row carries all columns so the batch runs as one executemany; unchanged ones keep their value
+            outcome = {"b_id": entry.id, "b_lease": entry.next_attempt_at, "b_attempts": attempts,
+                       "b_status": outbox_pending, "b_sent_at": None, "b_last_error": error,
+                       "b_next_attempt_at": entry.next_attempt_at}
+            if error is None:
+                outcome.update(b_status=outbox_sent, b_sent_at=now)
+            elif attempts >= self.max_attempts:
+                outcome.update(b_status=outbox_dead)
+                logger.error(f"Email {entry.id} to {entry.to_email} moved to dead letter: {error}")
+            else:
+                outcome.update(b_next_attempt_at=now + self._backoff(attempts))
+                logger.warning(f"Email {entry.id} failed (attempt {attempts}), retrying: {error}")
+            outcomes.append(outcome)
+
+        table = EmailOutbox.__table__
+        async with self.session_factory() as db:
+            # The lease deadline identifies this claim
+            await db.execute(
+                table.update()
+                .where(table.c.id == bindparam("b_id"), table.c.status == outbox_pending,
+                       table.c.next_attempt_at == bindparam("b_lease"))
+                .values(attempts=bindparam("b_attempts"), status=bindparam("b_status"),
+                        sent_at=bindparam("b_sent_at"), last_error=bindparam("b_last_error"),
+                        next_attempt_at=bindparam("b_next_attempt_at")),
+                outcomes,
+            )
+            await db.commit()
+
+    async def dispatch_batch(self) -> int:
+        """Send one batch of due emails, returns the number of outbox rows processed"""
+        entries = await self._claim()
+        if not entries:
+            return 0
+
+        # Outside any transaction: a slow SMTP server holds neither a pooled connection nor row locks
+        errors = await self.pool.send_many([self._build_message(entry) for entry in entries])
+
+        await self._record(entries, errors)
+
+        sent = sum(1 for error in errors if error is None)
+        logger.info(f"Email outbox batch processed: {sent} sent, {len(entries) - sent} failed")
+        return len(entries)
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                processed = await self.dispatch_batch()
+            except Exception as e:
+                logger.error(f"Unexpected error in email outbox dispatcher: {str(e)}")
+                processed = 0
+
+            # Keep draining while batches come back full, otherwise wait for the next poll
+            if processed < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def start(self):
+        if self._task is None:
+            self._stopping = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+            logger.info("Email outbox dispatcher started")
+
+    async def stop(self):
+        if self._task is not None:
+            self._stopping.set()
+            await self._task
+            self._task = None
+        await self.pool.close()
+        logger.info("Email outbox dispatcher stopped")
+
+
+email_dispatcher = EmailOutboxDispatcher()
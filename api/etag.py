@@ -0,0 +1,51 @@
+import hashlib
+from datetime import datetime
+from typing import Iterable, Optional
+
+from fastapi import HTTPException, Response, status
+
+
+def task_etag(task_id: int, modified_on: datetime) -> str:
+    """Strong validator of one task, it changes whenever the task is modified"""
+    return f'"{hashlib.sha1(f"{task_id}:{modified_on.isoformat()}".encode()).hexdigest()}"'
+
+
+def list_etag(tasks: Iterable) -> str:
+    """Validator of a list page, from the task_id and modified_on of every task on it in order"""
+    digest = hashlib.sha1()
+    for task in tasks:
+        digest.update(f"{task.task_id}:{task.modified_on.isoformat()};".encode())
+    return f'"{digest.hexdigest()}"'
+
+
+def _header_tags(header: str) -> list:
+    return [tag.strip() for tag in header.split(",") if tag.strip()]
+
+
+def if_none_match(header: Optional[str], etag: str) -> bool:
+    """True when the client already holds this version; If-None-Match uses the weak comparison"""
+    if not header:
+        return False
+    tags = _header_tags(header)
+    return "*" in tags or etag in [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+
+
+def if_match(header: Optional[str], etag: str) -> bool:
+    """True when the precondition holds; If-Match uses the strong comparison, weak tags never match"""
+    if header is None:
+        return True
+    tags = _header_tags(header)
+    return "*" in tags or etag in tags
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+
+def check_if_match(header: Optional[str], etag: str):
+    if not if_match(header, etag):
+        raise HTTPException(
+            status_code=status.HTTP_412_PRECONDITION_FAILED,
+            detail="The task was modified since it was read, fetch it again before updating",
+            headers={"ETag": etag},
+        )
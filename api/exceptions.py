@@ -1,10 +1,11 @@
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import HTTPException, Request
 from fastapi.responses import JSONResponse
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.exc import SQLAlchemyError, TimeoutError as PoolTimeoutError
 import logging
 from pydantic import BaseModel
 
-app = FastAPI()
+from .database import DB_POOL_RETRY_AFTER_SECONDS
+
 logger = logging.getLogger(__name__)
 
 
@@ -12,25 +13,50 @@ class ErrorResponse(BaseModel):
     detail: str
 
 
-@app.exception_handler(SQLAlchemyError)
-async def sqlalchemy_exception_handler(exc: SQLAlchemyError):
-    logger.error(f"Database error occurred: {str(exc)}")
+async def sqlalchemy_exception_handler(request: Request, exc: SQLAlchemyError):
+    logger.error(f"Database error occurred on {request.method} {request.url.path}: {str(exc)}")
     return JSONResponse(
         status_code=500,
         content=ErrorResponse(detail="An error occurred while interacting with the database").dict()
     )
 
 
-@app.exception_handler(HTTPException)
-async def http_exception_handler( exc: HTTPException):
+async def pool_timeout_exception_handler(request: Request, exc: PoolTimeoutError):
+    # No free connection within DB_POOL_TIMEOUT; answer right away instead of letting requests pile up
+    return JSONResponse(
+        status_code=503,
+        content=ErrorResponse(detail="The database is busy, please retry shortly").dict(),
+        headers={"Retry-After": str(DB_POOL_RETRY_AFTER_SECONDS)}
+    )
+
+
+def _pool_timeout_cause(exc: BaseException):
+    # The services turn unexpected errors into a 500 HTTPException inside their except blocks,
+    # so a pool timeout that reached one of them is still on the exception chain
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        if isinstance(exc, PoolTimeoutError):
+            return exc
+        seen.add(id(exc))
+        exc = exc.__cause__ or exc.__context__
+    return None
+
+
+async def http_exception_handler(request: Request, exc: HTTPException):
+    if exc.status_code >= 500:
+        pool_timeout = _pool_timeout_cause(exc)
+        if pool_timeout is not None:
+            return await pool_timeout_exception_handler(request, pool_timeout)
+    # Keep headers such as Retry-After and WWW-Authenticate
     return JSONResponse(
         status_code=exc.status_code,
-        content=ErrorResponse(detail=exc.detail).dict()
+        content={"detail": exc.detail},
+        headers=getattr(exc, "headers", None)
     )
 
 
-@app.exception_handler(Exception)
-async def general_exception_handler():
+async def general_exception_handler(request: Request, exc: Exception):
+    logger.exception(f"Unexpected error on {request.method} {request.url.path}: {str(exc)}")
     return JSONResponse(
         status_code=500,
         content=ErrorResponse(detail="An unexpected error occurred").dict()
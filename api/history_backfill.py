@@ -0,0 +1,127 @@
+"""Rewrite full-snapshot task history entries as deltas.
+
+    python -m api.history_backfill [--batch-size 500] [--dry-run]
+
+Entries written before history was delta encoded hold the whole task in
+new_data. Tasks are processed in batches, each in its own transaction: every
+entry is replayed in version order, and the entries that do not fall on a
+snapshot interval keep only the fields they changed. The storage used by the
+history columns is reported before and after; the table itself only shrinks
+once it is vacuumed.
+"""
+import argparse
+import json
+import logging
+
+from sqlalchemy import select, text, update
+
+from .database import SessionLocal
+from .models import TaskHistory
+from .task_history_service import apply_history_entry
+from .task_service import HISTORY_SNAPSHOT_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+def storage_report(db) -> dict:
+    row = db.execute(text("""
+        SELECT count(*) AS entries,
+               coalesce(sum(pg_column_size(previous_data)), 0) AS previous_data_bytes,
+               coalesce(sum(pg_column_size(new_data)), 0) AS new_data_bytes,
+               pg_total_relation_size('tasks_history') AS table_bytes
+        FROM tasks_history
+    """)).mappings().one()
+    return dict(row)
+
+
+def _history_bytes(report: dict) -> int:
+    return report["previous_data_bytes"] + report["new_data_bytes"]
+
+
+def _legacy_snapshots():
+    # Snapshots written by the API only ever fall on the interval, any other snapshot is a legacy full entry
+    return (TaskHistory.is_snapshot.is_(True)) & ((TaskHistory.version - 1) % HISTORY_SNAPSHOT_INTERVAL != 0)
+
+
+def _delta_updates(entries) -> list:
+    """Replay one task's entries and return the delta form of its legacy snapshots"""
+    updates = []
+    state = {}
+    for entry in entries:
+        previous_state = state
+        state = apply_history_entry(state, entry.new_data, entry.is_snapshot)
+        if entry.is_snapshot and (entry.version - 1) % HISTORY_SNAPSHOT_INTERVAL != 0:
+            changed = {key: value for key, value in state.items() if previous_state.get(key) != value}
+            updates.append({
+                "id": entry.id,
+                "created_at": entry.created_at,
+                "previous_data": {key: previous_state.get(key) for key in changed},
+                "new_data": changed,
+                "is_snapshot": False,
+            })
+    return updates
+
+
+def backfill(batch_size: int = 500, dry_run: bool = False) -> dict:
+    converted = 0
+    batches = 0
+    last_task_id = 0
+    with SessionLocal() as db:
+        before = storage_report(db)
+
+        while True:
+            task_ids = db.execute(
+                select(TaskHistory.task_id).where(_legacy_snapshots(), TaskHistory.task_id > last_task_id)
+                .group_by(TaskHistory.task_id).order_by(TaskHistory.task_id).limit(batch_size)
+            ).scalars().all()
+            if not task_ids:
+                break
+            last_task_id = task_ids[-1]
+
+            entries = db.execute(
+                select(TaskHistory.id, TaskHistory.created_at, TaskHistory.task_id, TaskHistory.version,
+                       TaskHistory.is_snapshot, TaskHistory.new_data)
+                .where(TaskHistory.task_id.in_(task_ids))
+                .order_by(TaskHistory.task_id, TaskHistory.version)
+            ).all()
+
+            entries_by_task = {}
+            for entry in entries:
+                entries_by_task.setdefault(entry.task_id, []).append(entry)
+
+            updates = []
+            for task_entries in entries_by_task.values():
+                updates.extend(_delta_updates(task_entries))
+
+            if updates and not dry_run:
+                db.execute(update(TaskHistory), updates)
+                db.commit()
+            else:
+                db.rollback()
+
+            converted += len(updates)
+            batches += 1
+            logger.info(f"History backfill batch {batches}: {len(updates)} entries of {len(task_ids)} tasks")
+
+        after = storage_report(db)
+
+    saved = _history_bytes(before) - _history_bytes(after)
+    return {
+        "dry_run": dry_run,
+        "batches": batches,
+        "converted_entries": converted,
+        "before": before,
+        "after": after,
+        "saved_bytes": saved,
+        "saved_percent": round(100 * saved / _history_bytes(before), 1) if _history_bytes(before) else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=500, help="tasks per transaction")
+    parser.add_argument("--dry-run", action="store_true", help="report what would be converted without writing")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    print(json.dumps(backfill(batch_size=args.batch_size, dry_run=args.dry_run), indent=2))
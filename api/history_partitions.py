@@ -0,0 +1,207 @@
+"""Monthly partitions of tasks_history: creation ahead of time, retention and archiving.
+
+    python -m api.history_partitions ensure [--months-ahead 3]
+    python -m api.history_partitions archive [--retention-months 24] [--archive-dir history_archive] [--dry-run]
+
+`ensure` creates the partitions for the current month and the next ones, and
+moves rows that landed in the default partition into their month's; run it
+from cron, the API only does it on startup with
+HISTORY_PARTITIONS_ON_STARTUP=true. `archive` copies every partition that ended
+before the retention window to a gzipped CSV file, then detaches and drops it.
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import os
+from datetime import date, datetime
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from .database import async_engine, disable_statement_timeout
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+HISTORY_TABLE = "tasks_history"
+HISTORY_DEFAULT_PARTITION = "tasks_history_default"
+HISTORY_PARTITION_MONTHS_AHEAD = int(os.getenv("HISTORY_PARTITION_MONTHS_AHEAD", "3"))
+HISTORY_RETENTION_MONTHS = int(os.getenv("HISTORY_RETENTION_MONTHS", "24"))
+HISTORY_ARCHIVE_DIR = os.getenv("HISTORY_ARCHIVE_DIR", "history_archive")
+
+
+def month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(value: date, months: int) -> date:
+    month = value.month - 1 + months
+    return date(value.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{HISTORY_TABLE}_y{month.year:04d}m{month.month:02d}"
+
+
+async def _stranded_months(conn) -> List[date]:
+    """Months with rows in the default partition, left there while their partition did not exist yet"""
+    result = await conn.execute(text(
+        f"SELECT DISTINCT date_trunc('month', created_at)::date FROM {HISTORY_DEFAULT_PARTITION}"
+    ))
+    return list(result.scalars())
+
+
+async def _create_partition(conn, month: date, move_from_default: bool):
+    name = partition_name(month)
+    bounds = f"FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    if not move_from_default:
+        await conn.execute(text(f"CREATE TABLE {name} PARTITION OF {HISTORY_TABLE} FOR VALUES {bounds}"))
+        return
+
+    # Postgres refuses a new partition while the default one holds rows of its range: detach the default,
+    # create the month, move its rows over and attach the default again, all in the caller's transaction
+    rows_of_month = f"created_at >= '{month.isoformat()}' AND created_at < '{add_months(month, 1).isoformat()}'"
+    await conn.execute(text(f"ALTER TABLE {HISTORY_TABLE} DETACH PARTITION {HISTORY_DEFAULT_PARTITION}"))
+    await conn.execute(text(f"CREATE TABLE {name} PARTITION OF {HISTORY_TABLE} FOR VALUES {bounds}"))
+    moved = await conn.execute(text(
+        f"INSERT INTO {name} SELECT * FROM {HISTORY_DEFAULT_PARTITION} WHERE {rows_of_month}"
+    ))
+    await conn.execute(text(f"DELETE FROM {HISTORY_DEFAULT_PARTITION} WHERE {rows_of_month}"))
+    await conn.execute(text(f"ALTER TABLE {HISTORY_TABLE} ATTACH PARTITION {HISTORY_DEFAULT_PARTITION} DEFAULT"))
+    logger.warning(f"Moved {moved.rowcount} task history rows from {HISTORY_DEFAULT_PARTITION} to {name}")
+
+
+async def ensure_partitions(engine: AsyncEngine = async_engine, months_ahead: int = HISTORY_PARTITION_MONTHS_AHEAD,
+                            start: Optional[date] = None) -> List[str]:
+    """Create the monthly partitions from `start` (the current month by default) up to `months_ahead` later.
+
+    Months whose rows ended up in the default partition, because this did not run in time, get their
+    partition too and the rows are moved into it. Raises once the other partitions are created if one of
+    them could not be.
+    """
+    first = month_start(start or datetime.utcnow().date())
+    created = []
+    failed = []
+    async with engine.begin() as conn:
+        # Rows outside of every monthly range land here instead of failing the insert
+        await conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {HISTORY_DEFAULT_PARTITION} PARTITION OF {HISTORY_TABLE} DEFAULT"
+        ))
+        stranded = set(await _stranded_months(conn))
+        if stranded:
+            # Moving a month of rows may take longer than any API statement may run
+            await disable_statement_timeout(conn)
+        months = sorted(stranded | {add_months(first, offset) for offset in range(months_ahead + 1)})
+        for month in months:
+            name = partition_name(month)
+            exists = await conn.scalar(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name})
+            if exists:
+                continue
+            try:
+                async with conn.begin_nested():
+                    await _create_partition(conn, month, month in stranded)
+                created.append(name)
+            except DBAPIError as e:
+                logger.error(f"Could not create task history partition {name}: {str(e)}")
+                failed.append(name)
+    if created:
+        logger.info(f"Created task history partitions: {', '.join(created)}")
+    if failed:
+        raise RuntimeError(f"Could not create task history partitions: {', '.join(failed)}")
+    return created
+
+
+async def list_partitions(engine: AsyncEngine = async_engine) -> List[dict]:
+    """Monthly partitions of the history table with the month they hold, oldest first"""
+    async with engine.connect() as conn:
+        result = await conn.execute(text("""
+            SELECT child.relname AS name
+            FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = :table AND child.relname <> :default
+            ORDER BY child.relname
+        """), {"table": HISTORY_TABLE, "default": HISTORY_DEFAULT_PARTITION})
+        names = result.scalars().all()
+
+    partitions = []
+    prefix = f"{HISTORY_TABLE}_y"
+    for name in names:
+        # Names follow partition_name, e.g. tasks_history_y2024m09
+        if not name.startswith(prefix):
+            continue
+        year, month = name[len(prefix):].split("m")
+        partitions.append({"name": name, "month": date(int(year), int(month), 1)})
+    return partitions
+
+
+async def _copy_to_archive(engine: AsyncEngine, name: str, path: str) -> int:
+    """Stream a partition to a gzipped CSV file with COPY, returning the number of bytes written"""
+    async with engine.connect() as conn:
+        # Large partitions take longer to copy than any API statement may run
+        await disable_statement_timeout(conn)
+        raw = await conn.get_raw_connection()
+        with gzip.open(path, "wb") as archive:
+            async def write(chunk: bytes):
+                archive.write(chunk)
+
+            await raw.driver_connection.copy_from_table(name, output=write, format="csv", header=True)
+    return os.path.getsize(path)
+
+
+async def archive_partitions(engine: AsyncEngine = async_engine, retention_months: int = HISTORY_RETENTION_MONTHS,
+                             archive_dir: str = HISTORY_ARCHIVE_DIR, dry_run: bool = False) -> List[dict]:
+    """Archive and drop the partitions whose month ended before the retention window"""
+    cutoff = add_months(month_start(datetime.utcnow().date()), -retention_months)
+    expired = [partition for partition in await list_partitions(engine) if add_months(partition["month"], 1) <= cutoff]
+
+    archived = []
+    if not dry_run:
+        os.makedirs(archive_dir, exist_ok=True)
+    for partition in expired:
+        name = partition["name"]
+        path = os.path.join(archive_dir, f"{name}.csv.gz")
+        if dry_run:
+            archived.append({"partition": name, "archive": path})
+            continue
+
+        # Copy first, the partition is only dropped once its archive is on disk
+        size = await _copy_to_archive(engine, name, path)
+        async with engine.begin() as conn:
+            await conn.execute(text(f"ALTER TABLE {HISTORY_TABLE} DETACH PARTITION {name}"))
+            await conn.execute(text(f"DROP TABLE {name}"))
+        logger.info(f"Archived task history partition {name} to {path} ({size} bytes)")
+        archived.append({"partition": name, "archive": path, "bytes": size})
+    return archived
+
+
+async def _main(args):
+    try:
+        if args.command == "ensure":
+            result = await ensure_partitions(months_ahead=args.months_ahead)
+        else:
+            result = await archive_partitions(retention_months=args.retention_months, archive_dir=args.archive_dir,
+                                              dry_run=args.dry_run)
+        print(json.dumps(result, indent=2))
+    finally:
+        await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    ensure_parser = subparsers.add_parser("ensure", help="create the upcoming monthly partitions")
+    ensure_parser.add_argument("--months-ahead", type=int, default=HISTORY_PARTITION_MONTHS_AHEAD)
+    archive_parser = subparsers.add_parser("archive", help="archive and drop partitions past the retention window")
+    archive_parser.add_argument("--retention-months", type=int, default=HISTORY_RETENTION_MONTHS)
+    archive_parser.add_argument("--archive-dir", default=HISTORY_ARCHIVE_DIR)
+    archive_parser.add_argument("--dry-run", action="store_true", help="list the partitions that would be archived")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(_main(parser.parse_args()))
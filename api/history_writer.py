@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import os
+import time
+from typing import List, Optional
+
+from sqlalchemy import event, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .database import AsyncSessionLocal
+from .models import TaskHistory
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# sync: history is inserted in the task's own transaction (durable, the default)
+# async: history is queued once the task commits and written in batches (best effort, flushed on shutdown)
+HISTORY_WRITE_MODE = os.getenv("HISTORY_WRITE_MODE", "sync").lower()
+HISTORY_WRITER_BATCH_SIZE = int(os.getenv("HISTORY_WRITER_BATCH_SIZE", "500"))
+HISTORY_WRITER_FLUSH_INTERVAL = float(os.getenv("HISTORY_WRITER_FLUSH_INTERVAL", "0.2"))
+HISTORY_WRITER_MAX_QUEUE = int(os.getenv("HISTORY_WRITER_MAX_QUEUE", "100000"))
+
+# Session.info key holding the rows of the current transaction until it commits
+PENDING_HISTORY_KEY = "pending_task_history"
+
+_STOP = object()
+
+
+class HistoryWriter:
+    """Writes task history rows, either in the caller's transaction or batched from an in-process queue"""
+
+    def __init__(self, mode: str = HISTORY_WRITE_MODE, batch_size: int = HISTORY_WRITER_BATCH_SIZE,
+                 flush_interval: float = HISTORY_WRITER_FLUSH_INTERVAL, max_queue: int = HISTORY_WRITER_MAX_QUEUE):
+        self.mode = mode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.flushes = 0
+        self.flush_seconds_total = 0.0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+
+    @property
+    def is_async(self) -> bool:
+        # Until the background task runs (scripts, or before startup) history is written synchronously
+        return self.mode == "async" and self._task is not None
+
+    async def write(self, db: AsyncSession, rows: List[dict]):
+        """Record history rows for the caller's transaction"""
+        if not rows:
+            return
+        if not self.is_async:
+            # One multi-row INSERT in the same transaction as the task change
+            await db.execute(insert(TaskHistory), rows)
+            return
+        # Held on the session and only queued once the transaction commits, a rollback discards them
+        db.sync_session.info.setdefault(PENDING_HISTORY_KEY, []).extend(rows)
+
+    def _enqueue(self, rows: List[dict]):
+        dropped = 0
+        for row in rows:
+            try:
+                self._queue.put_nowait(row)
+                self.enqueued += 1
+            except asyncio.QueueFull:
+                dropped += 1
+        if dropped:
+            self.dropped += dropped
+            logger.warning(f"History writer queue is full, dropped {dropped} entries ({self.dropped} so far)")
+
+    async def _insert(self, rows: List[dict]):
+        async with AsyncSessionLocal() as db:
+            await db.execute(insert(TaskHistory), rows)
+            await db.commit()
+
+    async def _flush(self, rows: List[dict]):
+        started = time.perf_counter()
+        try:
+            await self._insert(rows)
+            self.written += len(rows)
+        except IntegrityError:
+            # Usually a task deleted before its history was flushed; keep the rest of the batch
+            for row in rows:
+                try:
+                    await self._insert([row])
+                    self.written += 1
+                except IntegrityError as e:
+                    self.failed += 1
+                    logger.warning(f"Dropped history entry of task {row.get('task_id')}: {str(e)}")
+        except Exception as e:
+            self.failed += len(rows)
+            logger.error(f"Failed to write {len(rows)} history entries: {str(e)}")
+        finally:
+            elapsed = time.perf_counter() - started
+            self.flushes += 1
+            self.last_flush_seconds = elapsed
+            self.flush_seconds_total += elapsed
+            self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+
+            # Flush once the batch is full or the interval since its first row has passed
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+
+    async def start(self):
+        if self.mode == "async" and self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"History writer started in async mode (batch {self.batch_size}, "
+                        f"interval {self.flush_interval}s)")
+
+    async def stop(self):
+        """Flush everything still queued, then stop"""
+        if self._task is not None:
+            # Rows queued before the marker are flushed first, wait even when the queue is full
+            await self._queue.put(_STOP)
+            await self._task
+            self._task = None
+            logger.info(f"History writer stopped, {self.written} entries written, {self.failed} failed")
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode if self.is_async else "sync",
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "flushes": self.flushes,
+            "last_flush_seconds": self.last_flush_seconds,
+            "avg_flush_seconds": self.flush_seconds_total / self.flushes if self.flushes else 0.0,
+            "max_flush_seconds": self.max_flush_seconds,
+        }
+
+
+history_writer = HistoryWriter()
+
+
+@event.listens_for(Session, "after_commit")
+def _queue_committed_history(session: Session):
+    rows = session.info.pop(PENDING_HISTORY_KEY, None)
+    if not rows:
+        return
+    if history_writer.is_async:
+        history_writer._enqueue(rows)
+    else:
+        # The writer stopped between the write and the commit
+        history_writer.dropped += len(rows)
+        logger.warning(f"History writer is stopped, dropped {len(rows)} entries")
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_rolled_back_history(session: Session, previous_transaction):
+    session.info.pop(PENDING_HISTORY_KEY, None)
@@ -1,54 +1,168 @@
-from http.client import HTTPException
+"""Application factory.
+
+Importing this module builds the app and nothing else: no database access,
+no DDL (the schema is managed by Alembic) and no logging setup. Everything
+with side effects runs in the lifespan when a server starts the app:
+
+    uvicorn api.main:app
+    uvicorn api.main:create_app --factory
+"""
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
 from logging.handlers import RotatingFileHandler
 
-import uvicorn
-from fastapi import FastAPI
-from fastapi.exception_handlers import http_exception_handler
-from sqlalchemy.exc import SQLAlchemyError
+from fastapi import FastAPI, HTTPException
+from sqlalchemy.exc import SQLAlchemyError, TimeoutError as PoolTimeoutError
 from starlette.middleware.cors import CORSMiddleware
 
-from api.exceptions import sqlalchemy_exception_handler, general_exception_handler
-from api.routers import tasks, users, task_history, auth
-from api.database import Base, engine
+from api.exceptions import sqlalchemy_exception_handler, pool_timeout_exception_handler, http_exception_handler, \
+    general_exception_handler
+from api.routers import tasks, users, task_history, auth, health
+from api.database import AsyncSessionLocal, async_engine, warm_pool
+from api.email_outbox import email_dispatcher, EMAIL_DISPATCHER_ENABLED
+from api.password_hasher import password_hasher
+from api.principal_cache import principal_cache
+from api.reference_cache import reference_cache
+from api.history_partitions import ensure_partitions
+from api.history_writer import history_writer
+from api.metrics import MetricsMiddleware, metrics_endpoint
+from api.query_tracker import QueryTrackingMiddleware
+from api.replicas import ReadYourWritesMiddleware, replica_set
+from dotenv import load_dotenv
 
-import logging
-
-# Configure logging
-handler = RotatingFileHandler('app.log', maxBytes=20000000, backupCount=5)
-logging.basicConfig(
-    handlers=[handler],  # File handler
-    level=logging.INFO,  # Log level
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',  # Log format
-    datefmt='%Y-%m-%d %H:%M:%S',  # Date format
-)
+load_dotenv()
 
-# Initialize logger
 logger = logging.getLogger(__name__)
 
+# Empty to log to stderr only
+APP_LOG_FILE = os.getenv("APP_LOG_FILE", "app.log")
+# Partitions are DDL and lock tasks_history, so they are left to the scheduled
+# `python -m api.history_partitions ensure`; turn on for single-instance setups without that job
+HISTORY_PARTITIONS_ON_STARTUP = os.getenv("HISTORY_PARTITIONS_ON_STARTUP", "false").lower() == "true"
+
+
+def configure_logging():
+    handler = RotatingFileHandler(APP_LOG_FILE, maxBytes=20000000, backupCount=5) if APP_LOG_FILE \
+        else logging.StreamHandler()
+    logging.basicConfig(
+        handlers=[handler],
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+    )
+
+
+async def warm_up() -> dict:
+    """Open the pooled connections and fill the caches, so the first requests run at full speed"""
+    timings = {}
+
+    async def step(name: str, coroutine):
+        started = time.perf_counter()
+        try:
+            result = await coroutine
+        except Exception as e:
+            # A cold cache only costs speed, the app still starts and fills it on demand
+            logger.warning(f"Warm-up step {name} failed: {str(e)}")
+            result = None
+        timings[name] = {"seconds": round(time.perf_counter() - started, 3), "result": result}
+
+    async def load_reference_data():
+        async with AsyncSessionLocal() as db:
+            await reference_cache.load_all(db)
+        return reference_cache.stats()["sizes"]
+
+    async def load_principals():
+        async with AsyncSessionLocal() as db:
+            return await principal_cache.warm(db)
+
+    await step("db_pool", warm_pool(async_engine))
+    for replica in replica_set.replicas:
+        if replica.healthy:
+            await step(f"{replica.name}_pool", warm_pool(replica.engine))
+    if HISTORY_PARTITIONS_ON_STARTUP:
+        await step("history_partitions", ensure_partitions())
+    await step("reference_cache", load_reference_data())
+    await step("auth_cache", load_principals())
+    await step("password_hasher", password_hasher.start())
+    return timings
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    configure_logging()
+    app.state.ready = False
+
+    # Replica health is known before their pools are warmed
+    await replica_set.start()
+    app.state.warmup = await warm_up()
+
+    # Only starts a background task when HISTORY_WRITE_MODE=async
+    await history_writer.start()
+    # Drain the email outbox in the background instead of sending inline in the request
+    if EMAIL_DISPATCHER_ENABLED:
+        await email_dispatcher.start()
+
+    app.state.ready = True
+    logger.info(f"Application ready in {time.perf_counter() - started:.2f}s")
+    try:
+        yield
+    finally:
+        app.state.ready = False
+        await email_dispatcher.stop()
+        # Flush the queued history entries before the process exits
+        await history_writer.stop()
+        await replica_set.stop()
+        await password_hasher.shutdown()
+        await async_engine.dispose()
+
+
+def create_app() -> FastAPI:
+    app = FastAPI(lifespan=lifespan)
+    app.state.ready = False
+    app.state.warmup = {}
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],  # Adjust to the domain you're accessing from
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    # Reads of a user go to the primary for a moment after their writes, see api/replicas.py
+    app.add_middleware(ReadYourWritesMiddleware)
+
+    # Statement count, DB time and the Server-Timing header of every request
+    app.add_middleware(QueryTrackingMiddleware)
+
+    # Outermost, so the latency covers the whole request
+    app.add_middleware(MetricsMiddleware)
 
-# Create all database tables
-Base.metadata.create_all(bind=engine)
+    # Prometheus scrape endpoint
+    app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
 
-app = FastAPI()
+    # Include all routers
+    app.include_router(tasks.router, prefix="/api/v1")
+    app.include_router(users.router, prefix="/api/v1")
+    app.include_router(task_history.router, prefix="/api/v1")
+    app.include_router(auth.router, prefix="/api/v1")
+    app.include_router(health.router)
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Adjust to the domain you're accessing from
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+    # Register custom exception handlers
+    app.add_exception_handler(SQLAlchemyError, sqlalchemy_exception_handler)
+    # More specific than SQLAlchemyError, so pool checkout timeouts get this one
+    app.add_exception_handler(PoolTimeoutError, pool_timeout_exception_handler)
+    app.add_exception_handler(HTTPException, http_exception_handler)
+    app.add_exception_handler(Exception, general_exception_handler)
+    return app
 
-# Include all routers
-app.include_router(tasks.router, prefix="/api/v1")
-app.include_router(users.router, prefix="/api/v1")
-app.include_router(task_history.router, prefix="/api/v1")
-app.include_router(auth.router, prefix="/api/v1")
 
-# Register custom exception handlers
-app.add_exception_handler(SQLAlchemyError, sqlalchemy_exception_handler)
-app.add_exception_handler(HTTPException, http_exception_handler)
-app.add_exception_handler(Exception, general_exception_handler)
+app = create_app()
 
 if __name__ == "__main__":
+    # Imported here, serving through `uvicorn api.main:app` does not need it loaded twice
+    import uvicorn
     uvicorn.run("api.main:app", host="127.0.0.1", port=8000, reload=True)
@@ -0,0 +1,181 @@
+"""Prometheus metrics, served at /metrics.
+
+Request latency and status counts come from MetricsMiddleware, labelled with
+the route template rather than the raw path, and the statements each request
+ran from the tracker of api.query_tracker. Pool, cache and background worker figures are read from their owners when
+the endpoint is scraped.
+"""
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from starlette.requests import Request
+from starlette.responses import Response
+
+from .database import DB_MAX_OVERFLOW, async_engine, engine
+from .history_writer import history_writer
+from .password_hasher import password_hasher
+from .principal_cache import principal_cache
+from .query_cache import query_cache
+from .query_tracker import statement_totals
+from .reference_cache import reference_cache
+from .replicas import replica_set
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Time spent handling a request", ["method", "route"], buckets=LATENCY_BUCKETS
+)
+HTTP_REQUESTS = Counter("http_requests", "Requests handled, by response status", ["method", "route", "status"])
+DB_QUERIES_PER_REQUEST = Histogram(
+    "db_queries_per_request", "SQL statements run by one request", ["method", "route"], buckets=QUERY_COUNT_BUCKETS
+)
+DB_SECONDS_PER_REQUEST = Histogram(
+    "db_query_duration_seconds_per_request", "Time one request spent in SQL statements", ["method", "route"],
+    buckets=LATENCY_BUCKETS
+)
+SMTP_SEND_SECONDS = Histogram(
+    "smtp_send_duration_seconds", "Time to send one email over the SMTP pool", ["outcome"], buckets=LATENCY_BUCKETS
+)
+
+# Routes are labelled by template, anything that matched no route shares one label
+UNMATCHED_ROUTE = "unmatched"
+
+
+class MetricsMiddleware:
+    """Records the latency, status and SQL statements of every HTTP request"""
+
+    def __init__(self, app):
+        self.app = app
+        self._routes = None
+
+    def _route_template(self, scope) -> str:
+        if self._routes is None:
+            # Endpoint function to path template, the router sets the matched endpoint on the scope
+            self._routes = {
+                route.endpoint: route.path for route in scope["app"].routes if hasattr(route, "endpoint")
+            }
+        return self._routes.get(scope.get("endpoint"), UNMATCHED_ROUTE)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        response_status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal response_status
+            if message["type"] == "http.response.start":
+                response_status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            method = scope["method"]
+            route = self._route_template(scope)
+            HTTP_REQUEST_SECONDS.labels(method, route).observe(elapsed)
+            HTTP_REQUESTS.labels(method, route, str(response_status)).inc()
+            tracker = scope.get("query_tracker")
+            if tracker is not None:
+                DB_QUERIES_PER_REQUEST.labels(method, route).observe(tracker.count)
+                DB_SECONDS_PER_REQUEST.labels(method, route).observe(tracker.seconds)
+
+
+def _gauge(name: str, documentation: str, labels=(), samples=()):
+    metric = GaugeMetricFamily(name, documentation, labels=list(labels))
+    for label_values, value in samples:
+        metric.add_metric(list(label_values), value)
+    return metric
+
+
+def _counter(name: str, documentation: str, labels=(), samples=()):
+    metric = CounterMetricFamily(name, documentation, labels=list(labels))
+    for label_values, value in samples:
+        metric.add_metric(list(label_values), value)
+    return metric
+
+
+class ApplicationCollector:
+    """Reads the connection pools, caches and background workers at scrape time"""
+
+    def collect(self):
+        yield _counter("db_queries", "SQL statements run, inside or outside of requests", ["engine"],
+                       [((name, ), count) for name, count in statement_totals.items()])
+
+        pools = [("async", async_engine.sync_engine.pool), ("sync", engine.pool)]
+        pools += [(replica.name, replica.engine.sync_engine.pool) for replica in replica_set.replicas]
+        yield _gauge("db_pool_size", "Connections the pool keeps open", ["engine"],
+                     [((name, ), pool.size()) for name, pool in pools])
+        yield _gauge("db_pool_checked_out", "Connections currently in use", ["engine"],
+                     [((name, ), pool.checkedout()) for name, pool in pools])
+        yield _gauge("db_pool_max_connections", "Pool size plus the allowed overflow", ["engine"],
+                     [((name, ), pool.size() + DB_MAX_OVERFLOW) for name, pool in pools])
+        yield _gauge("db_pool_overflow", "Connections open beyond the pool size", ["engine"],
+                     [((name, ), max(0, pool.overflow())) for name, pool in pools])
+        yield _counter("db_pool_checkouts", "Connections handed out by the pool", ["engine"],
+                       [((name, ), getattr(pool, "checkouts", 0)) for name, pool in pools])
+        yield _counter("db_pool_wait_seconds", "Time spent waiting for a pooled connection", ["engine"],
+                       [((name, ), getattr(pool, "wait_seconds_total", 0.0)) for name, pool in pools])
+        yield _counter("db_pool_timeouts", "Checkouts that found no free connection in time, answered with 503",
+                       ["engine"], [((name, ), getattr(pool, "timeouts", 0)) for name, pool in pools])
+        yield _gauge("db_pool_max_wait_seconds", "Longest wait for a pooled connection", ["engine"],
+                     [((name, ), getattr(pool, "max_wait_seconds", 0.0)) for name, pool in pools])
+
+        replica_stats = replica_set.stats()
+        yield _counter("db_read_sessions", "Sessions of read-only endpoints, by the database they went to", ["target"],
+                       [((target, ), count) for target, count in replica_stats["routed"].items()])
+        yield _gauge("db_replica_healthy", "Whether the read replica receives reads", ["replica"],
+                     [((replica["name"], ), int(replica["healthy"])) for replica in replica_stats["replicas"]])
+        yield _gauge("db_replica_lag_seconds", "Replay lag of the read replica at its last health check", ["replica"],
+                     [((replica["name"], ), replica["lag_seconds"]) for replica in replica_stats["replicas"]])
+
+        principal_stats = principal_cache.stats()
+        caches = {
+            "auth_tokens": principal_stats["tokens"],
+            "auth_principals": principal_stats["principals"],
+            "reference": reference_cache.stats(),
+            "query": query_cache.stats(),
+        }
+        yield _counter("cache_hits", "Cache lookups answered from the cache", ["cache"],
+                       [((name, ), stats["hits"]) for name, stats in caches.items()])
+        yield _counter("cache_misses", "Cache lookups that fell through", ["cache"],
+                       [((name, ), stats["misses"]) for name, stats in caches.items()])
+        yield _gauge("cache_hit_ratio", "Share of lookups answered from the cache since start", ["cache"],
+                     [((name, ), stats["hit_ratio"]) for name, stats in caches.items()])
+        query_stats = caches["query"]
+        yield _gauge("query_cache_bytes", "Size of the cached query results", samples=[((), query_stats.get("bytes", 0))])
+        yield _counter("query_cache_evictions", "Query results evicted to stay under the size cap",
+                       samples=[((), query_stats.get("evictions", 0))])
+
+        hasher_stats = password_hasher.stats()
+        yield _gauge("password_hash_pending", "Password hashes queued or running", samples=[((), hasher_stats["pending"])])
+        yield _counter("password_hash_completed", "Password hashes computed", samples=[((), hasher_stats["completed"])])
+        yield _counter("password_hash_rejected", "Password hashes rejected with 503 while saturated",
+                       samples=[((), hasher_stats["rejected"])])
+
+        writer_stats = history_writer.stats()
+        yield _gauge("history_writer_queue_depth", "History entries waiting to be written",
+                     samples=[((), writer_stats["queue_depth"])])
+        yield _counter("history_writer_entries", "History entries handled by the writer", ["outcome"], [
+            (("written", ), writer_stats["written"]),
+            (("dropped", ), writer_stats["dropped"]),
+            (("failed", ), writer_stats["failed"]),
+        ])
+        yield _counter("history_writer_flushes", "Batches flushed by the writer", samples=[((), writer_stats["flushes"])])
+        yield _gauge("history_writer_flush_seconds", "Flush latency of the history writer", ["stat"], [
+            (("last", ), writer_stats["last_flush_seconds"]),
+            (("avg", ), writer_stats["avg_flush_seconds"]),
+            (("max", ), writer_stats["max_flush_seconds"]),
+        ])
+
+
+REGISTRY.register(ApplicationCollector())
+
+
+async def metrics_endpoint(request: Request) -> Response:
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
@@ -1,12 +1,19 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Boolean
-from sqlalchemy.orm import relationship
-from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Boolean, Index, Computed
+from sqlalchemy.orm import relationship, deferred
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB, TSVECTOR
 from datetime import datetime
 
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
 
+# Weighted full-text document of a task: name (A), description (B) and notes (C)
+TASK_SEARCH_VECTOR = (
+    "setweight(to_tsvector('english', coalesce(task_name, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(task_description, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(notes, '')), 'C')"
+)
+
 
 class TaskActivity(Base):
     __tablename__ = "tasks_activity"
@@ -41,16 +48,39 @@ class TaskActivity(Base):
     # Boolean field for favorite
     favorite = Column(String(100), nullable=True)
 
+    # Version of the latest history entry, so logging history needs no extra query
+    history_version = Column(Integer, default=0, server_default="0", nullable=False)
+
+    # Full-text search document, generated by Postgres and only loaded when asked for
+    search_vector = deferred(Column(TSVECTOR, Computed(TASK_SEARCH_VECTOR, persisted=True), nullable=True))
+
     # Foreign keys to link users (creator and assignee)
     created_by_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     assigned_to_id = Column(Integer, ForeignKey("users.id"), nullable=False)
 
     # Relationship with TaskHistory
-    history = relationship("TaskHistory", back_populates="task")
+    history = relationship("TaskHistory", back_populates="task", passive_deletes=True)  # Removed by ON DELETE CASCADE
     attachments = relationship("Attachment", back_populates="task")  # One-to-many relationship with Attachments
     creator = relationship("User", foreign_keys=[created_by_id], back_populates="tasks_created")
     assignee = relationship("User", foreign_keys=[assigned_to_id], back_populates="assigned_tasks")
 
+    # Indexes matching the query_tasks access paths (see "Task query indexes" in the README)
+    __table_args__ = (
+        Index("ix_tasks_activity_created_by_created_on", "created_by_id", "created_on", "task_id"),
+        Index("ix_tasks_activity_assigned_to_created_on", "assigned_to_id", "created_on", "task_id"),
+        Index("ix_tasks_activity_created_by_status_created_on", "created_by_id", "status", "created_on", "task_id"),
+        Index("ix_tasks_activity_assigned_to_status_created_on", "assigned_to_id", "status", "created_on", "task_id"),
+        Index("ix_tasks_activity_created_by_activity_type_created_on",
+              "created_by_id", "activity_type_id", "created_on", "task_id"),
+        Index("ix_tasks_activity_assigned_to_activity_type_created_on",
+              "assigned_to_id", "activity_type_id", "created_on", "task_id"),
+        Index("ix_tasks_activity_created_by_due_date", "created_by_id", "due_date"),
+        Index("ix_tasks_activity_assigned_to_due_date", "assigned_to_id", "due_date"),
+        Index("ix_tasks_activity_task_name_trgm", "task_name",
+              postgresql_using="gin", postgresql_ops={"task_name": "gin_trgm_ops"}),
+        Index("ix_tasks_activity_search_vector", "search_vector", postgresql_using="gin"),
+    )
+
 
 class User(Base):
     __tablename__ = "users"
@@ -124,16 +154,52 @@ class Attachment(Base):
 
 
 # Table for TaskHistory
+# Range partitioned by month on created_at, see api/history_partitions.py
 class TaskHistory(Base):
     __tablename__ = "tasks_history"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     task_id = Column(Integer, ForeignKey('tasks_activity.task_id', ondelete='CASCADE'), nullable=False)
     action = Column(String(50), nullable=False)
-    previous_data = Column(Text, nullable=True)
-    new_data = Column(Text, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)  # Ensure this is correctly defined
+    # Changed fields only: their old values and their new values, unless the entry is a full snapshot
+    previous_data = Column(JSONB, nullable=True)
+    new_data = Column(JSONB, nullable=True)
+    # Position of the entry in the task's history, snapshots store the whole task in new_data
+    version = Column(Integer, nullable=False)
+    is_snapshot = Column(Boolean, default=False, nullable=False)
+    # Partition key, so it has to be part of the primary key
+    created_at = Column(DateTime, primary_key=True, default=datetime.utcnow, nullable=False)
     modified_by_id = Column(Integer, ForeignKey("users.id"), nullable=False)
 
     modified_by = relationship("User", foreign_keys=[modified_by_id])
     task = relationship("TaskActivity", back_populates="history")
+
+    __table_args__ = (
+        # Not unique: a unique index on a partitioned table must contain created_at
+        Index("ix_tasks_history_task_id_version", "task_id", "version"),
+        # Timeline and feed filters, all sorted by the (created_at, id) keyset
+        Index("ix_tasks_history_task_id_created_at", "task_id", "created_at", "id"),
+        Index("ix_tasks_history_modified_by_created_at", "modified_by_id", "created_at", "id"),
+        Index("ix_tasks_history_created_at", "created_at", "id"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+
+# Table for EmailOutbox, written in the same transaction as the task and drained by the email dispatcher
+class EmailOutbox(Base):
+    __tablename__ = "email_outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    to_email = Column(String(255), nullable=False)
+    subject = Column(String(255), nullable=False)
+    body = Column(Text, nullable=False)
+    status = Column(String(20), default="pending", nullable=False)  # pending, sent or dead
+    attempts = Column(Integer, default=0, nullable=False)
+    last_error = Column(Text, nullable=True)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    sent_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_email_outbox_status_next_attempt_at", "status", "next_attempt_at"),
+    )
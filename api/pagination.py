@@ -0,0 +1,40 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from fastapi import HTTPException, status
+
+
+def encode_cursor(values: dict) -> str:
+    """Encode the keyset position of the last row into an opaque cursor"""
+    payload = {key: value.isoformat() if isinstance(value, datetime) else value for key, value in values.items()}
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict:
+    """Decode an opaque cursor back into its keyset values"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, dict):
+            raise ValueError("cursor payload is not an object")
+        return values
+    except (binascii.Error, ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid pagination cursor")
+
+
+def cursor_datetime(values: dict, key: str) -> datetime:
+    """Read a datetime keyset value from a decoded cursor"""
+    try:
+        return datetime.fromisoformat(values[key])
+    except (KeyError, TypeError, ValueError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid pagination cursor")
+
+
+def cursor_int(values: dict, key: str) -> int:
+    """Read an integer keyset value from a decoded cursor"""
+    value = values.get(key)
+    if not isinstance(value, int):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid pagination cursor")
+    return value
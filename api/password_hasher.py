@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+PASSWORD_HASH_RETRY_AFTER_SECONDS = int(os.getenv("PASSWORD_HASH_RETRY_AFTER_SECONDS", "1"))
+PASSWORD_HASH_NICE = int(os.getenv("PASSWORD_HASH_NICE", "5"))
+
+pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+
+
+# Module level so the worker processes can import and run them
+def _init_worker(niceness: int):
+    # Let the API process win the CPU when both compete on a small host
+    if niceness and hasattr(os, "nice"):
+        os.nice(niceness)
+
+
+def _worker_ready() -> int:
+    return os.getpid()
+
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+class PasswordHasher:
+    """Runs argon2 in a process pool so a burst of logins does not block the event loop"""
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn, so the workers do not inherit the event loop or open database connections
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(PASSWORD_HASH_NICE,),
+            )
+            logger.info(f"Started password hashing pool with {self.workers} workers")
+        return self._executor
+
+    async def _run(self, fn, *args):
+        # Reject early instead of letting requests queue up behind a saturated pool
+        if self._pending >= self.max_pending:
+            self.rejected += 1
+            logger.warning(f"Password hashing pool saturated with {self._pending} pending jobs")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many authentication requests, please retry shortly",
+                headers={"Retry-After": str(PASSWORD_HASH_RETRY_AFTER_SECONDS)},
+            )
+
+        self._pending += 1
+        executor = self._get_executor()
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+            self.completed += 1
+            return result
+        except BrokenProcessPool:
+            # A worker died; drop the pool so the next call starts a fresh one. Concurrent calls fail
+            # on the same pool, only the first one replaces it
+            if self._executor is executor:
+                logger.error("Password hashing pool is broken, restarting it")
+                self._executor = None
+                # Stops its management thread and the workers still alive, they would leak otherwise
+                executor.shutdown(wait=False, cancel_futures=True)
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Authentication is temporarily unavailable, please retry shortly",
+                headers={"Retry-After": str(PASSWORD_HASH_RETRY_AFTER_SECONDS)},
+            )
+        finally:
+            self._pending -= 1
+
+    async def start(self):
+        """Spawn every worker up front, so the first logins do not wait for the processes to start"""
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        await asyncio.gather(*(loop.run_in_executor(executor, _worker_ready) for _ in range(self.workers)))
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(_verify, plain_password, hashed_password)
+
+    async def shutdown(self):
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            # Waiting for the workers to exit blocks, keep it off the event loop
+            await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "pending": self._pending,
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,179 @@
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, object_session
+
+from .models import TaskHistory, User
+from .schemas import UserPrincipal
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+AUTH_CACHE_MAX_SIZE = int(os.getenv("AUTH_CACHE_MAX_SIZE", "10000"))
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))
+# Principals carry is_admin and is_active, which other workers and admin tools can change without this
+# process noticing, so they are kept for a shorter time than the decoded tokens
+AUTH_PRINCIPAL_TTL_SECONDS = float(os.getenv("AUTH_PRINCIPAL_TTL_SECONDS", "10"))
+# Principals loaded at startup, of the users active over the last AUTH_CACHE_WARM_HOURS
+AUTH_CACHE_WARM_USERS = int(os.getenv("AUTH_CACHE_WARM_USERS", "1000"))
+AUTH_CACHE_WARM_HOURS = int(os.getenv("AUTH_CACHE_WARM_HOURS", "24"))
+
+
+class _LRUCache:
+    """Bounded LRU map whose entries also expire after their own deadline"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[1] <= time.time():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, value, expires_at: float):
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def pop(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "size": len(self._entries),
+        }
+
+
+class PrincipalCache:
+    """Caches decoded access tokens and the user principals they resolve to"""
+
+    def __init__(self, max_size: int = AUTH_CACHE_MAX_SIZE, ttl_seconds: float = AUTH_CACHE_TTL_SECONDS,
+                 principal_ttl_seconds: float = AUTH_PRINCIPAL_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.principal_ttl_seconds = min(principal_ttl_seconds, ttl_seconds)
+        self._tokens = _LRUCache(max_size)
+        self._principals = _LRUCache(max_size)
+
+    def get_token(self, token: str) -> Optional[int]:
+        """Return the user id of an already decoded token"""
+        return self._tokens.get(token)
+
+    def put_token(self, token: str, user_id: int, expires_at: Optional[float]):
+        # Never keep a token past its own expiry
+        deadline = time.time() + self.ttl_seconds
+        if expires_at is not None:
+            deadline = min(deadline, expires_at)
+        self._tokens.put(token, user_id, deadline)
+
+    def get_principal(self, user_id: int) -> Optional[UserPrincipal]:
+        return self._principals.get(user_id)
+
+    def put_principal(self, principal: UserPrincipal):
+        self._principals.put(principal.id, principal, time.time() + self.principal_ttl_seconds)
+
+    async def warm(self, db: AsyncSession, limit: int = AUTH_CACHE_WARM_USERS) -> int:
+        """Load the principals of the users who changed tasks over the last day, returning how many were cached"""
+        if limit <= 0:
+            return 0
+        recent = (
+            select(TaskHistory.modified_by_id)
+            .where(TaskHistory.created_at >= datetime.utcnow() - timedelta(hours=AUTH_CACHE_WARM_HOURS))
+            .distinct()
+            .limit(limit)
+        )
+        result = await db.execute(select(User).where(User.id.in_(recent)))
+        users = result.scalars().all()
+        for user in users:
+            self.put_principal(UserPrincipal.from_orm(user))
+        return len(users)
+
+    def invalidate_user(self, user_id: int):
+        """Forget a user's principal so the next request reloads it"""
+        self._principals.pop(user_id)
+        logger.info(f"Invalidated cached principal for user {user_id}")
+
+    def invalidate_all_users(self):
+        """Forget every principal, for changes whose users are not known (bulk UPDATE/DELETE of users)"""
+        self._principals.clear()
+        logger.info("Invalidated all cached principals")
+
+    def clear(self):
+        self._tokens.clear()
+        self._principals.clear()
+
+    def stats(self) -> dict:
+        return {"tokens": self._tokens.stats(), "principals": self._principals.stats()}
+
+
+principal_cache = PrincipalCache()
+
+
+# The user ids changed in a session are collected while it runs and dropped from the cache once the
+# transaction commits, so a concurrent request cannot cache the old row again in between. None stands for
+# "unknown users".
+_CHANGED_PRINCIPALS = "changed_principals"
+
+
+def _mark_changed(session: Optional[Session], user_id: Optional[int]):
+    if session is not None:
+        session.info.setdefault(_CHANGED_PRINCIPALS, set()).add(user_id)
+    elif user_id is not None:
+        principal_cache.invalidate_user(user_id)
+    else:
+        principal_cache.invalidate_all_users()
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_changed_user(mapper, connection, target):
+    _mark_changed(object_session(target), target.id)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _invalidate_bulk_changed_users(orm_execute_state):
+    # update(User) / delete(User) statements bypass the unit of work and its mapper events
+    if (orm_execute_state.is_update or orm_execute_state.is_delete) \
+            and orm_execute_state.statement.entity_description.get("table") is User.__table__:
+        _mark_changed(orm_execute_state.session, None)
+
+
+@event.listens_for(Session, "after_commit")
+def _drop_changed_principals(session):
+    changed = session.info.pop(_CHANGED_PRINCIPALS, None)
+    if not changed:
+        return
+    if None in changed:
+        principal_cache.invalidate_all_users()
+    else:
+        for user_id in changed:
+            principal_cache.invalidate_user(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changed_principals(session):
+    session.info.pop(_CHANGED_PRINCIPALS, None)
@@ -0,0 +1,284 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Iterable, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# memory: per process (the default), sqlite: a file shared by the workers of one host, none: disabled
+QUERY_CACHE_BACKEND = os.getenv("QUERY_CACHE_BACKEND", "memory").lower()
+QUERY_CACHE_MAX_BYTES = int(os.getenv("QUERY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Bounds how long a worker can serve a page that another worker's write made stale (memory backend)
+QUERY_CACHE_TTL_SECONDS = float(os.getenv("QUERY_CACHE_TTL_SECONDS", "30"))
+QUERY_CACHE_SQLITE_PATH = os.getenv("QUERY_CACHE_SQLITE_PATH", "query_cache.sqlite3")
+
+
+class MemoryBackend:
+    """In-process LRU of serialized results, capped by their total size"""
+
+    # Dict operations under a lock, cheap enough to run on the event loop
+    blocking = False
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key: str, value: bytes, expires_at: float):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (value, expires_at)
+            self._bytes += len(value)
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[0])
+
+    def generation(self, user_id: int) -> int:
+        return self._generations.get(user_id, 0)
+
+    def bump(self, user_ids: Iterable[int]):
+        with self._lock:
+            for user_id in user_ids:
+                self._generations[user_id] = self._generations.get(user_id, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "bytes": self._bytes, "evictions": self.evictions}
+
+
+class SqliteBackend:
+    """Results and generations in a local SQLite file, so every worker sees the others' invalidations.
+    A stand-in for a shared cache server on single host deployments.
+
+    Entries are evicted oldest first by expiry rather than by last access, so a cache hit is a plain read
+    and does not compete with the other workers for the write lock."""
+
+    # File I/O and lock waits, QueryCache runs these calls in a thread
+    blocking = True
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS query_cache (
+                    key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL,
+                    expires_at REAL NOT NULL, accessed_at REAL NOT NULL
+                )
+            """)
+            conn.execute("DROP INDEX IF EXISTS query_cache_accessed_at")
+            conn.execute("CREATE INDEX IF NOT EXISTS query_cache_expires_at ON query_cache (expires_at)")
+            conn.execute("CREATE TABLE IF NOT EXISTS query_cache_generations (user_id INTEGER PRIMARY KEY, generation INTEGER NOT NULL)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread, the file is shared between processes
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[bytes]:
+        row = self._connect().execute(
+            "SELECT value FROM query_cache WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: bytes, expires_at: float):
+        if len(value) > self.max_bytes:
+            return
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT OR REPLACE INTO query_cache (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), expires_at, time.time())
+            )
+            total = conn.execute("SELECT coalesce(sum(size), 0) FROM query_cache").fetchone()[0]
+            if total > self.max_bytes:
+                # Every entry lives for the same TTL, so the earliest expiry is the oldest entry (expired ones first)
+                oldest = conn.execute("SELECT key, size FROM query_cache ORDER BY expires_at").fetchall()
+                for old_key, size in oldest:
+                    if total <= self.max_bytes:
+                        break
+                    conn.execute("DELETE FROM query_cache WHERE key = ?", (old_key,))
+                    total -= size
+                    self.evictions += 1
+
+    def generation(self, user_id: int) -> int:
+        row = self._connect().execute(
+            "SELECT generation FROM query_cache_generations WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def bump(self, user_ids: Iterable[int]):
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT INTO query_cache_generations (user_id, generation) VALUES (?, 1) "
+                "ON CONFLICT (user_id) DO UPDATE SET generation = generation + 1",
+                [(user_id,) for user_id in user_ids]
+            )
+
+    def clear(self):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM query_cache")
+            conn.execute("DELETE FROM query_cache_generations")
+
+    def stats(self) -> dict:
+        entries, size = self._connect().execute("SELECT count(*), coalesce(sum(size), 0) FROM query_cache").fetchone()
+        return {"entries": entries, "bytes": size, "evictions": self.evictions}
+
+
+def _normalize(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    return value
+
+
+class QueryCache:
+    """Caches query results per user; a user's entries are invalidated by bumping their generation"""
+
+    def __init__(self, backend=None, ttl_seconds: float = QUERY_CACHE_TTL_SECONDS):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    def _failed(self, action: str, error: Exception):
+        # A broken or locked cache costs speed only, callers fall back to the database
+        self.errors += 1
+        logger.error(f"Query cache {action} failed: {str(error)}")
+
+    async def _call(self, method, *args):
+        if self.backend.blocking:
+            return await asyncio.to_thread(method, *args)
+        return method(*args)
+
+    async def key(self, namespace: str, user_id: int, params: dict) -> Optional[str]:
+        """Key of a result, from the normalized parameters and the user's current generation.
+        None when the generation cannot be read, the result must not be cached then"""
+        normalized = json.dumps({name: _normalize(value) for name, value in params.items()}, sort_keys=True)
+        try:
+            generation = await self._call(self.backend.generation, user_id)
+        except Exception as e:
+            self._failed("generation lookup", e)
+            return None
+        return f"{namespace}:{user_id}:{generation}:{hashlib.sha1(normalized.encode()).hexdigest()}"
+
+    async def get(self, key: str):
+        try:
+            value = await self._call(self.backend.get, key)
+            result = None if value is None else pickle.loads(value)
+        except Exception as e:
+            self._failed("read", e)
+            result = None
+        if result is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    async def set(self, key: str, value):
+        try:
+            await self._call(self.backend.set, key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL),
+                             time.time() + self.ttl_seconds)
+        except Exception as e:
+            self._failed("write", e)
+
+    async def invalidate_users(self, user_ids: Iterable[Optional[int]]):
+        """Bump the generation of every user whose results may have changed, after the write committed"""
+        if not self.enabled:
+            return
+        user_ids = sorted({user_id for user_id in user_ids if user_id is not None})
+        if not user_ids:
+            return
+        try:
+            await self._call(self.backend.bump, user_ids)
+        except Exception as e:
+            # The write is committed already; the users' cached pages stay until QUERY_CACHE_TTL_SECONDS
+            self._failed(f"invalidation of users {user_ids}", e)
+
+    async def clear(self):
+        if self.enabled:
+            await self._call(self.backend.clear)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        stats = {
+            "backend": QUERY_CACHE_BACKEND if self.enabled else "none",
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "errors": self.errors,
+        }
+        if self.enabled:
+            try:
+                stats.update(self.backend.stats())
+            except Exception as e:
+                self._failed("stats", e)
+        return stats
+
+
+def _create_backend():
+    if QUERY_CACHE_BACKEND == "memory":
+        return MemoryBackend(QUERY_CACHE_MAX_BYTES)
+    if QUERY_CACHE_BACKEND == "sqlite":
+        return SqliteBackend(QUERY_CACHE_SQLITE_PATH, QUERY_CACHE_MAX_BYTES)
+    if QUERY_CACHE_BACKEND != "none":
+        logger.warning(f"Unknown QUERY_CACHE_BACKEND {QUERY_CACHE_BACKEND}, the query cache is disabled")
+    return None
+
+
+query_cache = QueryCache(_create_backend())
@@ -0,0 +1,156 @@
+"""Per-request SQL instrumentation.
+
+Cursor execute events on both engines attribute every statement to the
+request being handled: the statement count and DB time are returned in a
+Server-Timing header and feed the metrics, statements slower than
+SLOW_QUERY_THRESHOLD_MS are logged as JSON, and a statement repeated
+N_PLUS_ONE_THRESHOLD times in one request is reported as a likely N+1.
+
+Routes declare how many statements they may run with query_budget(n); with
+QUERY_BUDGET_ENFORCE=true (test runs) a request going over its budget fails
+with a 500 instead of only logging a warning.
+"""
+import json
+import logging
+import os
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy import event
+from starlette.datastructures import MutableHeaders
+
+from .database import async_engine, engine
+from .replicas import replica_set
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "200"))
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "5"))
+QUERY_BUDGET_ENFORCE = os.getenv("QUERY_BUDGET_ENFORCE", "false").lower() == "true"
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "true").lower() == "true"
+
+# Longest statement text written to the logs
+LOGGED_STATEMENT_LENGTH = 1000
+
+
+class QueryTracker:
+    """Statements run on behalf of one request"""
+
+    def __init__(self, method: str = "", path: str = ""):
+        self.method = method
+        self.path = path
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+        self.budget: Optional[int] = None
+
+    def record(self, statement: str, elapsed: float):
+        self.count += 1
+        self.seconds += elapsed
+        self.statements[statement] += 1
+
+    def repeated_statements(self, threshold: int = N_PLUS_ONE_THRESHOLD) -> list:
+        """Statements run at least `threshold` times, the usual sign of a query per row"""
+        return [(statement, count) for statement, count in self.statements.most_common() if count >= threshold]
+
+    def server_timing(self) -> str:
+        return f'db;dur={self.seconds * 1000:.2f};desc="{self.count} queries"'
+
+
+_current_tracker: ContextVar[Optional[QueryTracker]] = ContextVar("query_tracker", default=None)
+
+# Statements per engine since start, inside or outside of requests
+statement_totals = {"async": 0, "sync": 0}
+
+
+def current_tracker() -> Optional[QueryTracker]:
+    return _current_tracker.get()
+
+
+def _log_event(level: int, event_name: str, tracker: Optional[QueryTracker], **fields):
+    record = {"event": event_name}
+    if tracker is not None:
+        record.update(method=tracker.method, path=tracker.path)
+    record.update(fields)
+    logger.log(level, json.dumps(record, default=str))
+
+
+def _instrument_engine(sync_engine, name: str):
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        statement_totals[name] += 1
+        tracker = _current_tracker.get()
+        if tracker is not None:
+            tracker.record(statement, elapsed)
+        if elapsed * 1000 >= SLOW_QUERY_THRESHOLD_MS:
+            _log_event(logging.WARNING, "slow_query", tracker, engine=name, duration_ms=round(elapsed * 1000, 2),
+                       executemany=executemany, statement=statement[:LOGGED_STATEMENT_LENGTH])
+
+
+_instrument_engine(async_engine.sync_engine, "async")
+_instrument_engine(engine, "sync")
+for _replica in replica_set.replicas:
+    statement_totals.setdefault("replica", 0)
+    _instrument_engine(_replica.engine.sync_engine, "replica")
+
+
+class QueryTrackingMiddleware:
+    """Tracks the statements of every HTTP request and reports them in a Server-Timing header"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        tracker = QueryTracker(scope["method"], scope["path"])
+        # Outer middlewares (metrics) read the tracker from the scope once the request is done
+        scope["query_tracker"] = tracker
+        token = _current_tracker.set(tracker)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and SERVER_TIMING_ENABLED:
+                MutableHeaders(scope=message).append("Server-Timing", tracker.server_timing())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_tracker.reset(token)
+            for statement, count in tracker.repeated_statements():
+                _log_event(logging.WARNING, "n_plus_one", tracker, count=count,
+                           statement=statement[:LOGGED_STATEMENT_LENGTH])
+
+
+def query_budget(max_queries: int):
+    """Route dependency declaring how many statements the endpoint may run"""
+
+    async def check_query_budget():
+        tracker = _current_tracker.get()
+        if tracker is not None:
+            tracker.budget = max_queries
+        yield
+        if tracker is None or tracker.count <= max_queries:
+            return
+        _log_event(logging.WARNING, "query_budget_exceeded", tracker, count=tracker.count, budget=max_queries,
+                   statements=[statement[:200] for statement in tracker.statements])
+        if QUERY_BUDGET_ENFORCE:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Query budget exceeded: {tracker.count} statements, budget {max_queries}"
+            )
+
+    return check_query_budget
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Optional, Set
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .constant import activity_type_id, activity_group_id, stage_id, core_group_id
+from .models import ActivityType, ActivityGroup, Stage, CoreGroup
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+REFERENCE_CACHE_TTL_SECONDS = float(os.getenv("REFERENCE_CACHE_TTL_SECONDS", "300"))
+
+# Lookup tables referenced by tasks, keyed by the task field that points at them
+REFERENCE_MODELS = {
+    activity_type_id: ActivityType,
+    activity_group_id: ActivityGroup,
+    stage_id: Stage,
+    core_group_id: CoreGroup,
+}
+
+
+class ReferenceDataCache:
+    """In-process cache of the ids in the lookup tables, so FK validation is a set lookup"""
+
+    def __init__(self, ttl_seconds: float = REFERENCE_CACHE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._ids: Dict[str, Set[int]] = {}
+        self._loaded_at: Dict[str, float] = {}
+        self._lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+
+    def _is_fresh(self, field: str) -> bool:
+        loaded_at = self._loaded_at.get(field)
+        return loaded_at is not None and time.monotonic() - loaded_at < self.ttl_seconds
+
+    async def _load(self, db: AsyncSession, field: str):
+        async with self._lock:
+            # Another request may have refreshed the table while we waited for the lock
+            if self._is_fresh(field):
+                return
+            model = REFERENCE_MODELS[field]
+            result = await db.execute(select(model.id))
+            self._ids[field] = set(result.scalars().all())
+            self._loaded_at[field] = time.monotonic()
+            self.loads += 1
+            logger.info(f"Loaded {len(self._ids[field])} ids for {model.__tablename__} into the reference cache")
+
+    async def load_all(self, db: AsyncSession):
+        """Load every lookup table, used to warm the cache"""
+        for field in REFERENCE_MODELS:
+            await self._load(db, field)
+
+    async def contains(self, db: AsyncSession, field: str, value: int) -> bool:
+        """Return True when the id is known to exist, False means the caller has to check the database"""
+        if not self._is_fresh(field):
+            await self._load(db, field)
+        if value in self._ids.get(field, ()):
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def add(self, field: str, value: int):
+        """Record an id that was confirmed against the database after a miss"""
+        if field in self._ids:
+            self._ids[field].add(value)
+
+    def invalidate(self, field: Optional[str] = None):
+        """Drop one lookup table (or all of them) so the next lookup reloads from the database"""
+        fields = [field] if field else list(REFERENCE_MODELS)
+        for name in fields:
+            self._ids.pop(name, None)
+            self._loaded_at.pop(name, None)
+        logger.info(f"Invalidated reference cache for {', '.join(fields)}")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "loads": self.loads,
+            "sizes": {field: len(ids) for field, ids in self._ids.items()},
+        }
+
+
+reference_cache = ReferenceDataCache()
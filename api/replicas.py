@@ -0,0 +1,245 @@
+"""Routing of read-only requests to Postgres read replicas.
+
+Set DATABASE_REPLICA_URLS to a comma separated list of replica DSNs. Read
+endpoints take their session from get_read_db, which picks the next healthy
+replica in round-robin order; everything else keeps using get_async_db and
+the primary. A background check marks a replica unhealthy while it cannot
+be reached or replays more than REPLICA_MAX_LAG_SECONDS behind the primary,
+and reads fall back to the primary while no replica is healthy.
+
+Replicas lag behind the primary, so after a successful write a user's reads
+go to the primary for READ_YOUR_WRITES_SECONDS, which is never shorter than
+the lag a healthy replica may have (REPLICA_MAX_LAG_SECONDS plus the health
+check interval). The window is remembered per
+user in the worker that handled the write and in a cookie, which carries it
+to the other workers.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import List, Optional
+
+from fastapi import Request
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from starlette.datastructures import MutableHeaders
+
+from .auth_service import token_user_id
+from .database import ASYNC_CONNECT_ARGS, AsyncSessionLocal, POOL_OPTIONS, TimedAsyncQueuePool, to_async_url
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+REPLICA_HEALTH_CHECK_INTERVAL = float(os.getenv("REPLICA_HEALTH_CHECK_INTERVAL", "5"))
+REPLICA_HEALTH_CHECK_TIMEOUT = float(os.getenv("REPLICA_HEALTH_CHECK_TIMEOUT", "2"))
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "10"))
+# A replica counted as healthy may be up to REPLICA_MAX_LAG_SECONDS behind, and more by the time its lag is
+# measured again, so a shorter read-your-writes window could still send the writer to a replica without the write
+MIN_READ_YOUR_WRITES_SECONDS = REPLICA_MAX_LAG_SECONDS + REPLICA_HEALTH_CHECK_INTERVAL
+READ_YOUR_WRITES_SECONDS_SETTING = float(os.getenv("READ_YOUR_WRITES_SECONDS", str(MIN_READ_YOUR_WRITES_SECONDS)))
+READ_YOUR_WRITES_SECONDS = max(READ_YOUR_WRITES_SECONDS_SETTING, MIN_READ_YOUR_WRITES_SECONDS)
+
+READ_YOUR_WRITES_COOKIE = "read_primary_until"
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+# Session.info key holding the name of the replica a session reads from
+REPLICA_SESSION_INFO = "replica"
+
+# Seconds the replica's replay is behind; 0 while it has replayed everything it received, since an idle
+# primary would otherwise look like growing lag
+REPLICA_LAG_QUERY = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+
+class Replica:
+    def __init__(self, name: str, url: str):
+        self.name = name
+        self.engine = create_async_engine(
+            to_async_url(url),
+            poolclass=TimedAsyncQueuePool,
+            connect_args=ASYNC_CONNECT_ARGS,
+            **POOL_OPTIONS,
+        )
+        self.sessionmaker = async_sessionmaker(self.engine, class_=AsyncSession, autoflush=False,
+                                               expire_on_commit=False)
+        # Healthy until a check says otherwise, so reads use the replica from the first request
+        self.healthy = True
+        self.lag_seconds = 0.0
+        self.last_error: Optional[str] = None
+
+    async def _replay_lag(self) -> float:
+        async with self.engine.connect() as conn:
+            return float((await conn.execute(REPLICA_LAG_QUERY)).scalar() or 0)
+
+    async def check(self):
+        try:
+            # Bounds the connection attempt as well, an unreachable host would otherwise hang the check
+            self.lag_seconds = await asyncio.wait_for(self._replay_lag(), REPLICA_HEALTH_CHECK_TIMEOUT)
+            self.last_error = None
+            healthy = self.lag_seconds <= REPLICA_MAX_LAG_SECONDS
+        except Exception as e:
+            self.last_error = str(e) or type(e).__name__
+            healthy = False
+
+        if healthy != self.healthy:
+            if healthy:
+                logger.info(f"Read replica {self.name} is healthy again")
+            else:
+                logger.warning(f"Read replica {self.name} marked unhealthy: "
+                               f"{self.last_error or f'{self.lag_seconds:.1f}s behind the primary'}")
+        self.healthy = healthy
+
+
+class ReplicaSet:
+    """Round-robin over the healthy replicas, with the health checks running in the background"""
+
+    def __init__(self, urls: List[str]):
+        self.replicas = [Replica(f"replica_{index}", url) for index, url in enumerate(urls)]
+        self._next = 0
+        self._task: Optional[asyncio.Task] = None
+        self._pinned = {}  # user id -> monotonic deadline of the read-your-writes window
+        self.routed = {"primary": 0, "replica": 0}
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.replicas)
+
+    def choose(self) -> Optional[Replica]:
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[self._next % len(self.replicas)]
+            self._next += 1
+            if replica.healthy:
+                return replica
+        return None
+
+    async def check_all(self):
+        await asyncio.gather(*(replica.check() for replica in self.replicas))
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(REPLICA_HEALTH_CHECK_INTERVAL)
+            try:
+                await self.check_all()
+            except Exception as e:
+                logger.error(f"Read replica health check failed: {str(e)}")
+
+    async def start(self):
+        if not self.configured or self._task is not None:
+            return
+        if READ_YOUR_WRITES_SECONDS_SETTING < MIN_READ_YOUR_WRITES_SECONDS:
+            logger.warning(f"READ_YOUR_WRITES_SECONDS={READ_YOUR_WRITES_SECONDS_SETTING:g} is shorter than the "
+                           f"tolerated replica lag plus the health check interval, using "
+                           f"{MIN_READ_YOUR_WRITES_SECONDS:g}s")
+        await self.check_all()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Routing reads to {len(self.replicas)} replicas, "
+                    f"{sum(replica.healthy for replica in self.replicas)} healthy")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for replica in self.replicas:
+            await replica.engine.dispose()
+
+    def pin(self, user_id: int):
+        now = time.monotonic()
+        self._pinned[user_id] = now + READ_YOUR_WRITES_SECONDS
+        # Drop the expired windows now and then, the map only holds recent writers
+        if len(self._pinned) > 10000:
+            self._pinned = {key: deadline for key, deadline in self._pinned.items() if deadline > now}
+
+    def is_pinned(self, user_id: Optional[int]) -> bool:
+        if user_id is None:
+            return False
+        deadline = self._pinned.get(user_id)
+        return deadline is not None and deadline > time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            "routed": dict(self.routed),
+            "replicas": [
+                {"name": replica.name, "healthy": replica.healthy, "lag_seconds": replica.lag_seconds,
+                 "last_error": replica.last_error}
+                for replica in self.replicas
+            ],
+        }
+
+
+replica_set = ReplicaSet(DATABASE_REPLICA_URLS)
+
+
+def _bearer_user_id(authorization: Optional[str]) -> Optional[int]:
+    """User of a bearer token; does not count in the auth cache hits and misses"""
+    if not authorization or not authorization.lower().startswith("bearer "):
+        return None
+    return token_user_id(authorization[7:])
+
+
+def _cookie_pinned(request: Request) -> bool:
+    try:
+        return float(request.cookies.get(READ_YOUR_WRITES_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+async def get_read_db(request: Request):
+    """Session for read-only endpoints, on a replica unless the user wrote something a moment ago"""
+    replica = None
+    if replica_set.configured and not _cookie_pinned(request) \
+            and not replica_set.is_pinned(_bearer_user_id(request.headers.get("authorization"))):
+        replica = replica_set.choose()
+
+    if replica is None:
+        replica_set.routed["primary"] += 1
+        async with AsyncSessionLocal() as db:
+            yield db
+    else:
+        replica_set.routed["replica"] += 1
+        async with replica.sessionmaker() as db:
+            db.info[REPLICA_SESSION_INFO] = replica.name
+            yield db
+
+
+def is_replica_session(db: AsyncSession) -> bool:
+    """Whether the session reads from a replica, whose results may lag behind the primary"""
+    return REPLICA_SESSION_INFO in db.info
+
+
+class ReadYourWritesMiddleware:
+    """Pins the reads of a user to the primary for a moment after each successful write"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in READ_METHODS or not replica_set.configured:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                # Anonymous writes are not pinned
+                authorization = dict(scope["headers"]).get(b"authorization")
+                user_id = _bearer_user_id(authorization.decode("latin-1") if authorization else None)
+                if user_id is not None:
+                    replica_set.pin(user_id)
+                    until = time.time() + READ_YOUR_WRITES_SECONDS
+                    MutableHeaders(scope=message).append(
+                        "Set-Cookie", f"{READ_YOUR_WRITES_COOKIE}={until:.3f}; Max-Age={int(READ_YOUR_WRITES_SECONDS) + 1}; "
+                                      f"Path=/; HttpOnly; SameSite=Lax"
+                    )
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
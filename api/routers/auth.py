@@ -1,14 +1,15 @@
 from fastapi import APIRouter, Depends
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from ..database import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..database import get_async_db
+from ..query_tracker import query_budget
 from ..auth_service import authenticate_user_and_create_token
 
 router = APIRouter()
 
 
-@router.post("/token",tags=["Authentication"])
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+@router.post("/token",tags=["Authentication"], dependencies=[Depends(query_budget(1))])
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
     # authenticate the user and return the token response
     token_response = await authenticate_user_and_create_token(db, form_data.username, form_data.password)
 
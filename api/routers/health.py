@@ -0,0 +1,34 @@
+import asyncio
+import logging
+
+from fastapi import APIRouter, Request, status
+from fastapi.responses import JSONResponse
+from sqlalchemy import text
+
+from ..database import async_engine
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# Seconds the readiness probe waits for the database
+READINESS_DB_TIMEOUT = 2.0
+
+
+@router.get("/health/live", tags=["Health"], include_in_schema=False)
+async def live():
+    """The process is up and serving requests"""
+    return {"status": "ok"}
+
+
+@router.get("/health/ready", tags=["Health"], include_in_schema=False)
+async def ready(request: Request):
+    """Startup, including the warm-up, is done and the primary database answers"""
+    if not getattr(request.app.state, "ready", False):
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"status": "starting"})
+    try:
+        async with async_engine.connect() as conn:
+            await asyncio.wait_for(conn.execute(text("SELECT 1")), READINESS_DB_TIMEOUT)
+    except Exception as e:
+        logger.warning(f"Readiness check failed: {str(e)}")
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"status": "database unavailable"})
+    return {"status": "ready", "warmup": request.app.state.warmup}
@@ -1,26 +1,55 @@
 import logging
-from typing import List
+from datetime import datetime
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 
-from sqlalchemy.orm import Session, Query
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from ..constant import Added, Modified
 from ..task_history_service import TasksHistory
-from ..database import get_db
-from ..schemas import TaskHistoryResponse, TaskHistoryDetailsResponse, ResponseWrapper
+from ..replicas import get_read_db
+from ..query_tracker import query_budget
+from ..schemas import TaskHistoryResponse, TaskHistoryDetailsResponse, ResponseWrapper, TaskAsOfResponse, \
+    TaskTimelineEntry
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 task_history = TasksHistory()
 
 
-@router.get("/tasks/history/", response_model=ResponseWrapper[List[TaskHistoryResponse]], tags=["Task History"])
-async def get_all_task_histories(skip: int = 0, limit: int = 10, sort_order: str = "asc",
-                                 db: Session = Depends(get_db)):
-    return await task_history.get_all_task_histories(db, skip=skip, limit=limit, sort_order=sort_order)
+@router.get("/tasks/history/", response_model=ResponseWrapper[List[TaskHistoryResponse]], tags=["Task History"],
+            dependencies=[Depends(query_budget(1))])
+async def get_all_task_histories(skip: int = 0, limit: int = 10, sort_order: str = Query("asc", enum=["asc", "desc"]),
+                                 task_id: Optional[int] = Query(None),
+                                 modified_by_id: Optional[int] = Query(None),
+                                 action: Optional[str] = Query(None, enum=[Added, Modified]),
+                                 created_from: Optional[datetime] = Query(None),
+                                 created_to: Optional[datetime] = Query(None),
+                                 cursor: Optional[str] = Query(None, description="next_cursor from the previous page, replaces skip"),
+                                 db: AsyncSession = Depends(get_read_db)):
+    return await task_history.get_all_task_histories(
+        db, skip=skip, limit=limit, sort_order=sort_order, task_id=task_id, modified_by_id=modified_by_id,
+        action=action, created_from=created_from, created_to=created_to, cursor=cursor
+    )
+
+
+@router.get("/tasks/{task_id}/history", response_model=ResponseWrapper[List[TaskTimelineEntry]], tags=["Task History"],
+            dependencies=[Depends(query_budget(1))])
+async def get_task_timeline(task_id: int, limit: int = 20, sort_order: str = Query("desc", enum=["asc", "desc"]),
+                            cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+                            db: AsyncSession = Depends(get_read_db)):
+    return await task_history.get_task_timeline(task_id=task_id, db=db, limit=limit, sort_order=sort_order,
+                                                cursor=cursor)
 
 
 @router.get("/tasks/{task_id}/history_details", response_model=ResponseWrapper[TaskHistoryDetailsResponse],
-            tags=["Task History"])
-async def get_task_history_details(task_id: int, db: Session = Depends(get_db)):
+            tags=["Task History"], dependencies=[Depends(query_budget(1))])
+async def get_task_history_details(task_id: int, db: AsyncSession = Depends(get_read_db)):
     return await task_history.get_task_history_details(task_id=task_id, db=db)
+
+
+@router.get("/tasks/{task_id}/history/as_of", response_model=ResponseWrapper[TaskAsOfResponse], tags=["Task History"],
+            dependencies=[Depends(query_budget(1))])
+async def get_task_as_of(task_id: int, at: datetime, db: AsyncSession = Depends(get_read_db)):
+    return await task_history.get_task_as_of(task_id=task_id, as_of=at, db=db)
@@ -1,26 +1,38 @@
 from datetime import datetime
 from typing import List, Optional
 
-from fastapi import APIRouter, Depends, Query
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Query, Header, Response
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from ..task_service import TaskActivityImpl
-from ..models import User
-from ..schemas import TaskActivityCreate, TaskResponse, TaskCreatedResponse, ResponseWrapper
-from ..database import get_db
+from ..schemas import TaskActivityCreate, TaskResponse, TaskCreatedResponse, ResponseWrapper, TaskSearchResponse, \
+    BulkTaskCreateResponse, UserPrincipal
+from ..database import get_async_db
+from ..replicas import get_read_db
 from ..auth_service import get_current_user
+from ..etag import task_etag
+from ..query_tracker import query_budget
 
 router = APIRouter()
 task_impl = TaskActivityImpl()
 
 
-@router.post("/tasks", response_model=ResponseWrapper[TaskCreatedResponse], tags=["Task Activity"])
-async def create_task(task: TaskActivityCreate, db: Session = Depends(get_db),
-                      current_user: int = Depends(get_current_user)):
+@router.post("/tasks", response_model=ResponseWrapper[TaskCreatedResponse], tags=["Task Activity"],
+             dependencies=[Depends(query_budget(11))])
+async def create_task(task: TaskActivityCreate, db: AsyncSession = Depends(get_async_db),
+                      current_user: UserPrincipal = Depends(get_current_user)):
     return await task_impl.create_task(db, task_data=task, current_user=current_user)
 
 
-@router.get("/tasks", response_model=ResponseWrapper[List[TaskResponse]], tags=["Task Activity"])
+@router.post("/tasks/bulk", response_model=ResponseWrapper[BulkTaskCreateResponse], tags=["Task Activity"],
+             dependencies=[Depends(query_budget(13))])
+async def bulk_create_tasks(tasks: List[TaskActivityCreate], db: AsyncSession = Depends(get_async_db),
+                            current_user: UserPrincipal = Depends(get_current_user)):
+    return await task_impl.bulk_create_tasks(db, tasks_data=tasks, current_user=current_user)
+
+
+@router.get("/tasks", response_model=ResponseWrapper[List[TaskResponse]], tags=["Task Activity"],
+            dependencies=[Depends(query_budget(5))])
 async def get_tasks(
         task_type: str = Query("created", enum=["created", "assigned"]),
         task_name: Optional[str] = Query(None),
@@ -31,29 +43,56 @@ async def get_tasks(
         assigned_to_id: Optional[int] = Query(None),
         skip: int = 0,
         limit: int = 10,
+        cursor: Optional[str] = Query(None, description="next_cursor from the previous page, replaces skip"),
         sort_order: str = Query("asc", enum=["asc", "desc"]),
-        db: Session = Depends(get_db),
-        current_user: User = Depends(get_current_user)
+        if_none_match: Optional[str] = Header(None),
+        db: AsyncSession = Depends(get_read_db),
+        current_user: UserPrincipal = Depends(get_current_user)
 ):
     return await task_impl.get_tasks(
         db, current_user=current_user, task_type=task_type, task_name=task_name, skip=skip, limit=limit,
         sort_order=sort_order,
         _status=status, due_date_from=due_date_from, due_date_to=due_date_to,
-        activity_type_id=activity_type_id, assigned_to_id=assigned_to_id
+        activity_type_id=activity_type_id, assigned_to_id=assigned_to_id, cursor=cursor,
+        if_none_match_header=if_none_match
+    )
+
+
+@router.get("/tasks/search", response_model=ResponseWrapper[List[TaskSearchResponse]], tags=["Task Activity"],
+            dependencies=[Depends(query_budget(3))])
+async def search_tasks(
+        q: str = Query(..., min_length=1, description="Search terms, web search syntax (quotes, OR, -word)"),
+        task_type: str = Query("created", enum=["created", "assigned"]),
+        limit: int = 10,
+        cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+        db: AsyncSession = Depends(get_read_db),
+        current_user: UserPrincipal = Depends(get_current_user)
+):
+    return await task_impl.search_tasks(
+        db, current_user=current_user, query_text=q, task_type=task_type, limit=limit, cursor=cursor
     )
 
 
-@router.get("/tasks/{task_id}", response_model=ResponseWrapper[TaskResponse], tags=["Task Activity"])
-async def get_task_by_id(task_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    return await task_impl.get_task_by_id(db, task_id=task_id, current_user=current_user)
+@router.get("/tasks/{task_id}", response_model=ResponseWrapper[TaskResponse], tags=["Task Activity"],
+            dependencies=[Depends(query_budget(3))])
+async def get_task_by_id(task_id: int, if_none_match: Optional[str] = Header(None), db: AsyncSession = Depends(get_read_db),
+                         current_user: UserPrincipal = Depends(get_current_user)):
+    return await task_impl.get_task_by_id(db, task_id=task_id, current_user=current_user,
+                                          if_none_match_header=if_none_match)
 
 
-@router.put("/tasks/{task_id}", response_model=ResponseWrapper[TaskResponse], tags=["Task Activity"])
-async def update_task(task_id: int, task: TaskActivityCreate, db: Session = Depends(get_db),
-                      current_user: User = Depends(get_current_user)):
-    return await task_impl.update_task(db, task_id=task_id, task_data=task.dict(), current_user=current_user)
+@router.put("/tasks/{task_id}", response_model=ResponseWrapper[TaskResponse], tags=["Task Activity"],
+            dependencies=[Depends(query_budget(13))])
+async def update_task(task_id: int, task: TaskActivityCreate, response: Response, if_match: Optional[str] = Header(None),
+                      db: AsyncSession = Depends(get_async_db), current_user: UserPrincipal = Depends(get_current_user)):
+    updated = await task_impl.update_task(db, task_id=task_id, task_data=task.dict(), current_user=current_user,
+                                          if_match_header=if_match)
+    # The new version's validator, usable as If-Match for the next update
+    response.headers["ETag"] = task_etag(updated.values.task_id, updated.values.modified_on)
+    return updated
 
 
-@router.delete("/tasks/{task_id}", response_model=ResponseWrapper, tags=["Task Activity"])
-async def delete_task_api(task_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+@router.delete("/tasks/{task_id}", response_model=ResponseWrapper, tags=["Task Activity"],
+               dependencies=[Depends(query_budget(5))])
+async def delete_task_api(task_id: int, db: AsyncSession = Depends(get_async_db), current_user: UserPrincipal = Depends(get_current_user)):
     return await task_impl.delete_task(db, task_id=task_id, current_user=current_user)
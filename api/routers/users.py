@@ -1,6 +1,8 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from ..database import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..database import get_async_db
+from ..replicas import get_read_db
+from ..query_tracker import query_budget
 from ..crud_users import UserImpl
 from ..schemas import UserCreate, UserResponse, UserCreatedResponse, UsersResponse
 
@@ -8,16 +10,19 @@ router = APIRouter()
 user_impl = UserImpl()
 
 
-@router.post("/users", response_model=UserCreatedResponse, tags=["User Activity"])
-async def create_user_api(user_data: UserCreate, db: Session = Depends(get_db)):
+@router.post("/users", response_model=UserCreatedResponse, tags=["User Activity"],
+             dependencies=[Depends(query_budget(2))])
+async def create_user_api(user_data: UserCreate, db: AsyncSession = Depends(get_async_db)):
     return await user_impl.create_user(db, user_data)
 
 
-@router.get("/users", response_model=list[UsersResponse], tags=["User Activity"])
-async def list_of_users(skip: int = 0, limit: int = 10, db: Session = Depends(get_db)):
+@router.get("/users", response_model=list[UsersResponse], tags=["User Activity"],
+            dependencies=[Depends(query_budget(1))])
+async def list_of_users(skip: int = 0, limit: int = 10, db: AsyncSession = Depends(get_read_db)):
     return await user_impl.get_users(db, skip=skip, limit=limit)
 
 
-@router.get("/users/{user_id}", response_model=UsersResponse, tags=["User Activity"])
-async def get_user_by_id(user_id: int, db: Session = Depends(get_db)):
+@router.get("/users/{user_id}", response_model=UsersResponse, tags=["User Activity"],
+            dependencies=[Depends(query_budget(1))])
+async def get_user_by_id(user_id: int, db: AsyncSession = Depends(get_read_db)):
     return await  user_impl.get_user(db, user_id=user_id)
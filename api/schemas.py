@@ -12,6 +12,7 @@ T = TypeVar('T')
 class ResponseWrapper(GenericModel, Generic[T]):
     status_code: int
     values: T
+    next_cursor: Optional[str] = None  # Set on paginated lists when another page may follow
 
     class Config:
         arbitrary_types_allowed = True
@@ -60,6 +61,20 @@ class TaskCreatedResponse(TaskBase):
         orm_mode = True
 
 
+class BulkTaskCreated(TaskCreatedResponse):
+    index: int  # Position of the task in the request payload
+
+
+class BulkTaskError(BaseModel):
+    index: int
+    errors: List[dict]
+
+
+class BulkTaskCreateResponse(BaseModel):
+    created: List[BulkTaskCreated]
+    errors: List[BulkTaskError]
+
+
 class TaskResponse(TaskBase):
     task_id: int
     activity_type_id: int
@@ -81,6 +96,13 @@ class TaskResponse(TaskBase):
         orm_mode = True
 
 
+class TaskSearchResponse(TaskResponse):
+    rank: float
+    task_name_highlight: Optional[str]
+    task_description_highlight: Optional[str]
+    notes_highlight: Optional[str]
+
+
 class UserCreate(BaseModel):
     username: str
     email: EmailStr
@@ -101,6 +123,18 @@ class UserResponse(BaseModel):
         orm_mode = True
 
 
+class UserPrincipal(BaseModel):
+    id: int
+    username: str
+    email: str
+    is_admin: Optional[bool] = False
+    is_active: Optional[bool] = True
+
+    class Config:
+        orm_mode = True
+        allow_mutation = False
+
+
 class UserCreatedResponse(BaseModel):
     message: str
     user: UserResponse
@@ -140,3 +174,23 @@ class TaskDataResponse(BaseModel):
 class TaskHistoryDetailsResponse(BaseModel):
     previous_data_value: TaskDataResponse
     latest_data_value: TaskDataResponse
+
+
+class TaskTimelineEntry(BaseModel):
+    id: int
+    version: int
+    action: str
+    is_snapshot: bool
+    modified_by_id: int
+    modified_by: str
+    created_at: datetime
+    previous_data: Optional[dict] = None
+    new_data: Optional[dict] = None
+
+
+class TaskAsOfResponse(BaseModel):
+    task_id: int
+    as_of: datetime
+    version: int
+    changed_at: datetime
+    data: dict
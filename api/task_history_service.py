@@ -1,33 +1,78 @@
-import json
 import logging
+from datetime import datetime, timezone
+from typing import Optional
 
 from fastapi import HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import select, func, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from api.models import TaskHistory, User
-from api.schemas import TaskHistoryResponse, ResponseWrapper, TaskHistoryDetailsResponse, TaskDataResponse
+from api.models import TaskActivity, TaskHistory, User
+from api.pagination import encode_cursor, decode_cursor, cursor_datetime, cursor_int
+from api.schemas import TaskHistoryResponse, ResponseWrapper, TaskHistoryDetailsResponse, TaskDataResponse, \
+    TaskAsOfResponse, TaskTimelineEntry
 
 logger = logging.getLogger(__name__)
 
 
+def apply_history_entry(state: dict, new_data: Optional[dict], is_snapshot: bool) -> dict:
+    """Return the task state after a history entry: a snapshot replaces it, a delta is merged into it."""
+    if is_snapshot:
+        return dict(new_data or {})
+    return {**state, **(new_data or {})}
+
+
 class TasksHistory():
 
     def __init__(self):
         pass
 
+    @staticmethod
+    def _to_naive_utc(value: Optional[datetime]):
+        """created_at is stored as naive UTC"""
+        if value is not None and value.tzinfo is not None and value.tzinfo.utcoffset(value) is not None:
+            return value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+    @staticmethod
+    def _for_task(task_id: int):
+        """Conditions selecting one task's entries. History never predates the task, so bounding created_at by
+        the task's creation lets Postgres skip the older monthly partitions at execution time."""
+        created_on = select(TaskActivity.created_on).where(TaskActivity.task_id == task_id).scalar_subquery()
+        return TaskHistory.task_id == task_id, TaskHistory.created_at >= created_on
+
     @staticmethod
     def _get_order_by_clause(sort_order: str):
-        """Return the order by clause based on the sort order."""
+        """Return the order by clause based on the sort order, the id breaks ties between equal timestamps."""
         if sort_order == "asc":
-            return TaskHistory.created_at.asc()
-        return TaskHistory.created_at.desc()
+            return TaskHistory.created_at.asc(), TaskHistory.id.asc()
+        return TaskHistory.created_at.desc(), TaskHistory.id.desc()
+
+    def _paginate(self, query, sort_order: str, skip: int, limit: int, cursor: Optional[str]):
+        """Order the entries and apply keyset pagination when a cursor is given, offset pagination otherwise."""
+        query = query.order_by(*self._get_order_by_clause(sort_order))
+        if cursor:
+            values = decode_cursor(cursor)
+            last = tuple_(cursor_datetime(values, "created_at"), cursor_int(values, "id"))
+            position = tuple_(TaskHistory.created_at, TaskHistory.id)
+            query = query.where(position > last if sort_order == "asc" else position < last)
+            return query.limit(limit)
+        return query.offset(skip).limit(limit)
 
     @staticmethod
-    def _format_entry(entry: TaskHistory, user_name: str):
-        """Format a single task history entry."""
-        new_data = json.loads(entry.new_data) if entry.new_data else {}
-        task_name = new_data.get("task_name", "N/A")
-        _status = new_data.get("status", "N/A")
+    def _next_cursor(entries, limit: int) -> Optional[str]:
+        """Cursor of the last entry when the page is full, so the client knows there may be more."""
+        if len(entries) < limit:
+            return None
+        return encode_cursor({"created_at": entries[-1].created_at, "id": entries[-1].id})
+
+    @staticmethod
+    def _format_entry(entry: TaskHistory, user_name: str, current_name: Optional[str] = None,
+                      current_status: Optional[str] = None):
+        """Format a single task history entry, falling back to the task's current name and status
+        when the entry did not change them."""
+        new_data = entry.new_data or {}
+        task_name = new_data.get("task_name", current_name or "N/A")
+        _status = new_data.get("status", current_status or "N/A")
 
         return {
             "Activity_Object": new_data,
@@ -37,11 +82,6 @@ class TasksHistory():
             "Created_at": entry.created_at
         }
 
-    @staticmethod
-    def _get_deserialized_data(data):
-        """Helper method to deserialize JSON data."""
-        return json.loads(data) if data else {}
-
     @staticmethod
     def _create_task_history_detail(field_name, previous_value, latest_value):
         """Helper method to create TaskHistoryDetailsResponse."""
@@ -51,79 +91,133 @@ class TasksHistory():
             latest_data_value=latest_value
         )
 
-    @staticmethod
-    def _get_user_name(db: Session, user_id: int):
-        """Fetch the user's name using the user_id."""
-        user = db.query(User).filter(User.id == user_id).first()
-        return user.name if user else "N/A"
-
-    @staticmethod
-    def _get_deserialized_data(data):
-        """Helper method to deserialize JSON data."""
-        return json.loads(data) if data else {}
-
-    @staticmethod
-    def _get_user_name(db: Session, user_id: int):
-        """Fetch the user's name using the user_id."""
-        user = db.query(User).filter(User.id == user_id).first()
-        return user.username if user else "N/A"
-
     async def get_all_task_histories(self,
-                                     db: Session,
+                                     db: AsyncSession,
                                      skip: int = 0,
                                      limit: int = 10,
-                                     sort_order: str = 'asc'):
+                                     sort_order: str = 'asc',
+                                     task_id: Optional[int] = None,
+                                     modified_by_id: Optional[int] = None,
+                                     action: Optional[str] = None,
+                                     created_from: Optional[datetime] = None,
+                                     created_to: Optional[datetime] = None,
+                                     cursor: Optional[str] = None):
         """Get all task histories."""
         try:
-            # Get the order by clause
-            order_by_clause = self._get_order_by_clause(sort_order)
+            # Join the user who modified the task, and the task for fields the entry did not change
+            query = (
+                select(TaskHistory, User.username, TaskActivity.task_name, TaskActivity.status)
+                .join(User, TaskHistory.modified_by_id == User.id)
+                .join(TaskActivity, TaskHistory.task_id == TaskActivity.task_id)
+            )
+
+            # Apply the optional filters
+            if task_id:
+                query = query.where(*self._for_task(task_id))
+            if modified_by_id:
+                query = query.where(TaskHistory.modified_by_id == modified_by_id)
+            if action:
+                query = query.where(TaskHistory.action == action)
+            if created_from:
+                query = query.where(TaskHistory.created_at >= self._to_naive_utc(created_from))
+            if created_to:
+                query = query.where(TaskHistory.created_at <= self._to_naive_utc(created_to))
 
-            # Join TaskHistory with User table to get the name of the user who modified the task
-            history_entries = db.query(TaskHistory, User.username).join(User, TaskHistory.modified_by_id == User.id) \
-                .order_by(order_by_clause).offset(skip).limit(limit).all()
+            result = await db.execute(self._paginate(query, sort_order, skip, limit, cursor))
+            history_entries = result.all()
 
             # Format the response using the fetched User.name
-            formatted_response = [self._format_entry(entry[0], entry[1]) for entry in history_entries]
+            formatted_response = [self._format_entry(*entry) for entry in history_entries]
 
             return ResponseWrapper(
                 status_code=status.HTTP_200_OK,
-                values=formatted_response
+                values=formatted_response,
+                next_cursor=self._next_cursor([entry[0] for entry in history_entries], limit)
             )
 
+        except HTTPException as http_exc:
+            logger.error(f"HTTP error fetching task histories: {http_exc.detail}")
+            raise http_exc
+
         except Exception as e:
             logger.error(f"Error fetching task histories: {str(e)}")
             raise
 
-    async def get_task_history_details(self, task_id: int, db: Session):
+    async def get_task_timeline(self, task_id: int, db: AsyncSession, limit: int = 20, sort_order: str = 'desc',
+                                cursor: Optional[str] = None):
+        """Get the history of one task, page by page, with the name of the user behind each entry"""
+        try:
+            query = (
+                select(TaskHistory, User.username)
+                .join(User, TaskHistory.modified_by_id == User.id)
+                .where(*self._for_task(task_id))
+            )
+            result = await db.execute(self._paginate(query, sort_order, 0, limit, cursor))
+            history_entries = result.all()
+
+            timeline = [
+                TaskTimelineEntry(
+                    id=entry.id,
+                    version=entry.version,
+                    action=entry.action,
+                    is_snapshot=entry.is_snapshot,
+                    modified_by_id=entry.modified_by_id,
+                    modified_by=user_name,
+                    created_at=entry.created_at,
+                    previous_data=entry.previous_data,
+                    new_data=entry.new_data
+                )
+                for entry, user_name in history_entries
+            ]
+
+            return ResponseWrapper(
+                status_code=status.HTTP_200_OK,
+                values=timeline,
+                next_cursor=self._next_cursor([entry for entry, _ in history_entries], limit)
+            )
+
+        except HTTPException as http_exc:
+            logger.error(f"HTTP error fetching the history of task {task_id}: {http_exc.detail}")
+            raise http_exc
+
+        except Exception as e:
+            logger.error(f"Error fetching the history of task {task_id}: {str(e)}")
+            raise HTTPException(status_code=500, detail=str(e))
+
+    async def get_task_history_details(self, task_id: int, db: AsyncSession):
         """Get details of the task history"""
         try:
-            task_history = db.query(TaskHistory).filter(TaskHistory.task_id == task_id).all()
+            # Only the two latest entries are needed, fetched with their user names and the current task status
+            result = await db.execute(
+                select(TaskHistory, User.username, TaskActivity.status)
+                .join(User, TaskHistory.modified_by_id == User.id)
+                .join(TaskActivity, TaskHistory.task_id == TaskActivity.task_id)
+                .where(*self._for_task(task_id))
+                .order_by(TaskHistory.version.desc())
+                .limit(2)
+            )
+            task_history = result.all()
 
             if not task_history:
                 raise HTTPException(status_code=404, detail="Task history not found")
 
-            # Take the latest task history and previous one, assuming you want the first two records
-            latest_task = task_history[-1]
-            previous_task = task_history[-2] if len(task_history) > 1 else None  # Check if a previous task exists
-
-            # Deserialize previous and latest data
-            latest_data = self._get_deserialized_data(latest_task.new_data)
-            previous_data = self._get_deserialized_data(previous_task.previous_data) if previous_task else {}
+            latest_task, latest_user_name, current_status = task_history[0]
+            previous_task, previous_user_name, _ = task_history[1] if len(task_history) > 1 else (None, "N/A", None)
 
-            # Fetch user names
-            latest_user_name = self._get_user_name(db, latest_task.modified_by_id)
-            previous_user_name = self._get_user_name(db, previous_task.modified_by_id) if previous_task else "N/A"
+            # The latest entry leads to the current task, and its previous_data holds what it changed
+            latest_status = current_status
+            previous_status = (latest_task.previous_data or {}).get("status", current_status) if previous_task else "N/A"
 
             # Construct the response
             task_history_response = TaskHistoryDetailsResponse(
                 previous_data_value=TaskDataResponse(
-                    status=previous_data.get("status", "N/A"),
+                    status=previous_status,
                     created_by=previous_user_name,
-                    created_at=previous_task.created_at.strftime("%m/%d/%y %H:%M")
+                    created_at=previous_task.created_at.strftime("%m/%d/%y %H:%M") if previous_task else None
 
                 ),
                 latest_data_value=TaskDataResponse(
-                    status=latest_data.get("status", "N/A"),
+                    status=latest_status,
                     created_by=latest_user_name,
                     created_at=latest_task.created_at.strftime("%m/%d/%y %H:%M")
                 )
@@ -135,6 +229,57 @@ class TasksHistory():
                 values=task_history_response
             )
 
+        except HTTPException as http_exc:
+            logger.error(f"HTTP error fetching task history details: {http_exc.detail}")
+            raise http_exc
+
         except Exception as e:
             logger.error(f"Error fetching task history details: {str(e)}")
             raise HTTPException(status_code=500, detail=str(e))
+
+    async def get_task_as_of(self, task_id: int, as_of: datetime, db: AsyncSession):
+        """Reconstruct a task as it was at a point in time from its nearest snapshot and the deltas after it"""
+        try:
+            as_of = self._to_naive_utc(as_of)
+
+            target_version = select(func.max(TaskHistory.version)).where(
+                *self._for_task(task_id), TaskHistory.created_at <= as_of
+            ).scalar_subquery()
+            snapshot_version = select(func.max(TaskHistory.version)).where(
+                *self._for_task(task_id), TaskHistory.created_at <= as_of, TaskHistory.is_snapshot,
+                TaskHistory.version <= target_version
+            ).scalar_subquery()
+
+            result = await db.execute(
+                select(TaskHistory.version, TaskHistory.is_snapshot, TaskHistory.new_data, TaskHistory.created_at)
+                .where(*self._for_task(task_id), TaskHistory.created_at <= as_of,
+                       TaskHistory.version.between(snapshot_version, target_version))
+                .order_by(TaskHistory.version)
+            )
+            entries = result.all()
+
+            if not entries:
+                raise HTTPException(status_code=404, detail=f"Task {task_id} has no history at {as_of.isoformat()}")
+
+            state = {}
+            for entry in entries:
+                state = apply_history_entry(state, entry.new_data, entry.is_snapshot)
+
+            return ResponseWrapper(
+                status_code=status.HTTP_200_OK,
+                values=TaskAsOfResponse(
+                    task_id=task_id,
+                    as_of=as_of,
+                    version=entries[-1].version,
+                    changed_at=entries[-1].created_at,
+                    data=state
+                )
+            )
+
+        except HTTPException as http_exc:
+            logger.error(f"HTTP error reconstructing task {task_id} as of {as_of}: {http_exc.detail}")
+            raise http_exc
+
+        except Exception as e:
+            logger.error(f"Error reconstructing task {task_id} as of {as_of}: {str(e)}")
+            raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,63 @@
+from collections import namedtuple
+from functools import lru_cache
+from typing import Iterable, List, Optional
+
+from fastapi import status
+from fastapi.responses import ORJSONResponse
+
+from .models import TaskActivity
+from .schemas import TaskResponse
+
+# The columns behind TaskResponse, selected as plain rows instead of hydrating TaskActivity objects
+TASK_RESPONSE_COLUMNS = tuple(getattr(TaskActivity, name) for name in TaskResponse.__fields__)
+
+# Values pydantic accepts as true for a bool field, favorite is stored as text
+_TRUE_VALUES = {"true", "1", "yes", "on", "t", "y"}
+
+
+def favorite_to_bool(value) -> Optional[bool]:
+    if value is None:
+        return None
+    return str(value).lower() in _TRUE_VALUES
+
+
+@lru_cache(maxsize=None)
+def _row_type(keys: tuple):
+    return namedtuple("TaskRow", keys)
+
+
+def rows_to_values(rows) -> list:
+    """Plain tuples of selected rows, compact enough to cache"""
+    return [tuple(row) for row in rows]
+
+
+def rows_from_values(columns: tuple, values: list) -> list:
+    """Rebuild cached tuples as rows with the same attributes and _asdict() as the selected ones"""
+    row_type = _row_type(tuple(column.key for column in columns))
+    return [row_type._make(row) for row in values]
+
+
+def task_row_to_dict(row) -> dict:
+    """JSON ready TaskResponse fields of a row selected with TASK_RESPONSE_COLUMNS"""
+    values = row._asdict()
+    values["favorite"] = favorite_to_bool(values["favorite"])
+    return values
+
+
+def _etag_headers(etag: Optional[str]) -> Optional[dict]:
+    return {"ETag": etag} if etag else None
+
+
+def task_list_response(rows: Iterable, next_cursor: Optional[str] = None, etag: Optional[str] = None) -> ORJSONResponse:
+    """ResponseWrapper[List[TaskResponse]] encoded straight from the rows, skipping the response model validation"""
+    values: List[dict] = [task_row_to_dict(row) for row in rows]
+    return ORJSONResponse(content={"status_code": status.HTTP_200_OK, "values": values, "next_cursor": next_cursor},
+                          headers=_etag_headers(etag))
+
+
+def task_detail_response(row, etag: Optional[str] = None) -> ORJSONResponse:
+    """ResponseWrapper[TaskResponse] encoded straight from the row"""
+    return ORJSONResponse(
+        content={"status_code": status.HTTP_200_OK, "values": task_row_to_dict(row), "next_cursor": None},
+        headers=_etag_headers(etag)
+    )
@@ -1,23 +1,27 @@
 import logging
 import os
-import smtplib
-from concurrent.futures import ThreadPoolExecutor
-from email.mime.text import MIMEText
 from typing import List, Optional
 
 from fastapi import HTTPException, status
 
-from sqlalchemy import desc, asc
-from sqlalchemy.orm import Session
-from sqlalchemy.exc import SQLAlchemyError
-
-from .constant import activity_type_id, activity_group_id, stage_id, core_group_id, assigned_to_id, created, assigned, \
-    due_data, Modified, Added
-from .models import TaskActivity, TaskHistory, User, Attachment, ActivityType, ActivityGroup, Stage, CoreGroup
+from sqlalchemy import desc, asc, select, insert, update, tuple_, func, literal, Float
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .constant import created, assigned, due_data, Modified, Added
+from .pagination import encode_cursor, decode_cursor, cursor_datetime, cursor_int
+from .email_outbox import build_task_assigned_email, enqueue_email
+from .history_writer import history_writer
+from .task_serialization import TASK_RESPONSE_COLUMNS, task_list_response, task_detail_response, rows_to_values, \
+    rows_from_values
+from .query_cache import query_cache
+from .replicas import is_replica_session
+from .etag import task_etag, list_etag, if_none_match, not_modified, check_if_match
+from .validation_service import reference_validator
+from .models import TaskActivity, User, Attachment
 from datetime import datetime, timezone
-import json
 
-from .schemas import TaskResponse, ResponseWrapper, TaskCreatedResponse, AttachmentCreate, TaskActivityCreate
+from .schemas import TaskResponse, ResponseWrapper, TaskCreatedResponse, AttachmentCreate, TaskActivityCreate, \
+    TaskSearchResponse, BulkTaskCreated, BulkTaskError, BulkTaskCreateResponse, UserPrincipal
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -25,60 +29,23 @@ load_dotenv()
 # Configure logging
 logger = logging.getLogger(__name__)
 
+BULK_CREATE_MAX_TASKS = int(os.getenv("BULK_CREATE_MAX_TASKS", "5000"))
+# Every Nth history entry of a task stores the whole task instead of the changed fields
+HISTORY_SNAPSHOT_INTERVAL = int(os.getenv("HISTORY_SNAPSHOT_INTERVAL", "20"))
 
-class TaskActivityImpl:
-    def __init__(self):
-        pass
+# Columns that are not part of the recorded task state
+HISTORY_EXCLUDED_COLUMNS = {"task_id", "history_version"}
 
-    @staticmethod
-    def validate_core_group(db: Session, core_group_id: int):
-        core_group = db.query(CoreGroup).filter(CoreGroup.id == core_group_id).first()
-        if not core_group:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Core group with id {core_group_id} does not exist."
-            )
-        return core_group
-
-    @staticmethod
-    def validate_activity_type(db: Session, activity_type_id: int):
-        activity_type = db.query(ActivityType).filter(ActivityType.id == activity_type_id).first()
-        if not activity_type:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Activity type with id {activity_type_id} does not exist."
-            )
-        return activity_type
+# Enough to compute the ETag of a task or a list page without loading the tasks
+TASK_VALIDATOR_COLUMNS = (TaskActivity.task_id, TaskActivity.modified_on)
 
-    @staticmethod
-    def validate_assign_user(db: Session, user_id: int):
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"User with id {user_id} does not exist to assign."
-            )
-        return user
+SEARCH_CONFIG = 'english'
+HIGHLIGHT_OPTIONS = 'StartSel=<mark>, StopSel=</mark>, MaxFragments=2, MaxWords=20, MinWords=5'
 
-    @staticmethod
-    def validate_stage(db: Session, stage_id: int):
-        stage = db.query(Stage).filter(Stage.id == stage_id).first()
-        if not stage:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Stage with id {stage_id} does not exist."
-            )
-        return stage
 
-    @staticmethod
-    def validate_activity_group(db: Session, activity_group_id: int):
-        activity_group = db.query(ActivityGroup).filter(ActivityGroup.id == activity_group_id).first()
-        if not activity_group:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Activity group with id {activity_group_id} does not exist."
-            )
-        return activity_group
+class TaskActivityImpl:
+    def __init__(self):
+        pass
 
     """Validate due date"""
     @staticmethod
@@ -98,44 +65,34 @@ class TaskActivityImpl:
                 )
         return True
 
-    """Validate fields asynchronously using a ThreadPoolExecutor"""
-    def run_validations(self, db: Session, task_data: dict):
-        # Use ThreadPoolExecutor to validate fields concurrently
-        with ThreadPoolExecutor() as executor:
-            validation_tasks = []
-
-            if task_data.get(activity_type_id) is not None:
-                validation_tasks.append(executor.submit(self.validate_activity_type, db, task_data[activity_type_id]))
-
-            if task_data.get(activity_group_id) is not None:
-                validation_tasks.append(
-                    executor.submit(self.validate_activity_group, db, task_data[activity_group_id]))
-
-            if task_data.get(stage_id) is not None:
-                validation_tasks.append(executor.submit(self.validate_stage, db, task_data[stage_id]))
-
-            if task_data.get(core_group_id) is not None:
-                validation_tasks.append(executor.submit(self.validate_core_group, db, task_data[core_group_id]))
-
-            if task_data.get(assigned_to_id) is not None:
-                validation_tasks.append(executor.submit(self.validate_assign_user, db, task_data[assigned_to_id]))
+    """Validate every referenced id with a single statement, reporting all invalid fields at once"""
+    @staticmethod
+    async def run_validations(db: AsyncSession, task_data: dict):
+        await reference_validator.validate(db, task_data)
 
-                # Collect the results
-            for future in validation_tasks:
-                future.result()  # Raise any exception
+    """Timestamps are stored without time zone, asyncpg rejects aware datetimes for them so store naive UTC"""
+    @staticmethod
+    def _to_naive_utc(value: Optional[datetime]):
+        if value is not None and value.tzinfo is not None and value.tzinfo.utcoffset(value) is not None:
+            return value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
 
-    """Create a task entry in the database"""
+    """Favorite is stored as a string column, asyncpg will not coerce booleans for it"""
     @staticmethod
-    def _create_task_entry_and_save(db: Session, task_data, user_id: int):
-        task = TaskActivity(
+    def _favorite_to_column(favorite):
+        return None if favorite is None else str(favorite).lower()
+
+    """Column values of a new task, shared by single and bulk creation"""
+    def _new_task_values(self, task_data, user_id: int, now: datetime) -> dict:
+        return dict(
             task_name=task_data.task_name,
             task_description=task_data.task_description,
             created_by_id=user_id,
-            created_on=datetime.utcnow(),
-            modified_on=datetime.utcnow(),
+            created_on=now,
+            modified_on=now,
             status=task_data.status,
-            favorite=task_data.favorite,
-            due_date=task_data.due_date,
+            favorite=self._favorite_to_column(task_data.favorite),
+            due_date=self._to_naive_utc(task_data.due_date),
             action_type=task_data.action_type,
             activity_type_id=task_data.activity_type_id,
             activity_group_id=task_data.activity_group_id,
@@ -145,28 +102,33 @@ class TaskActivityImpl:
             notes=task_data.notes,
             link_response_ids=task_data.link_response_ids,
             link_object_ids=task_data.link_object_ids,
+            history_version=1,
         )
+
+    """Create a task entry in the session, flushing only to obtain its id"""
+    async def _create_task_entry(self, db: AsyncSession, task_data, user_id: int):
+        task = TaskActivity(**self._new_task_values(task_data, user_id, datetime.utcnow()))
         db.add(task)
-        db.commit()
-        db.refresh(task)
+        await db.flush()
         return task
 
-    """Updated _handle_attachments method"""
-
+    """Insert attachment rows with multi-row INSERT ... RETURNING, ids come back in the order of the rows"""
     @staticmethod
-    def _handle_attachments(db: Session, task: TaskActivity, attachments: List[AttachmentCreate]):
+    async def _insert_attachments(db: AsyncSession, rows: List[dict]) -> List[int]:
+        if not rows:
+            return []
+        result = await db.execute(
+            insert(Attachment).returning(Attachment.id, sort_by_parameter_order=True), rows
+        )
+        return list(result.scalars().all())
+
+    """Insert the attachments of a task in one statement, without committing the caller's transaction"""
+
+    async def _handle_attachments(self, db: AsyncSession, task: TaskActivity, attachments: List[AttachmentCreate]):
         if attachments:
-            attachment_ids = []
-            for attachment_data in attachments:
-                # Access the file_name using dot notation instead of brackets
-                attachment = Attachment(
-                    task_id=task.task_id,
-                    file_name=attachment_data.file_name
-                )
-                db.add(attachment)
-                db.commit()  # Commit to generate the attachment ID
-                attachment_ids.append(attachment.id)  # Collect attachment ID
-            return attachment_ids
+            return await self._insert_attachments(
+                db, [{"task_id": task.task_id, "file_name": attachment.file_name} for attachment in attachments]
+            )
         return []
 
     @staticmethod
@@ -184,21 +146,44 @@ class TaskActivityImpl:
         )
 
     @staticmethod
-    def check_user_auth(current_user: User):
+    def check_user_auth(current_user: UserPrincipal):
         if not current_user:
             logger.warning("Unauthorized access attempt")
             raise HTTPException(status_code=401, detail="Unauthorized")
 
-    """ Helper method to determine sorting order"""
+    """ Helper method to determine sorting order, task_id breaks ties so keyset pages are stable"""
 
     @staticmethod
     def get_sort_order(sort_order: str):
-        return asc(TaskActivity.created_on) if sort_order == "asc" else desc(TaskActivity.created_on)
+        if sort_order == "asc":
+            return asc(TaskActivity.created_on), asc(TaskActivity.task_id)
+        return desc(TaskActivity.created_on), desc(TaskActivity.task_id)
+
+    """Helper methods to convert between the last task of a page and its keyset cursor"""
+
+    @staticmethod
+    def encode_task_cursor(task: TaskActivity) -> str:
+        return encode_cursor({"created_on": task.created_on, "task_id": task.task_id})
+
+    @staticmethod
+    def decode_task_cursor(cursor: str):
+        values = decode_cursor(cursor)
+        return cursor_datetime(values, "created_on"), cursor_int(values, "task_id")
+
+    """Helper method to restrict tasks to the ones created by or assigned to the user"""
+
+    @staticmethod
+    def _visibility_filter(query, user_id: int, task_type: str):
+        if task_type == created:
+            return query.where(TaskActivity.created_by_id == user_id)  # Get tasks created by the current user
+        if task_type == assigned:
+            return query.where(TaskActivity.assigned_to_id == user_id)  # Get tasks assigned to the user
+        return query
 
     """Helper method to fetch tasks (created or assigned)"""
 
-    def query_tasks(self,
-                    db: Session,
+    async def query_tasks(self,
+                    db: AsyncSession,
                     user_id: int,
                     task_type: str,
                     skip: int,
@@ -209,44 +194,74 @@ class TaskActivityImpl:
                     due_date_to: Optional[datetime] = None,
                     task_name: Optional[str] = None,
                     activity_type_id: Optional[int] = None,
-                    assigned_to_id: Optional[int] = None
+                    assigned_to_id: Optional[int] = None,
+                    cursor: Optional[str] = None,
+                    columns: tuple = TASK_RESPONSE_COLUMNS
                     ):
-        query = db.query(TaskActivity)
+        cache_key = None
+        if query_cache.enabled:
+            # Same user, filters and page as an earlier request since the user's tasks last changed
+            cache_key = await query_cache.key("tasks", user_id, {
+                "task_type": task_type, "skip": None if cursor else skip, "limit": limit, "sort_order": sort_order,
+                "status": status, "due_date_from": due_date_from, "due_date_to": due_date_to, "task_name": task_name,
+                "activity_type_id": activity_type_id, "assigned_to_id": assigned_to_id, "cursor": cursor,
+                "columns": [column.key for column in columns],
+            })
+            # Cache failures are logged by query_cache and answered as a miss, the query below still runs
+            cached = await query_cache.get(cache_key) if cache_key is not None else None
+            if cached is not None:
+                return rows_from_values(columns, cached)
+
+        # Only the requested columns, as rows rather than TaskActivity objects
+        query = select(*columns)
 
         # Filter by task type (created or assigned)
-        if task_type == created:
-            query = query.filter(TaskActivity.created_by_id == user_id)  # Get tasks created by the current user
-        elif task_type == assigned:
-            query = query.filter(TaskActivity.assigned_to_id == user_id)  # Get tasks assigned to the user
+        query = self._visibility_filter(query, user_id, task_type)
 
         # Apply additional filters dynamically based on the presence of query parameters
         if status:
-            query = query.filter(TaskActivity.status == status)  # Filter by task status
+            query = query.where(TaskActivity.status == status)  # Filter by task status
         if due_date_from:
-            query = query.filter(TaskActivity.due_date >= due_date_from)  # Filter by tasks due after 'due_date_from'
+            query = query.where(TaskActivity.due_date >= self._to_naive_utc(due_date_from))  # Filter by tasks due after 'due_date_from'
         if due_date_to:
-            query = query.filter(TaskActivity.due_date <= due_date_to)  # Filter by tasks due before 'due_date_to'
+            query = query.where(TaskActivity.due_date <= self._to_naive_utc(due_date_to))  # Filter by tasks due before 'due_date_to'
         if task_name:
-            query = query.filter(
+            query = query.where(
                 TaskActivity.task_name.ilike(f"%{task_name}%"))  # Filter by task name (case-insensitive)
         if activity_type_id:
-            query = query.filter(TaskActivity.activity_type_id == activity_type_id)
+            query = query.where(TaskActivity.activity_type_id == activity_type_id)
         if assigned_to_id:
-            query = query.filter(TaskActivity.assigned_to_id == assigned_to_id)
+            query = query.where(TaskActivity.assigned_to_id == assigned_to_id)
 
         # Sorting (ascending or descending order)
         order_by_clause = self.get_sort_order(sort_order)
-        query = query.order_by(order_by_clause)
-
-        # Pagination (skip and limit)
-        query = query.offset(skip).limit(limit)
-
-        return query.all()
+        query = query.order_by(*order_by_clause)
+
+        if cursor:
+            # Keyset pagination: seek past the last row of the previous page instead of skipping rows
+            last_created_on, last_task_id = self.decode_task_cursor(cursor)
+            position = tuple_(TaskActivity.created_on, TaskActivity.task_id)
+            if sort_order == "asc":
+                query = query.where(position > tuple_(last_created_on, last_task_id))
+            else:
+                query = query.where(position < tuple_(last_created_on, last_task_id))
+            query = query.limit(limit)
+        else:
+            # Pagination (skip and limit)
+            query = query.offset(skip).limit(limit)
+
+        result = await db.execute(query)
+        rows = result.all()
+        # A lagging replica may not have the write that bumped the generation yet; cached under the new
+        # generation its page would be served until the TTL, so only primary results are cached
+        if cache_key is not None and not is_replica_session(db):
+            await query_cache.set(cache_key, rows_to_values(rows))
+        return rows
 
     """ Helper method to wrap tasks in the response"""
 
     @staticmethod
-    def wrap_task_response(tasks: List[TaskActivity]):
+    def wrap_task_response(tasks: List[TaskActivity], next_cursor: Optional[str] = None):
         task_responses = []
 
         for task in tasks:
@@ -276,7 +291,8 @@ class TaskActivityImpl:
 
         return ResponseWrapper(
             status_code=status.HTTP_200_OK,
-            values=task_responses
+            values=task_responses,
+            next_cursor=next_cursor
         )
 
     # Helper method to apply task updates with handling of optional fields
@@ -289,99 +305,76 @@ class TaskActivityImpl:
         # Ensure the modified_on field is updated
         task.modified_on = datetime.utcnow()
 
+    """JSON ready values of a task's columns, as recorded in its history"""
     @staticmethod
-    def _get_previous_task_data(task: TaskActivity) -> dict:
-        return {
-            "task_name": task.task_name,
-            "task_description": task.task_description,
-            "activity_type_id": task.activity_type_id,
-            "activity_group_id": task.activity_group_id,
-            "stage_id": task.stage_id,
-            "core_group_id": task.core_group_id,
-            "due_date": task.due_date.isoformat() if task.due_date else None,
-            "action_type": task.action_type,
-            "status": task.status,
-            "link_response_ids": task.link_response_ids,
-            "link_object_ids": task.link_object_ids,
-            "notes": task.notes,
-            "attachment_ids": task.attachment_ids,
-            "favorite": task.favorite,
-            "created_by_id": task.created_by_id,
-            "assigned_to_id": task.assigned_to_id,
-            "created_on": task.created_on.isoformat(),
-            "modified_on": task.modified_on.isoformat()
-        }
+    def _task_state(task: TaskActivity) -> dict:
+        state = {}
+        # Generated columns such as the search vector are skipped
+        for column in TaskActivity.__table__.columns:
+            if column.computed is not None or column.name in HISTORY_EXCLUDED_COLUMNS:
+                continue
+            value = getattr(task, column.name)
+            state[column.name] = value.isoformat() if isinstance(value, datetime) else value
+        return state
 
     @staticmethod
-    def _check_task_permissions(task: TaskActivity, current_user: User):
+    def _check_task_permissions(task: TaskActivity, current_user: UserPrincipal):
         if task.created_by_id != current_user.id and task.assigned_to_id != current_user.id and not current_user.is_admin:
             logger.warning(f"Unauthorized update attempt on task {task.task_id} by user {current_user.id}")
             raise HTTPException(status_code=403, detail="You do not have permission to update this task")
 
     @staticmethod
-    def _get_task_by_id(db: Session, task_id: int) -> TaskActivity:
-        task = db.query(TaskActivity).filter(TaskActivity.task_id == task_id).first()
+    async def _get_task_by_id(db: AsyncSession, task_id: int, for_update: bool = False) -> TaskActivity:
+        query = select(TaskActivity).where(TaskActivity.task_id == task_id)
+        if for_update:
+            # Serialize concurrent updates so history versions and deltas stay consistent
+            query = query.with_for_update()
+        task = await db.scalar(query)
         if not task:
             raise HTTPException(status_code=404, detail=f"Task with ID {task_id} not found")
         return task
 
-    """Log task history"""
+    """Column values of a history entry, shared by single and bulk writes.
+    Only the changed fields are stored, except on snapshot entries which keep the whole new state"""
+    @staticmethod
+    def _history_values(task_id: int, action: str, user_id: int, version: int, previous_state: Optional[dict] = None,
+                        new_state: Optional[dict] = None) -> dict:
+        is_snapshot = previous_state is None or (version - 1) % HISTORY_SNAPSHOT_INTERVAL == 0
+        new_state = new_state or {}
+        if previous_state is None:
+            previous_data = None
+            changed = dict(new_state)
+        else:
+            changed = {key: value for key, value in new_state.items() if previous_state.get(key) != value}
+            previous_data = {key: previous_state.get(key) for key in changed}
+        return dict(
+            task_id=task_id, action=action, previous_data=previous_data,
+            new_data=new_state if is_snapshot else changed, version=version, is_snapshot=is_snapshot,
+            created_at=datetime.utcnow(),
+            modified_by_id=user_id  # Store the user who modified the task
+        )
 
-    async def log_task_history(self, db: Session, task_id: int, action: str, current_user: User, previous_data=None,
-                               new_data=None):
+    """Log task history through the history writer, in the caller's transaction or once it commits"""
+
+    async def log_task_history(self, db: AsyncSession, task: TaskActivity, action: str, current_user: UserPrincipal,
+                               previous_state: Optional[dict] = None):
         try:
-            # Convert previous_data and new_data from model objects to dictionaries if necessary
-            if previous_data and not isinstance(previous_data, dict):
-                previous_data = {column.name: getattr(previous_data, column.name) for column in
-                                 previous_data.__table__.columns}
-
-            if new_data and not isinstance(new_data, dict):
-                new_data = {column.name: getattr(new_data, column.name) for column in new_data.__table__.columns}
-
-            # Ensure data is JSON serializable
-            if previous_data:
-                previous_data = {key: (value.isoformat() if isinstance(value, datetime) else value) for key, value in
-                                 previous_data.items()}
-            if new_data:
-                new_data = {key: (value.isoformat() if isinstance(value, datetime) else value) for key, value in
-                            new_data.items()}
+            # The version lives on the task row, so numbering the entry needs no extra query
+            if previous_state is not None:
+                task.history_version = (task.history_version or 0) + 1
 
             # Log the history entry
-            history_entry = TaskHistory(
-                task_id=task_id, action=action, previous_data=json.dumps(previous_data) if previous_data else None,
-                new_data=json.dumps(new_data) if new_data else None, created_at=datetime.utcnow(),
-                modified_by_id=current_user.id  # Store the user who modified the task
-            )
-
-            db.add(history_entry)
-            db.commit()
+            await history_writer.write(db, [self._history_values(
+                task.task_id, action, current_user.id, task.history_version,
+                previous_state=previous_state, new_state=self._task_state(task)
+            )])
 
         except HTTPException as http_exc:
-            logger.error(f"HTTP error during user creation: {str(http_exc.detail)}")
             raise http_exc
-
-        except SQLAlchemyError as e:
-            logger.error(f"Error logging task history for task ID {task_id}: {str(e)}")
-            db.rollback()
-            raise HTTPException(status_code=500, detail="An error occurred while logging task history")
-
         except Exception as e:
-            logger.error(f"Unexpected error logging task history for task ID {task_id}: {str(e)}")
+            logger.error(f"Unexpected error logging task history for task ID {task.task_id}: {str(e)}")
             raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
 
-    @staticmethod
-    def _delete_task_history(db: Session, task_id: int):
-        try:
-            # Delete all history records associated with the task ID
-            db.query(TaskHistory).filter(TaskHistory.task_id == task_id).delete(synchronize_session=False)
-            db.commit()
-            logger.info(f"Deleted all history records for task ID {task_id}")
-
-        except SQLAlchemyError as e:
-            logger.error(f"Error deleting task history for task ID {task_id}: {str(e)}")
-            db.rollback()
-            raise HTTPException(status_code=500, detail="An error occurred while deleting task history")
-
     @staticmethod
     def _check_user_permission(current_user, task, task_id):
         # Check if the current user is either the creator, the assignee, or an admin
@@ -389,79 +382,59 @@ class TaskActivityImpl:
             logger.warning(f"Unauthorized access attempt for task {task_id} by user {current_user.id}")
             raise HTTPException(status_code=403, detail="You do not have access to this task")
 
+    """Queue the assignment emails in the outbox, they are sent once the surrounding transaction commits"""
     @staticmethod
-    def send_task_assigned_email(to_email: str, task_name: str, due_date: datetime, description: str, assignor: str):
-        # Email body
-        email_content = f"""
-        Hello,
-
-        You have been assigned a new task by: {assignor}
-        Task Name: {task_name}
-        Description: {description}
-        Due Date: {due_date.strftime('%Y-%m-%d %H:%M:%S')}
-
-        Please complete it before the due date.
-
-        Best Regards,
-        Task Management System
-        """
-
-        # Set up email content and headers
-        msg = MIMEText(email_content)
-        msg['Subject'] = f"New Task Assigned: {task_name}"
-        msg['From'] = os.getenv('SMTP_USERNAME')
-        msg['To'] = to_email
-        # Gmail SMTP server credentials
-        smtp_username = os.getenv('SMTP_USERNAME')
-        smtp_password = os.getenv('SMTP_PASSWORD')
+    async def _enqueue_task_assigned_emails(db: AsyncSession, tasks: List[TaskActivity], assignor: str):
+        assignee_ids = {task.assigned_to_id for task in tasks if task.assigned_to_id is not None}
+        if not assignee_ids:
+            return
 
-        try:
-            # Set up connection with Gmail's SMTP server
-            with smtplib.SMTP('smtp.gmail.com', 587) as server:
-                server.ehlo()  # Identify yourself to the server
-                server.starttls()  # Secure the connection
-                server.ehlo()  # Re-identify yourself after starting TLS
-                server.login(smtp_username, smtp_password)  # Login
-                server.sendmail(smtp_username, to_email, msg.as_string())  # Send the email
-                logger.info("Email sent successfully")
-        except smtplib.SMTPException as e:
-            logger.error(f"Error sending email: {e}")
-            raise e
+        result = await db.execute(select(User.id, User.email).where(User.id.in_(assignee_ids)))
+        emails = dict(result.all())
+
+        for task in tasks:
+            assigned_user_email = emails.get(task.assigned_to_id)
+            if not assigned_user_email:
+                continue
+            subject, body = build_task_assigned_email(
+                task_name=task.task_name, due_date=task.due_date, description=task.task_description,
+                assignor=assignor
+            )
+            enqueue_email(db, to_email=assigned_user_email, subject=subject, body=body)
+
+    async def _enqueue_task_assigned_email(self, db: AsyncSession, task: TaskActivity, assignor: str):
+        await self._enqueue_task_assigned_emails(db, [task], assignor)
 
     """Main method to create task"""
 
-    async def create_task(self, db: Session, task_data: TaskActivityCreate, current_user: User):
+    async def create_task(self, db: AsyncSession, task_data: TaskActivityCreate, current_user: UserPrincipal):
         try:
             if self.validate_due_date(task_data.due_date):
-                # Validate fields asynchronously using a ThreadPoolExecutor
-                self.run_validations(db, task_data.dict())
+                # Validate referenced fields
+                await self.run_validations(db, task_data.dict())
 
-                task = self._create_task_entry_and_save(db, task_data, current_user.id)
+                # Everything below is one transaction, the task is only flushed to get its id
+                task = await self._create_task_entry(db, task_data, current_user.id)
 
                 # Handle and attach attachments
                 attachment_ids = []
                 if task_data.attachments:
-                    attachment_ids = self._handle_attachments(db, task=task, attachments=task_data.attachments)
+                    attachment_ids = await self._handle_attachments(db, task=task, attachments=task_data.attachments)
 
                 # Update the task with the list of attachment IDs
                 if attachment_ids:
                     task.attachment_ids = attachment_ids
 
-                # Log task creation history
-                await self.log_task_history(db, task_id=task.task_id, action=Added, new_data=task_data.dict(),
-                                            current_user=current_user)
+                # Queue the notification for the assigned user
+                await self._enqueue_task_assigned_email(db, task, assignor=current_user.username)
 
-                logger.info(f"Task created successfully for user {current_user.username}, Task ID: {task.task_id}")
+                # Log task creation history
+                await self.log_task_history(db, task=task, action=Added, current_user=current_user)
 
-                # Assuming User model has an "email" field
-                get_assigned_user_email = db.query(User.email).filter(User.id == task.assigned_to_id).scalar()
+                await db.commit()
+                await query_cache.invalidate_users([task.created_by_id, task.assigned_to_id])
 
-                if get_assigned_user_email:
-                    # Send email notification to the assigned user
-                    self.send_task_assigned_email(
-                        to_email=get_assigned_user_email, task_name=task.task_name, due_date=task.due_date,
-                        description=task.task_description, assignor=current_user.username
-                    )
+                logger.info(f"Task created successfully for user {current_user.username}, Task ID: {task.task_id}")
 
                 response = self.task_created_response(task)
 
@@ -469,98 +442,286 @@ class TaskActivityImpl:
                     status_code=status.HTTP_201_CREATED,
                     values=response
                 )
+        except HTTPException as http_exc:
+            logger.error(f"HTTP error during task creation: {http_exc.detail}")
+            raise http_exc
+
         except Exception as e:
+            await db.rollback()
             logger.error(f"Unexpected error during task creation: {str(e)}")
             raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
 
+    """Create many tasks in one transaction, reporting invalid items instead of failing the whole batch"""
+
+    async def bulk_create_tasks(self, db: AsyncSession, tasks_data: List[TaskActivityCreate], current_user: UserPrincipal):
+        if len(tasks_data) > BULK_CREATE_MAX_TASKS:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"A bulk request can create at most {BULK_CREATE_MAX_TASKS} tasks"
+            )
+
+        try:
+            errors = {}
+
+            # Due dates are checked in Python, references for every item in a single statement
+            for index, task_data in enumerate(tasks_data):
+                try:
+                    self.validate_due_date(task_data.due_date)
+                except HTTPException as http_exc:
+                    errors.setdefault(index, []).append(
+                        {"field": due_data, "value": task_data.due_date.isoformat(), "message": http_exc.detail}
+                    )
+
+            reference_errors = await reference_validator.validate_many(db, [task.dict() for task in tasks_data])
+            for index, row_errors in enumerate(reference_errors):
+                if row_errors:
+                    errors.setdefault(index, []).extend(row_errors)
+
+            valid = [(index, task_data) for index, task_data in enumerate(tasks_data) if index not in errors]
+
+            created_tasks = []
+            if valid:
+                now = datetime.utcnow()
+
+                # Multi-row INSERT ... RETURNING, rows come back in payload order
+                task_values = [self._new_task_values(task_data, current_user.id, now) for _, task_data in valid]
+                result = await db.execute(
+                    insert(TaskActivity).returning(TaskActivity.task_id, sort_by_parameter_order=True), task_values
+                )
+
+                # Detached copies of the inserted rows, used for the response and the notifications
+                created_tasks = [
+                    TaskActivity(task_id=task_id, **values) for task_id, values in zip(result.scalars().all(), task_values)
+                ]
+
+                # All attachments of the batch in one insert, then their ids are written back per task
+                attachment_rows = [
+                    {"task_id": task.task_id, "file_name": attachment.file_name}
+                    for task, (_, task_data) in zip(created_tasks, valid) for attachment in task_data.attachments or []
+                ]
+                attachment_ids = await self._insert_attachments(db, attachment_rows)
+                if attachment_ids:
+                    ids_by_task = {}
+                    for row, attachment_id in zip(attachment_rows, attachment_ids):
+                        ids_by_task.setdefault(row["task_id"], []).append(attachment_id)
+                    await db.execute(
+                        update(TaskActivity),
+                        [{"task_id": task_id, "attachment_ids": ids} for task_id, ids in ids_by_task.items()]
+                    )
+                    for task in created_tasks:
+                        task.attachment_ids = ids_by_task.get(task.task_id)
+
+                # History rows for the whole batch
+                await history_writer.write(db, [
+                    self._history_values(task.task_id, Added, current_user.id, task.history_version,
+                                         new_state=self._task_state(task))
+                    for task in created_tasks
+                ])
+
+                await self._enqueue_task_assigned_emails(db, created_tasks, assignor=current_user.username)
+
+                await db.commit()
+                await query_cache.invalidate_users(
+                    [current_user.id] + [task.assigned_to_id for task in created_tasks]
+                )
+
+            logger.info(f"Bulk created {len(created_tasks)} tasks for user {current_user.username}, "
+                        f"{len(errors)} rejected")
+
+            response = BulkTaskCreateResponse(
+                created=[
+                    BulkTaskCreated(index=index, **self.task_created_response(task).dict())
+                    for task, (index, _) in zip(created_tasks, valid)
+                ],
+                errors=[BulkTaskError(index=index, errors=item_errors) for index, item_errors in sorted(errors.items())]
+            )
+
+            if not errors:
+                response_status = status.HTTP_201_CREATED
+            elif created_tasks:
+                response_status = status.HTTP_207_MULTI_STATUS
+            else:
+                response_status = status.HTTP_400_BAD_REQUEST
+
+            return ResponseWrapper(status_code=response_status, values=response)
+
+        except HTTPException as http_exc:
+            logger.error(f"HTTP error during bulk task creation: {http_exc.detail}")
+            raise http_exc
+
+        except Exception as e:
+            await db.rollback()
+            logger.error(f"Unexpected error during bulk task creation: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+
     """get created task based on pagination"""
 
     async def get_tasks(
             self,
-            db: Session, current_user: User, task_type: str, skip: int = 0, limit: int = 10, sort_order: str = 'asc',
+            db: AsyncSession, current_user: UserPrincipal, task_type: str, skip: int = 0, limit: int = 10, sort_order: str = 'asc',
             _status: Optional[str] = None, due_date_from: Optional[datetime] = None,
             due_date_to: Optional[datetime] = None, task_name: Optional[str] = None,
             activity_type_id: Optional[int] = None,
-            assigned_to_id: Optional[int] = None
+            assigned_to_id: Optional[int] = None,
+            cursor: Optional[str] = None,
+            if_none_match_header: Optional[str] = None
     ):
         try:
-            if activity_type_id:
-                self.validate_activity_type(db, activity_type_id)
-            if assigned_to_id:
-                self.validate_assign_user(db, assigned_to_id)
+            # Validate the filter references in one statement
+            await reference_validator.validate(
+                db, {"activity_type_id": activity_type_id, "assigned_to_id": assigned_to_id}
+            )
 
-            # Fetch tasks with filters, based on the task_type (created or assigned)
-            tasks = self.query_tasks(
-                db, user_id=current_user.id, task_type=task_type, skip=skip, limit=limit, sort_order=sort_order,
+            page = dict(
+                user_id=current_user.id, task_type=task_type, skip=skip, limit=limit, sort_order=sort_order,
                 status=_status, due_date_from=due_date_from, due_date_to=due_date_to, task_name=task_name,
-                assigned_to_id=assigned_to_id, activity_type_id=activity_type_id
+                assigned_to_id=assigned_to_id, activity_type_id=activity_type_id, cursor=cursor
             )
 
+            if if_none_match_header:
+                # Revalidate against the ids and modification times of the page before loading it
+                etag = list_etag(await self.query_tasks(db, **page, columns=TASK_VALIDATOR_COLUMNS))
+                if if_none_match(if_none_match_header, etag):
+                    return not_modified(etag)
+
+            # Fetch tasks with filters, based on the task_type (created or assigned)
+            tasks = await self.query_tasks(db, **page)
+
             if not tasks:
                 logger.info(f"No tasks found for user {current_user.id}")
-                return ResponseWrapper(status_code=status.HTTP_200_OK, values=[])
+                return task_list_response([], etag=list_etag(tasks))
 
             logger.info(f"Retrieved {len(tasks)} {task_type} tasks for user {current_user.id}")
 
-            # Wrap the tasks in the response model
-            return self.wrap_task_response(tasks)
+            # A full page means there may be more rows, hand back the cursor to continue from
+            next_cursor = self.encode_task_cursor(tasks[-1]) if len(tasks) == limit else None
+
+            # Encode the rows directly, the response model only documents the shape
+            return task_list_response(tasks, next_cursor=next_cursor, etag=list_etag(tasks))
+
+        except HTTPException as http_exc:
+            logger.error(f"HTTP error retrieving tasks for user {current_user.id}: {http_exc.detail}")
+            raise http_exc
 
         except Exception as e:
             logger.error(f"Unexpected error retrieving tasks for user {current_user.id}: {str(e)}")
             raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
 
+    """Full-text search over the name, description and notes of the tasks visible to the user"""
+
+    async def search_tasks(self, db: AsyncSession, current_user: UserPrincipal, query_text: str, task_type: str,
+                           limit: int = 10, cursor: Optional[str] = None):
+        try:
+            ts_query = func.websearch_to_tsquery(SEARCH_CONFIG, query_text)
+            rank = func.ts_rank_cd(TaskActivity.search_vector, ts_query)
+
+            query = select(
+                TaskActivity,
+                rank.label("rank"),
+                func.ts_headline(SEARCH_CONFIG, TaskActivity.task_name, ts_query, HIGHLIGHT_OPTIONS),
+                func.ts_headline(SEARCH_CONFIG, func.coalesce(TaskActivity.task_description, ''), ts_query,
+                                 HIGHLIGHT_OPTIONS),
+                func.ts_headline(SEARCH_CONFIG, func.coalesce(TaskActivity.notes, ''), ts_query, HIGHLIGHT_OPTIONS),
+            ).where(TaskActivity.search_vector.op('@@')(ts_query))
+            query = self._visibility_filter(query, current_user.id, task_type)
+
+            if cursor:
+                # Keyset pagination on (rank, task_id), both descending
+                values = decode_cursor(cursor)
+                last_rank, last_task_id = values.get("rank"), cursor_int(values, "task_id")
+                if not isinstance(last_rank, (int, float)):
+                    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid pagination cursor")
+                query = query.where(
+                    tuple_(rank, TaskActivity.task_id) < tuple_(literal(last_rank, Float), last_task_id)
+                )
+
+            query = query.order_by(rank.desc(), TaskActivity.task_id.desc()).limit(limit)
+            rows = (await db.execute(query)).all()
+
+            results = []
+            for task, task_rank, name_highlight, description_highlight, notes_highlight in rows:
+                task_response = TaskResponse.from_orm(task)
+                results.append(TaskSearchResponse(
+                    **task_response.dict(),
+                    rank=task_rank,
+                    task_name_highlight=name_highlight,
+                    task_description_highlight=description_highlight or None,
+                    notes_highlight=notes_highlight or None,
+                ))
+
+            next_cursor = None
+            if len(rows) == limit:
+                next_cursor = encode_cursor({"rank": rows[-1][1], "task_id": rows[-1][0].task_id})
+
+            logger.info(f"Search returned {len(results)} {task_type} tasks for user {current_user.id}")
+            return ResponseWrapper(status_code=status.HTTP_200_OK, values=results, next_cursor=next_cursor)
+
+        except HTTPException as http_exc:
+            logger.error(f"HTTP error searching tasks for user {current_user.id}: {http_exc.detail}")
+            raise http_exc
+
+        except Exception as e:
+            logger.error(f"Unexpected error searching tasks for user {current_user.id}: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+
     """update a task"""
 
-    async def update_task(self, db: Session, task_id: int, task_data: dict, current_user: User):
+    async def update_task(self, db: AsyncSession, task_id: int, task_data: dict, current_user: UserPrincipal,
+                          if_match_header: Optional[str] = None):
         try:
 
             if due_data in task_data:
                 self.validate_due_date(task_data.get(due_data))
 
             # Fetch task by ID
-            task = self._get_task_by_id(db, task_id)
+            task = await self._get_task_by_id(db, task_id, for_update=True)
 
-            self.run_validations(db, task_data)
+            await self.run_validations(db, task_data)
 
             # Ensure the current user has permission to update the task
             self._check_task_permissions(task, current_user)
 
+            # With If-Match, only update the version of the task the client has seen
+            check_if_match(if_match_header, task_etag(task.task_id, task.modified_on))
+
             # Store the previous task data
-            previous_data = self._get_previous_task_data(task)
+            previous_state = self._task_state(task)
 
             # Handle attachments if provided
             if 'attachments' in task_data and task_data['attachments'] is not None:
                 # Convert dictionaries to AttachmentCreate models
                 attachments = [AttachmentCreate(**attachment) for attachment in task_data['attachments']]
-                attachment_ids = self._handle_attachments(db, task, attachments)
-                task.attachment_ids = attachment_ids  # Update the task's attachment IDs
-                db.commit()  # Commit the change to update the task with attachment IDs
+                attachment_ids = await self._handle_attachments(db, task, attachments)
+                task.attachment_ids = attachment_ids  # Update the task's attachment IDs, committed with the update
 
             # Apply updates to the task (merge the dictionary into the task instance)
             for key, value in task_data.items():
                 if key == 'attachments':  # Skip the attachments field
                     continue
+                if key == 'favorite':
+                    value = self._favorite_to_column(value)
+                if key == due_data:
+                    value = self._to_naive_utc(value)
                 if value is not None:  # Only update fields if value is provided
                     setattr(task, key, value)
 
-            get_assigned_user_email = db.query(User.email).filter(User.id == task.assigned_to_id).scalar()
+            # Queue the notification so it commits together with the task changes
+            await self._enqueue_task_assigned_email(db, task, assignor=current_user.username)
 
-            self.send_task_assigned_email(
-                to_email=get_assigned_user_email, task_name=task.task_name, due_date=task.due_date,
-                description=task.task_description, assignor=current_user.username
-            )
             # Update modified timestamp
             task.modified_on = datetime.utcnow()
 
-            # Commit changes to the database
-            db.commit()
-            db.refresh(task)
+            # Log the changes in history, the in-memory task already holds the new values
+            await self.log_task_history(db, task=task, action=Modified, previous_state=previous_state,
+                                        current_user=current_user)
 
-            task = self._get_task_by_id(db, task_id)
+            # Commit the update, attachments, history and outbox entry together
+            await db.commit()
 
-            # Log the changes in history
-            await self.log_task_history(db, task_id=task.task_id, action=Modified, previous_data=previous_data,
-                                        new_data=task, current_user=current_user)
+            # The task may have left the previous assignee's lists and joined the new one's
+            await query_cache.invalidate_users(
+                [task.created_by_id, previous_state["assigned_to_id"], task.assigned_to_id]
+            )
 
             logger.info(f"Task with ID {str(task.task_id)} updated successfully")
             return ResponseWrapper(
@@ -568,14 +729,30 @@ class TaskActivityImpl:
                 values=task
             )
 
+        except HTTPException as http_exc:
+            logger.error(f"HTTP error updating task with ID {task_id}: {http_exc.detail}")
+            raise http_exc
+
         except Exception as e:
+            await db.rollback()
             logger.error(f"Unexpected error updating task with ID {task_id}: {str(e)}")
             raise HTTPException(status_code=500, detail=f"An unexpected error occurred")
 
-    async def get_task_by_id(self, db: Session, task_id: int, current_user: User):
+    async def get_task_by_id(self, db: AsyncSession, task_id: int, current_user: UserPrincipal,
+                             if_none_match_header: Optional[str] = None):
         try:
-            # Retrieve the task by ID
-            task = self._get_task_by_id(db, task_id)
+            if if_none_match_header:
+                # Answer a matching revalidation from the task's id and modification time alone
+                result = await db.execute(select(*TASK_VALIDATOR_COLUMNS).where(TaskActivity.task_id == task_id))
+                validator = result.first()
+                if validator:
+                    etag = task_etag(validator.task_id, validator.modified_on)
+                    if if_none_match(if_none_match_header, etag):
+                        return not_modified(etag)
+
+            # Retrieve the response columns of the task
+            result = await db.execute(select(*TASK_RESPONSE_COLUMNS).where(TaskActivity.task_id == task_id))
+            task = result.first()
 
             # Check if the task exists
             if not task:
@@ -585,14 +762,11 @@ class TaskActivityImpl:
                     detail=f"No task found !"
                 )
 
-            # Convert the task to the response format
-            task_response = TaskResponse.from_orm(task)
+            # Return the wrapped response, encoded directly from the row
+            return task_detail_response(task, etag=task_etag(task.task_id, task.modified_on))
 
-            # Return the wrapped response
-            return ResponseWrapper(
-                status_code=status.HTTP_200_OK,
-                values=task_response
-            )
+        except HTTPException as http_exc:
+            raise http_exc
 
         except Exception as e:
             # Log unexpected errors
@@ -603,23 +777,21 @@ class TaskActivityImpl:
             )
 
     # delete a task
-    async def delete_task(self, db: Session, task_id: int, current_user: User):
+    async def delete_task(self, db: AsyncSession, task_id: int, current_user: UserPrincipal):
         try:
 
             # Fetch the task by ID
-            task = self._get_task_by_id(db, task_id)
+            task = await self._get_task_by_id(db, task_id)
             if not task:
                 logger.warning(f"Task with ID {task_id} not found")
                 raise HTTPException(status_code=404, detail=f"Task not found")
 
             self._check_user_permission(current_user, task, task_id)
 
-            # Delete task history records before deleting the task itself
-            self._delete_task_history(db, task_id)
-
-            # Now delete the task itself
-            db.delete(task)
-            db.commit()
+            # The history entries go with the task (ON DELETE CASCADE), in the same transaction
+            await db.delete(task)
+            await db.commit()
+            await query_cache.invalidate_users([task.created_by_id, task.assigned_to_id])
 
             logger.info(f"Task with ID {task_id} deleted successfully")
             return ResponseWrapper(
@@ -627,6 +799,8 @@ class TaskActivityImpl:
                 values={}
             )
 
+        except HTTPException as http_exc:
+            raise http_exc
         except Exception as e:
             logger.error(f"Unexpected error deleting task with ID {task_id}: {str(e)}")
             raise HTTPException(status_code=500, detail=f"An unexpected error occurred")
@@ -0,0 +1,95 @@
+import logging
+from collections import defaultdict
+from typing import Dict, List, Set
+
+from fastapi import HTTPException, status
+from sqlalchemy import Integer, any_, bindparam, literal, select, union_all
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .constant import activity_type_id, activity_group_id, stage_id, core_group_id, assigned_to_id
+from .models import User
+from .reference_cache import REFERENCE_MODELS, reference_cache
+
+logger = logging.getLogger(__name__)
+
+# Every task field that references another table, including the assigned user
+REFERENCE_FIELDS = {**REFERENCE_MODELS, assigned_to_id: User}
+
+ERROR_MESSAGES = {
+    activity_type_id: "Activity type with id {} does not exist.",
+    activity_group_id: "Activity group with id {} does not exist.",
+    stage_id: "Stage with id {} does not exist.",
+    core_group_id: "Core group with id {} does not exist.",
+    assigned_to_id: "User with id {} does not exist to assign.",
+}
+
+
+class ReferenceValidator:
+    """Checks every referenced id of one or many tasks with a single SQL statement"""
+
+    @staticmethod
+    def collect_ids(rows: List[dict]) -> Dict[str, Set[int]]:
+        ids_by_field = defaultdict(set)
+        for row in rows:
+            for field in REFERENCE_FIELDS:
+                if row.get(field) is not None:
+                    ids_by_field[field].add(row[field])
+        return ids_by_field
+
+    async def find_missing(self, db: AsyncSession, ids_by_field: Dict[str, Set[int]]) -> Dict[str, Set[int]]:
+        """Return the ids that do not exist, grouped by field"""
+        pending = {}
+        for field, ids in ids_by_field.items():
+            unknown = set()
+            for value in ids:
+                # Lookup table ids known to the reference cache need no database check
+                if field in REFERENCE_MODELS and await reference_cache.contains(db, field, value):
+                    continue
+                unknown.add(value)
+            if unknown:
+                pending[field] = unknown
+
+        if not pending:
+            return {}
+
+        # One SELECT per table, combined with UNION ALL so everything is checked in one round trip
+        selects = [
+            select(literal(field).label("field"), REFERENCE_FIELDS[field].id.label("id"))
+            .where(REFERENCE_FIELDS[field].id == any_(bindparam(f"{field}_ids", sorted(ids), type_=ARRAY(Integer))))
+            for field, ids in pending.items()
+        ]
+        statement = selects[0] if len(selects) == 1 else union_all(*selects)
+        result = await db.execute(statement)
+
+        found = defaultdict(set)
+        for field, value in result.all():
+            found[field].add(value)
+            if field in REFERENCE_MODELS:
+                reference_cache.add(field, value)
+
+        return {field: ids - found[field] for field, ids in pending.items() if ids - found[field]}
+
+    @staticmethod
+    def _errors_for_row(row: dict, missing: Dict[str, Set[int]]) -> List[dict]:
+        errors = []
+        for field in REFERENCE_FIELDS:
+            value = row.get(field)
+            if value is not None and value in missing.get(field, ()):
+                errors.append({"field": field, "value": value, "message": ERROR_MESSAGES[field].format(value)})
+        return errors
+
+    async def validate_many(self, db: AsyncSession, rows: List[dict]) -> List[List[dict]]:
+        """Validate a batch of tasks, returning the list of invalid fields for each row"""
+        missing = await self.find_missing(db, self.collect_ids(rows))
+        return [self._errors_for_row(row, missing) for row in rows]
+
+    async def validate(self, db: AsyncSession, task_data: dict):
+        """Validate a single task, raising a 400 that lists every invalid field"""
+        errors = (await self.validate_many(db, [task_data]))[0]
+        if errors:
+            logger.warning(f"Invalid task references: {', '.join(error['field'] for error in errors)}")
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=errors)
+
+
+reference_validator = ReferenceValidator()
@@ -0,0 +1,9 @@
+"""Benchmarks of the task API.
+
+    python -m benchmarks.seed --reset --users 1000 --tasks 1000000
+    python -m benchmarks.smtp_sink --port 8025
+    python -m benchmarks.load --base-url http://127.0.0.1:8000 --duration 30
+    python -m benchmarks.compare benchmarks/results/a.json benchmarks/results/b.json
+
+See "Benchmarks" in the README for the full procedure.
+"""
@@ -0,0 +1,58 @@
+"""Compare two load test reports of benchmarks.load.
+
+    python -m benchmarks.compare benchmarks/results/BASELINE.json benchmarks/results/CANDIDATE.json
+
+Prints the throughput and p50/p95/p99 latency of every scenario found in
+both reports, with the change from the baseline in percent. Settings that
+differ between the runs are listed first, since they make the figures
+incomparable.
+"""
+import argparse
+import json
+
+METRICS = ("throughput_rps", "p50_ms", "p95_ms", "p99_ms")
+
+
+def load(path: str) -> dict:
+    with open(path) as file:
+        return json.load(file)
+
+
+def change(before, after) -> str:
+    if before in (None, 0) or after is None:
+        return "n/a"
+    return f"{(after - before) / before * 100:+.1f}%"
+
+
+def describe(report: dict) -> str:
+    git = report.get("git") or {}
+    commit = (git.get("commit") or "unknown")[:8]
+    dirty = " (dirty)" if git.get("dirty") else ""
+    label = f" [{report['label']}]" if report.get("label") else ""
+    return f"{commit}{dirty}{label} {git.get('subject') or ''} at {report.get('started_at')}"
+
+
+def compare(baseline: dict, candidate: dict) -> list:
+    lines = [f"baseline:  {describe(baseline)}", f"candidate: {describe(candidate)}"]
+    for key in sorted(set(baseline["settings"]) | set(candidate["settings"])):
+        if baseline["settings"].get(key) != candidate["settings"].get(key):
+            lines.append(f"settings differ: {key} {baseline['settings'].get(key)} -> {candidate['settings'].get(key)}")
+
+    lines.append("")
+    lines.append(f"{'scenario':18} " + " ".join(f"{metric:>26}" for metric in METRICS) + f" {'errors':>10}")
+    for name, before in baseline["scenarios"].items():
+        after = candidate["scenarios"].get(name)
+        if after is None:
+            continue
+        cells = [f"{before[metric]} -> {after[metric]} {change(before[metric], after[metric]):>7}" for metric in METRICS]
+        lines.append(f"{name:18} " + " ".join(f"{cell:>26}" for cell in cells)
+                     + f" {before['errors']:>4} -> {after['errors']:<4}")
+    return lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    args = parser.parse_args()
+    print("\n".join(compare(load(args.baseline), load(args.candidate))))
@@ -0,0 +1,20 @@
+"""Shape of the seeded benchmark dataset, shared by the seeder and the load driver."""
+
+BENCH_USER_PREFIX = "bench_user_"
+BENCH_PASSWORD = "benchmark"
+
+
+def bench_user_email(number: int) -> str:
+    return f"{BENCH_USER_PREFIX}{number}@example.com"
+
+
+STATUSES = ["Not Started", "In Active", "In Progress", "On Hold", "Completed"]
+VERBS = ["Call", "Email", "Meet", "Review", "Prepare", "Follow up on", "Draft", "Schedule"]
+TOPICS = ["quarterly report", "contract renewal", "onboarding plan", "budget review", "product demo",
+          "support escalation", "hiring pipeline", "vendor audit", "release notes", "customer feedback"]
+COMPANIES = ["Acme", "Globex", "Initech", "Umbrella", "Hooli", "Stark", "Wayne", "Wonka"]
+
+ACTIVITY_TYPES = ["Call", "Email", "Meeting", "Task", "Review", "Visit", "Demo", "Follow up", "Training", "Audit"]
+STAGES = ["Backlog", "Planned", "In progress", "Blocked", "Review", "Done", "Archived", "Cancelled"]
+ACTIVITY_GROUP_COUNT = 20
+CORE_GROUP_COUNT = 12
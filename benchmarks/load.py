@@ -0,0 +1,348 @@
+"""HTTP load test of the task API against a seeded database.
+
+    python -m benchmarks.seed --reset --users 1000 --tasks 1000000
+    uvicorn api.main:app --workers 4
+    python -m benchmarks.load --base-url http://127.0.0.1:8000 --duration 30 --concurrency 32
+
+Logs in `--users` of the seeded users, then runs every scenario in turn for
+`--duration` seconds with `--concurrency` clients, each request made as a
+random one of those users. The report holds the throughput, error count,
+status codes and p50/p95/p99 latency of every scenario together with the git
+commit it ran against, is printed and saved as JSON under `--output`, and
+two reports can be compared with benchmarks.compare.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import time
+from datetime import datetime, timedelta
+
+import httpx
+
+from benchmarks.dataset import ACTIVITY_TYPES, BENCH_PASSWORD, STATUSES, TOPICS, bench_user_email
+
+API = "/api/v1"
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Fields of a listed task that are sent back as is on update
+UPDATE_FIELDS = ("task_name", "task_description", "favorite", "activity_type_id", "activity_group_id", "stage_id",
+                 "core_group_id", "due_date", "action_type", "link_response_ids", "link_object_ids", "notes",
+                 "assigned_to_id")
+
+
+class BenchUser:
+    def __init__(self, email: str, user_id: int, token: str):
+        self.email = email
+        self.id = user_id
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.tasks = []  # Listed task rows, targets of the update and history scenarios
+        self.created = []  # Ids of tasks created by the create scenario, deleted by the delete scenario
+
+
+class Context:
+    def __init__(self, client: httpx.AsyncClient, users: list, password: str, pages: int, seed: int):
+        self.client = client
+        self.users = users
+        self.password = password
+        self.pages = pages
+        self.seed = seed
+
+    def user(self, rng: random.Random) -> BenchUser:
+        return rng.choice(self.users)
+
+
+class Recorder:
+    """Latency and status of every request of one scenario"""
+
+    def __init__(self):
+        self.samples = []
+        self.statuses = {}
+        self.errors = 0
+
+    async def request(self, client: httpx.AsyncClient, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError as exc:
+            self.samples.append(time.perf_counter() - started)
+            self.errors += 1
+            key = type(exc).__name__
+            self.statuses[key] = self.statuses.get(key, 0) + 1
+            return None
+        self.samples.append(time.perf_counter() - started)
+        key = str(response.status_code)
+        self.statuses[key] = self.statuses.get(key, 0) + 1
+        if response.status_code >= 400:
+            self.errors += 1
+        return response
+
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return round(ordered[index] * 1000, 2)
+
+
+def summarize(recorder: Recorder, seconds: float) -> dict:
+    samples = recorder.samples
+    return {
+        "requests": len(samples),
+        "errors": recorder.errors,
+        "status_codes": dict(sorted(recorder.statuses.items())),
+        "seconds": round(seconds, 2),
+        "throughput_rps": round(len(samples) / seconds, 2) if seconds else None,
+        "p50_ms": percentile(samples, 50),
+        "p95_ms": percentile(samples, 95),
+        "p99_ms": percentile(samples, 99),
+        "mean_ms": round(statistics.mean(samples) * 1000, 2) if samples else None,
+        "max_ms": round(max(samples) * 1000, 2) if samples else None,
+    }
+
+
+def _values(response) -> list:
+    if response is None or response.status_code != 200:
+        return []
+    return response.json().get("values") or []
+
+
+async def scenario_login(ctx: Context, rng: random.Random, recorder: Recorder):
+    user = ctx.user(rng)
+    await recorder.request(ctx.client, "POST", f"{API}/token", data={"username": user.email, "password": ctx.password})
+
+
+async def scenario_list(ctx: Context, rng: random.Random, recorder: Recorder):
+    user = ctx.user(rng)
+    params = {"task_type": rng.choice(["created", "assigned"]), "limit": 20, "sort_order": rng.choice(["asc", "desc"])}
+    await recorder.request(ctx.client, "GET", f"{API}/tasks", headers=user.headers, params=params)
+
+
+async def scenario_filter(ctx: Context, rng: random.Random, recorder: Recorder):
+    user = ctx.user(rng)
+    params = {"task_type": rng.choice(["created", "assigned"]), "limit": 20}
+    for name in rng.sample(["status", "activity_type_id", "due_date", "task_name"], 2):
+        if name == "status":
+            params["status"] = rng.choice(STATUSES)
+        elif name == "activity_type_id":
+            params["activity_type_id"] = rng.randint(1, len(ACTIVITY_TYPES))
+        elif name == "due_date":
+            start = datetime.utcnow() - timedelta(days=rng.randint(0, 365))
+            params["due_date_from"] = start.isoformat()
+            params["due_date_to"] = (start + timedelta(days=30)).isoformat()
+        else:
+            params["task_name"] = rng.choice(TOPICS).split()[0]
+    await recorder.request(ctx.client, "GET", f"{API}/tasks", headers=user.headers, params=params)
+
+
+async def scenario_paginate(ctx: Context, rng: random.Random, recorder: Recorder):
+    """Follows next_cursor through up to --pages pages, every page is one sample"""
+    user = ctx.user(rng)
+    params = {"task_type": rng.choice(["created", "assigned"]), "limit": 20}
+    for _ in range(ctx.pages):
+        response = await recorder.request(ctx.client, "GET", f"{API}/tasks", headers=user.headers, params=params)
+        if response is None or response.status_code != 200 or not response.json().get("next_cursor"):
+            return
+        params["cursor"] = response.json()["next_cursor"]
+
+
+def _new_task(rng: random.Random, user: BenchUser) -> dict:
+    return {
+        "task_name": f"Load test {rng.choice(TOPICS)} {rng.randrange(10 ** 9)}",
+        "task_description": "Created by benchmarks.load",
+        "status": rng.choice(STATUSES),
+        "activity_type_id": rng.randint(1, len(ACTIVITY_TYPES)),
+        "assigned_to_id": user.id,
+    }
+
+
+async def scenario_create(ctx: Context, rng: random.Random, recorder: Recorder):
+    user = ctx.user(rng)
+    response = await recorder.request(ctx.client, "POST", f"{API}/tasks", headers=user.headers,
+                                      json=_new_task(rng, user))
+    if response is not None and response.is_success:
+        user.created.append(response.json()["values"]["task_id"])
+
+
+async def scenario_update(ctx: Context, rng: random.Random, recorder: Recorder):
+    user = ctx.user(rng)
+    task = rng.choice(user.tasks)
+    payload = {name: task.get(name) for name in UPDATE_FIELDS}
+    payload["status"] = rng.choice(STATUSES)
+    # Past due dates are rejected on update, reschedule instead
+    payload["due_date"] = (datetime.utcnow() + timedelta(days=rng.randint(1, 90))).isoformat()
+    await recorder.request(ctx.client, "PUT", f"{API}/tasks/{task['task_id']}", headers=user.headers, json=payload)
+
+
+async def scenario_delete(ctx: Context, rng: random.Random, recorder: Recorder):
+    """Deletes the tasks of the create scenario, creating one untimed first when none are left"""
+    user = ctx.user(rng)
+    if not user.created:
+        response = await ctx.client.post(f"{API}/tasks", headers=user.headers, json=_new_task(rng, user))
+        if not response.is_success:
+            return
+        user.created.append(response.json()["values"]["task_id"])
+    task_id = user.created.pop()
+    await recorder.request(ctx.client, "DELETE", f"{API}/tasks/{task_id}", headers=user.headers)
+
+
+async def scenario_history_timeline(ctx: Context, rng: random.Random, recorder: Recorder):
+    user = ctx.user(rng)
+    task = rng.choice(user.tasks)
+    await recorder.request(ctx.client, "GET", f"{API}/tasks/{task['task_id']}/history", headers=user.headers,
+                           params={"limit": 20})
+
+
+async def scenario_history_feed(ctx: Context, rng: random.Random, recorder: Recorder):
+    user = ctx.user(rng)
+    await recorder.request(ctx.client, "GET", f"{API}/tasks/history/", headers=user.headers,
+                           params={"modified_by_id": user.id, "sort_order": "desc", "limit": 20})
+
+
+async def scenario_history_details(ctx: Context, rng: random.Random, recorder: Recorder):
+    user = ctx.user(rng)
+    task = rng.choice(user.tasks)
+    await recorder.request(ctx.client, "GET", f"{API}/tasks/{task['task_id']}/history_details", headers=user.headers)
+
+
+async def scenario_history_as_of(ctx: Context, rng: random.Random, recorder: Recorder):
+    """State of a task at a random moment between its creation and its last change"""
+    user = ctx.user(rng)
+    task = rng.choice(user.tasks)
+    created_on = datetime.fromisoformat(task["created_on"])
+    modified_on = datetime.fromisoformat(task["modified_on"])
+    at = created_on + (modified_on - created_on) * rng.random()
+    await recorder.request(ctx.client, "GET", f"{API}/tasks/{task['task_id']}/history/as_of", headers=user.headers,
+                           params={"at": at.isoformat()})
+
+
+SCENARIOS = {
+    "login": scenario_login,
+    "list": scenario_list,
+    "filter": scenario_filter,
+    "paginate": scenario_paginate,
+    "create": scenario_create,
+    "update": scenario_update,
+    "delete": scenario_delete,
+    "history_timeline": scenario_history_timeline,
+    "history_feed": scenario_history_feed,
+    "history_details": scenario_history_details,
+    "history_as_of": scenario_history_as_of,
+}
+
+
+async def prepare_users(client: httpx.AsyncClient, count: int, password: str, concurrency: int) -> list:
+    """Logs in the first `count` seeded users and lists the tasks each created"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def prepare(number: int):
+        email = bench_user_email(number)
+        async with semaphore:
+            response = await client.post(f"{API}/token", data={"username": email, "password": password})
+            if not response.is_success:
+                return None
+            token = response.json()["access_token"]
+            response = await client.get(f"{API}/tasks", headers={"Authorization": f"Bearer {token}"},
+                                        params={"limit": 100})
+        tasks = _values(response)
+        if not tasks:
+            # The id is read from the tasks, a user without any is left out
+            return None
+        user = BenchUser(email, tasks[0]["created_by_id"], token)
+        user.tasks = tasks
+        return user
+
+    return [user for user in await asyncio.gather(*(prepare(number) for number in range(1, count + 1))) if user]
+
+
+async def run_scenario(ctx: Context, name: str, duration: float, concurrency: int) -> dict:
+    recorder = Recorder()
+    scenario = SCENARIOS[name]
+    deadline = time.perf_counter() + duration
+
+    async def client_loop(number: int):
+        rng = random.Random(f"{ctx.seed}-{name}-{number}")
+        while time.perf_counter() < deadline:
+            await scenario(ctx, rng, recorder)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client_loop(number) for number in range(concurrency)))
+    return summarize(recorder, time.perf_counter() - started)
+
+
+def git_revision() -> dict:
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    status = git("status", "--porcelain", "--untracked-files=no")
+    return {"commit": git("rev-parse", "HEAD"), "subject": git("log", "-1", "--format=%s"),
+            "dirty": bool(status) if status is not None else None}
+
+
+async def run(args) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency + 10, max_keepalive_connections=args.concurrency + 10)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        users = await prepare_users(client, args.users, args.password, args.concurrency)
+        if not users:
+            raise SystemExit("No seeded user could log in, run benchmarks.seed first")
+        ctx = Context(client, users, args.password, args.pages, args.seed)
+
+        scenarios = {}
+        for name in args.scenarios:
+            if args.warmup:
+                await run_scenario(ctx, name, args.warmup, args.concurrency)
+            scenarios[name] = await run_scenario(ctx, name, args.duration, args.concurrency)
+            print(f"{name:18} {scenarios[name]['throughput_rps']:>9} req/s  p50 {scenarios[name]['p50_ms']} ms  "
+                  f"p95 {scenarios[name]['p95_ms']} ms  p99 {scenarios[name]['p99_ms']} ms  "
+                  f"errors {scenarios[name]['errors']}")
+
+    return {
+        "label": args.label,
+        "started_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "git": git_revision(),
+        "settings": {
+            "base_url": args.base_url, "duration": args.duration, "warmup": args.warmup,
+            "concurrency": args.concurrency, "users": len(users), "pages": args.pages, "seed": args.seed,
+        },
+        "scenarios": scenarios,
+    }
+
+
+def save(report: dict, output: str) -> str:
+    os.makedirs(output, exist_ok=True)
+    commit = (report["git"]["commit"] or "nogit")[:8]
+    stamp = report["started_at"].replace(":", "").replace("-", "").rstrip("Z")
+    name = f"{stamp}_{commit}{'_dirty' if report['git']['dirty'] else ''}"
+    if report["label"]:
+        name += f"_{report['label']}"
+    path = os.path.join(output, f"{name}.json")
+    with open(path, "w") as file:
+        json.dump(report, file, indent=2)
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds per scenario")
+    parser.add_argument("--warmup", type=float, default=0.0, help="untimed seconds before each scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--users", type=int, default=100, help="seeded users to log in and act as")
+    parser.add_argument("--password", default=BENCH_PASSWORD)
+    parser.add_argument("--pages", type=int, default=5, help="pages followed by the paginate scenario")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--label", default="", help="added to the report name, e.g. the change being measured")
+    parser.add_argument("--output", default=os.path.join(REPO_ROOT, "benchmarks", "results"))
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print(f"Report saved to {save(report, args.output)}")
@@ -0,0 +1,124 @@
+"""Measure how a login storm affects the latency of other endpoints.
+
+Runs against a live server:
+
+    uvicorn api.main:app --workers 1
+    python -m benchmarks.login_storm --base-url http://127.0.0.1:8000 --logins 500 --concurrency 50
+
+While `--concurrency` clients hammer POST /api/v1/token, a single probe client
+keeps calling GET /api/v1/tasks. The report prints the login throughput, the
+number of logins rejected with 503 and the p50/p95/p99 probe latency, first
+on an idle server and then during the storm.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+
+import httpx
+
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return round(ordered[index] * 1000, 2)
+
+
+def summarize(samples):
+    return {
+        "count": len(samples),
+        "p50_ms": percentile(samples, 50),
+        "p95_ms": percentile(samples, 95),
+        "p99_ms": percentile(samples, 99),
+        "mean_ms": round(statistics.mean(samples) * 1000, 2) if samples else None,
+    }
+
+
+async def create_user(client: httpx.AsyncClient, password: str):
+    name = f"storm-{uuid.uuid4().hex[:8]}"
+    email = f"{name}@example.com"
+    response = await client.post(
+        "/api/v1/users", json={"username": name, "email": email, "password": password, "company": "benchmark"}
+    )
+    response.raise_for_status()
+    return email
+
+
+async def login(client: httpx.AsyncClient, email: str, password: str) -> httpx.Response:
+    return await client.post("/api/v1/token", data={"username": email, "password": password})
+
+
+async def probe(client: httpx.AsyncClient, headers: dict, stop: asyncio.Event, samples: list, interval: float):
+    while not stop.is_set():
+        started = time.perf_counter()
+        response = await client.get("/api/v1/tasks", headers=headers, params={"limit": 10})
+        samples.append(time.perf_counter() - started)
+        response.raise_for_status()
+        await asyncio.sleep(interval)
+
+
+async def measure_idle(client: httpx.AsyncClient, headers: dict, seconds: float, interval: float):
+    samples = []
+    stop = asyncio.Event()
+    task = asyncio.create_task(probe(client, headers, stop, samples, interval))
+    await asyncio.sleep(seconds)
+    stop.set()
+    await task
+    return samples
+
+
+async def storm(client: httpx.AsyncClient, email: str, password: str, logins: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    statuses = {}
+
+    async def one():
+        async with semaphore:
+            response = await login(client, email, password)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(logins)))
+    return time.perf_counter() - started, statuses
+
+
+async def main(args):
+    limits = httpx.Limits(max_connections=args.concurrency + 5)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=60, limits=limits) as client:
+        password = "benchmark-password"
+        email = await create_user(client, password)
+        token = (await login(client, email, password)).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        idle = await measure_idle(client, headers, args.idle_seconds, args.probe_interval)
+
+        samples = []
+        stop = asyncio.Event()
+        probe_task = asyncio.create_task(probe(client, headers, stop, samples, args.probe_interval))
+        elapsed, statuses = await storm(client, email, password, args.logins, args.concurrency)
+        stop.set()
+        await probe_task
+
+    report = {
+        "logins": args.logins,
+        "concurrency": args.concurrency,
+        "storm_seconds": round(elapsed, 2),
+        "logins_per_second": round(args.logins / elapsed, 1),
+        "login_status_codes": statuses,
+        "probe_idle": summarize(idle),
+        "probe_during_storm": summarize(samples),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--logins", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--idle-seconds", type=float, default=3.0)
+    parser.add_argument("--probe-interval", type=float, default=0.01)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,227 @@
+"""Seed a database with a reproducible benchmark dataset.
+
+    python -m benchmarks.seed --reset --users 1000 --tasks 1000000 --history-per-task 4 --seed 42
+
+Creates the lookup tables, `--users` users named bench_user_N (email
+bench_user_N@example.com, password `--password`) and `--tasks` tasks spread
+over the last `--days` days, each with `--history-per-task` history entries:
+the creation snapshot followed by status changes, stored as deltas the same
+way the API writes them. Everything is generated inside Postgres with
+INSERT ... SELECT over generate_series, in batches of `--batch-size` tasks,
+and derived from hashes of the row number and `--seed`, so the same
+arguments on an empty database (`--reset`) always produce the same data,
+with dates counted back from midnight of the day it runs.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from api.constant import Added, Modified
+from api.database import async_engine, disable_statement_timeout
+from api.history_partitions import ensure_partitions, month_start, HISTORY_PARTITION_MONTHS_AHEAD
+from api.models import TaskActivity
+from api.password_hasher import pwd_context
+from api.task_service import HISTORY_EXCLUDED_COLUMNS, HISTORY_SNAPSHOT_INTERVAL
+from benchmarks.dataset import (
+    ACTIVITY_GROUP_COUNT, ACTIVITY_TYPES, BENCH_PASSWORD, BENCH_USER_PREFIX, COMPANIES, CORE_GROUP_COUNT, STAGES,
+    STATUSES, TOPICS, VERBS
+)
+
+logger = logging.getLogger(__name__)
+
+LOOKUPS = {"activity_types": ACTIVITY_TYPES, "stages": STAGES}
+
+
+def _array(values) -> str:
+    # Constants from benchmarks.dataset, never user input
+    return "ARRAY[" + ", ".join("'" + value.replace("'", "''") + "'" for value in values) + "]"
+
+
+def _hash(expression: str, salt: int) -> str:
+    """Deterministic pseudo random non-negative integer from a row expression, the salt and the seed"""
+    return f"abs(hashint8(({expression})::bigint * 7919 + {salt} + CAST(:seed AS bigint)))"
+
+
+def _pick(array: str, expression: str, salt: int) -> str:
+    return f"({array})[1 + {_hash(expression, salt)} % cardinality({array})]"
+
+
+async def reset(conn):
+    await conn.execute(text(
+        "TRUNCATE tasks_history, attachments, email_outbox, tasks_activity, users, "
+        "activity_types, activity_groups, stages, core_groups RESTART IDENTITY CASCADE"
+    ))
+
+
+async def seed_lookups(conn):
+    for table, names in LOOKUPS.items():
+        for index, name in enumerate(names, start=1):
+            await conn.execute(text(f"INSERT INTO {table} (id, name) VALUES (:id, :name) ON CONFLICT (id) DO NOTHING"),
+                               {"id": index, "name": name})
+    await conn.execute(text("""
+        INSERT INTO activity_groups (id, name, sub_category_id, sub_category_name)
+        SELECT i, 'Group ' || i, 1 + i % 5, 'Sub category ' || (1 + i % 5) FROM generate_series(1, :count) AS g(i)
+        ON CONFLICT (id) DO NOTHING
+    """), {"count": ACTIVITY_GROUP_COUNT})
+    await conn.execute(text("""
+        INSERT INTO core_groups (id, category_id, category, name)
+        SELECT i, 1 + i % 4, 'Category ' || (1 + i % 4), 'Core group ' || i FROM generate_series(1, :count) AS g(i)
+        ON CONFLICT (id) DO NOTHING
+    """), {"count": CORE_GROUP_COUNT})
+
+
+async def seed_users(conn, users: int, password: str, seed: int):
+    # Hashing once is enough, every benchmark user shares the password
+    hashed_password = pwd_context.hash(password)
+    await conn.execute(text(f"""
+        INSERT INTO users (username, email, hashed_password, is_active, is_admin, company)
+        SELECT '{BENCH_USER_PREFIX}' || i, '{BENCH_USER_PREFIX}' || i || '@example.com', :hashed_password, true, false,
+               {_pick(_array(COMPANIES), "i", 1)}
+        FROM generate_series(1, :users) AS g(i)
+        ON CONFLICT (email) DO NOTHING
+    """), {"users": users, "hashed_password": hashed_password, "seed": seed})
+
+
+def _task_state_sql(status: str, modified_on: str) -> str:
+    """jsonb of a task's recorded state (see TaskActivityImpl._task_state) with the given status and modified_on"""
+    fields = []
+    for column in TaskActivity.__table__.columns:
+        if column.computed is not None or column.name in HISTORY_EXCLUDED_COLUMNS:
+            continue
+        value = {"status": status, "modified_on": modified_on}.get(column.name, f"t.{column.name}")
+        fields.append(f"'{column.name}', {value}")
+    return f"jsonb_build_object({', '.join(fields)})"
+
+
+def _tasks_sql(versions: int) -> str:
+    statuses = _array(STATUSES)
+    # Leave room for the status changes so that no history entry lands in the future
+    created_on = f"date_trunc('day', now()::timestamp) - interval '1 second' * ({_hash('g.i', 10)} % (CAST(:days AS integer) * 86400)) " \
+                 f"- interval '72 hours' * {versions - 1}"
+
+    def status_at(version: str) -> str:
+        # The last version holds the task's current status
+        return f"(CASE WHEN {version} = {versions} THEN t.status ELSE {_pick(statuses, f't.task_id * 100 + {version}', 12)} END)"
+
+    def modified_at(version: str) -> str:
+        return f"(t.created_on + (t.modified_on - t.created_on) * ({version} - 1) / greatest({versions} - 1, 1))"
+
+    return f"""
+        WITH u AS (SELECT array_agg(id ORDER BY id) AS ids FROM users WHERE email LIKE '{BENCH_USER_PREFIX}%'),
+        base AS (
+            SELECT g.i, {created_on} AS created_on,
+                   u.ids[1 + {_hash('g.i', 20)} % cardinality(u.ids)] AS created_by_id,
+                   u.ids[1 + {_hash('g.i', 21)} % cardinality(u.ids)] AS assigned_to_id
+            FROM generate_series(CAST(:first AS integer), CAST(:last AS integer)) AS g(i), u
+        ),
+        new_tasks AS (
+            INSERT INTO tasks_activity (
+                task_name, task_description, activity_type_id, activity_group_id, stage_id, core_group_id, due_date,
+                action_type, status, link_response_ids, link_object_ids, notes, attachment_ids, created_on, modified_on,
+                favorite, history_version, created_by_id, assigned_to_id
+            )
+            SELECT {_pick(_array(VERBS), 'g.i', 30)} || ' ' || {_pick(_array(TOPICS), 'g.i', 31)} || ' #' || g.i,
+                   'Benchmark task ' || g.i || ' about the ' || {_pick(_array(TOPICS), 'g.i', 32)}
+                       || ' for ' || {_pick(_array(COMPANIES), 'g.i', 33)},
+                   1 + {_hash('g.i', 34)} % {len(LOOKUPS['activity_types'])},
+                   CASE WHEN {_hash('g.i', 35)} % 3 = 0 THEN NULL ELSE 1 + {_hash('g.i', 36)} % {ACTIVITY_GROUP_COUNT} END,
+                   1 + {_hash('g.i', 37)} % {len(LOOKUPS['stages'])},
+                   CASE WHEN {_hash('g.i', 38)} % 2 = 0 THEN NULL ELSE 1 + {_hash('g.i', 39)} % {CORE_GROUP_COUNT} END,
+                   CASE WHEN {_hash('g.i', 40)} % 5 = 0 THEN NULL
+                        ELSE g.created_on + interval '1 day' * (1 + {_hash('g.i', 41)} % 90) END,
+                   {_pick(_array(VERBS), 'g.i', 42)},
+                   {_pick(statuses, 'g.i', 43)},
+                   NULL, NULL,
+                   CASE WHEN {_hash('g.i', 44)} % 2 = 0 THEN NULL
+                        ELSE 'Notes for ' || {_pick(_array(TOPICS), 'g.i', 45)} || ', check with ' || {_pick(_array(COMPANIES), 'g.i', 46)} END,
+                   NULL,
+                   g.created_on,
+                   g.created_on + interval '1 hour' * (1 + {_hash('g.i', 47)} % 72) * {versions - 1},
+                   CASE WHEN {_hash('g.i', 48)} % 4 = 0 THEN 'true' ELSE 'false' END,
+                   {versions},
+                   g.created_by_id, g.assigned_to_id
+            FROM base AS g
+            RETURNING *
+        )
+        INSERT INTO tasks_history (task_id, action, previous_data, new_data, version, is_snapshot, created_at, modified_by_id)
+        SELECT t.task_id,
+               CASE WHEN v.version = 1 THEN '{Added}' ELSE '{Modified}' END,
+               CASE WHEN v.version = 1 THEN NULL
+                    ELSE jsonb_build_object('status', {status_at('(v.version - 1)')}, 'modified_on', {modified_at('(v.version - 1)')}) END,
+               CASE WHEN (v.version - 1) % {HISTORY_SNAPSHOT_INTERVAL} = 0
+                    THEN {_task_state_sql(status_at('v.version'), modified_at('v.version'))}
+                    ELSE jsonb_build_object('status', {status_at('v.version')}, 'modified_on', {modified_at('v.version')}) END,
+               v.version,
+               (v.version - 1) % {HISTORY_SNAPSHOT_INTERVAL} = 0,
+               {modified_at('v.version')},
+               CASE WHEN v.version % 2 = 1 THEN t.created_by_id ELSE t.assigned_to_id END
+        FROM new_tasks AS t CROSS JOIN generate_series(1, {versions}) AS v(version)
+    """
+
+
+async def seed(users: int, tasks: int, history_per_task: int, days: int, seed_value: int, batch_size: int,
+               password: str, do_reset: bool) -> dict:
+    started = time.perf_counter()
+    async with async_engine.begin() as conn:
+        if do_reset:
+            await reset(conn)
+        await seed_lookups(conn)
+        await seed_users(conn, users, password, seed_value)
+
+    # Monthly history partitions for the whole range, plus the upcoming months
+    first_month = month_start((datetime.utcnow() - timedelta(days=days, hours=72 * history_per_task)).date())
+    today = datetime.utcnow().date()
+    months = (today.year - first_month.year) * 12 + today.month - first_month.month + HISTORY_PARTITION_MONTHS_AHEAD
+    await ensure_partitions(async_engine, months_ahead=months, start=first_month)
+
+    statement = text(_tasks_sql(history_per_task))
+    for first in range(1, tasks + 1, batch_size):
+        last = min(first + batch_size - 1, tasks)
+        batch_started = time.perf_counter()
+        async with async_engine.begin() as conn:
+            await disable_statement_timeout(conn)
+            await conn.execute(statement, {"first": first, "last": last, "days": days, "seed": seed_value})
+        logger.info(f"Seeded tasks {first}-{last} in {time.perf_counter() - batch_started:.1f}s")
+
+    async with async_engine.begin() as conn:
+        await disable_statement_timeout(conn)
+        await conn.execute(text("ANALYZE"))
+        counts = (await conn.execute(text("""
+            SELECT (SELECT count(*) FROM users) AS users,
+                   (SELECT count(*) FROM tasks_activity) AS tasks,
+                   (SELECT count(*) FROM tasks_history) AS history_entries
+        """))).mappings().one()
+
+    return {"seconds": round(time.perf_counter() - started, 1), **dict(counts)}
+
+
+async def _main(args):
+    try:
+        result = await seed(args.users, args.tasks, args.history_per_task, args.days, args.seed, args.batch_size,
+                            args.password, args.reset)
+        print(json.dumps(result, indent=2))
+    finally:
+        await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--tasks", type=int, default=100000)
+    parser.add_argument("--history-per-task", type=int, default=4, help="entries per task, including the creation")
+    parser.add_argument("--days", type=int, default=365, help="tasks are created over this many past days")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch-size", type=int, default=50000, help="tasks per transaction")
+    parser.add_argument("--password", default=BENCH_PASSWORD)
+    parser.add_argument("--reset", action="store_true", help="empty the tables first, required for reproducible ids")
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    logger.setLevel(logging.INFO)
+    # Every batch is a slow statement by design
+    logging.getLogger("api.query_tracker").setLevel(logging.ERROR)
+    asyncio.run(_main(parser.parse_args()))
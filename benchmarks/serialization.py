@@ -0,0 +1,148 @@
+"""Compare the cost of serializing task lists on the ORM path and on the row fast path.
+
+    python benchmarks/serialization.py --tasks 1000 --rounds 50
+
+The ORM path is what GET /api/v1/tasks used to do: build TaskResponse objects
+from TaskActivity instances, validate the wrapper again against
+ResponseWrapper[List[TaskResponse]] and render it with the JSON encoder. The
+fast path turns plain rows into dicts and renders them with orjson. Both work
+on in-memory data, so only the serialization is measured; the report gives the
+time per 1,000 tasks.
+
+With --fetch, both paths also load the tasks from the database configured by
+DATABASE_URL: TaskActivity objects through the session against the response
+columns as rows.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.utils import create_model_field  # noqa: E402
+from sqlalchemy import select  # noqa: E402
+
+from api.models import TaskActivity  # noqa: E402
+from api.schemas import ResponseWrapper, TaskResponse  # noqa: E402
+from api.task_serialization import TASK_RESPONSE_COLUMNS, task_list_response  # noqa: E402
+from api.task_service import TaskActivityImpl  # noqa: E402
+
+RESPONSE_FIELD = create_model_field(name="Response_get_tasks", type_=ResponseWrapper[List[TaskResponse]])
+
+
+def build_tasks(count: int) -> List[TaskActivity]:
+    now = datetime.utcnow()
+    return [
+        TaskActivity(
+            task_id=i + 1, task_name=f"Task {i}", task_description="Benchmark task " * 4, activity_type_id=1,
+            activity_group_id=None, stage_id=2, core_group_id=None, due_date=now + timedelta(days=i % 30),
+            action_type="call", status="In Active", link_response_ids=[1, 2], link_object_ids=None,
+            notes="Some notes", attachment_ids=[i], created_on=now, modified_on=now,
+            favorite="true" if i % 2 else "false", created_by_id=1, assigned_to_id=2,
+        )
+        for i in range(count)
+    ]
+
+
+# Stands in for the rows of select(*TASK_RESPONSE_COLUMNS), which offer the same _asdict()
+TaskRow = namedtuple("TaskRow", [column.key for column in TASK_RESPONSE_COLUMNS])
+
+
+def to_row(task: TaskActivity) -> TaskRow:
+    return TaskRow(*(getattr(task, key) for key in TaskRow._fields))
+
+
+async def orm_path(tasks) -> bytes:
+    wrapper = TaskActivityImpl.wrap_task_response(tasks)
+    content = await serialize_response(field=RESPONSE_FIELD, response_content=wrapper)
+    return JSONResponse(content=content).body
+
+
+async def fast_path(rows) -> bytes:
+    return task_list_response(rows).body
+
+
+async def time_rounds(func, data, rounds: int) -> List[float]:
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        await func(data)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def summarize(samples: List[float], tasks: int) -> dict:
+    per_thousand = [sample * 1000 / tasks for sample in samples]
+    return {
+        "median_ms_per_1000": round(statistics.median(per_thousand) * 1000, 3),
+        "min_ms_per_1000": round(min(per_thousand) * 1000, 3),
+    }
+
+
+async def fetch_rounds(limit: int, rounds: int) -> dict:
+    from api.database import AsyncSessionLocal as session_factory, async_engine
+
+    async def fetch_orm(_):
+        async with session_factory() as db:
+            tasks = (await db.execute(select(TaskActivity).order_by(TaskActivity.task_id).limit(limit))).scalars().all()
+            return await orm_path(tasks)
+
+    async def fetch_rows(_):
+        async with session_factory() as db:
+            rows = (await db.execute(select(*TASK_RESPONSE_COLUMNS).order_by(TaskActivity.task_id).limit(limit))).all()
+            return await fast_path(rows)
+
+    try:
+        async with session_factory() as db:
+            count = len((await db.execute(select(TaskActivity.task_id).limit(limit))).all())
+        if not count:
+            return {"error": "no tasks in the database"}
+        await fetch_orm(None)
+        await fetch_rows(None)
+        return {
+            "tasks": count,
+            "orm": summarize(await time_rounds(fetch_orm, None, rounds), count),
+            "fast": summarize(await time_rounds(fetch_rows, None, rounds), count),
+        }
+    finally:
+        await async_engine.dispose()
+
+
+async def main(args):
+    tasks = build_tasks(args.tasks)
+    rows = [to_row(task) for task in tasks]
+
+    # Both paths must produce the same document
+    assert json.loads(await orm_path(tasks)) == json.loads(await fast_path(rows))
+
+    orm = summarize(await time_rounds(orm_path, tasks, args.rounds), args.tasks)
+    fast = summarize(await time_rounds(fast_path, rows, args.rounds), args.tasks)
+    report = {
+        "tasks": args.tasks,
+        "rounds": args.rounds,
+        "serialization": {
+            "orm": orm,
+            "fast": fast,
+            "speedup": round(orm["median_ms_per_1000"] / fast["median_ms_per_1000"], 1),
+        },
+    }
+    if args.fetch:
+        report["fetch_and_serialize"] = await fetch_rounds(args.tasks, args.rounds)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=1000, help="tasks per response")
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--fetch", action="store_true", help="also load the tasks from the database")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,81 @@
+"""SMTP server that accepts every message and discards it.
+
+    python -m benchmarks.smtp_sink --port 8025
+
+Stands in for the mail server during load tests, so the email dispatcher
+keeps draining the outbox without sending anything. Run the API with
+SMTP_HOST=localhost SMTP_PORT=8025 SMTP_USE_TLS=false. Only the commands the
+dispatcher uses are understood, STARTTLS is not offered.
+"""
+import argparse
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+received = 0
+
+
+async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    global received
+
+    async def reply(line: str):
+        writer.write(f"{line}\r\n".encode())
+        await writer.drain()
+
+    await reply("220 benchmark smtp sink")
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            command = line.decode(errors="replace").strip().upper()
+            if command.startswith("EHLO"):
+                await reply("250-benchmark smtp sink\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME")
+            elif command.startswith("AUTH"):
+                await reply("235 accepted")
+            elif command == "DATA":
+                await reply("354 end with <CRLF>.<CRLF>")
+                while (await reader.readline()) not in (b".\r\n", b".\n", b""):
+                    pass
+                received += 1
+                await reply("250 queued")
+            elif command == "QUIT":
+                await reply("221 bye")
+                break
+            elif command.split(" ", 1)[0] in ("HELO", "MAIL", "RCPT", "RSET", "NOOP"):
+                await reply("250 ok")
+            else:
+                await reply("502 not implemented")
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def report(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        logger.info(f"{received} messages received")
+
+
+async def serve(host: str, port: int, interval: float):
+    server = await asyncio.start_server(handle, host, port)
+    logger.info(f"Listening on {host}:{port}")
+    asyncio.create_task(report(interval))
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--report-interval", type=float, default=10.0, help="seconds between message counts")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    try:
+        asyncio.run(serve(args.host, args.port, args.report_interval))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,108 @@
+"""Measure how long the application takes to import and to start.
+
+    python -m benchmarks.startup --rounds 5 --import-budget-ms 2000 --startup-budget-ms 3000
+
+Every round runs in a fresh interpreter. It imports api.main, checks that
+importing opened no database connection and set up no logging, then runs the
+lifespan (pool and cache warm-up, background workers) and asks
+/health/ready. The median of the rounds is compared with the budgets and the
+exit status is 1 when one is exceeded, so the check can run in CI against a
+migrated database.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+def _child():
+    started = time.perf_counter()
+    import logging
+    root_handlers = len(logging.getLogger().handlers)
+    from api import main
+    import_seconds = time.perf_counter() - started
+
+    from api.database import async_engine, engine
+    pools = [async_engine.sync_engine.pool, engine.pool]
+    import_side_effects = {
+        "connections": sum(pool.checkedin() + pool.checkedout() for pool in pools),
+        "logging_handlers": len(logging.getLogger().handlers) - root_handlers,
+    }
+
+    async def run():
+        import httpx
+        app = main.app
+        started = time.perf_counter()
+        async with app.router.lifespan_context(app):
+            startup_seconds = time.perf_counter() - started
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://startup") as client:
+                ready = await client.get("/health/ready")
+            stopping = time.perf_counter()
+        return {
+            "startup_seconds": startup_seconds,
+            "shutdown_seconds": time.perf_counter() - stopping,
+            "ready_status": ready.status_code,
+            "warmup": app.state.warmup,
+        }
+
+    result = asyncio.run(run())
+    print(json.dumps({"import_seconds": import_seconds, "import_side_effects": import_side_effects, **result}))
+
+
+def _round(env: dict) -> dict:
+    output = subprocess.run([sys.executable, "-m", "benchmarks.startup", "--child"], env=env, capture_output=True,
+                            text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 1)
+
+
+def main(args) -> int:
+    # Keep the logs of the measured runs out of app.log
+    env = {**os.environ, "APP_LOG_FILE": os.environ.get("APP_LOG_FILE", "")}
+    rounds = [_round(env) for _ in range(args.rounds)]
+
+    import_ms = _ms(statistics.median(result["import_seconds"] for result in rounds))
+    startup_ms = _ms(statistics.median(result["startup_seconds"] for result in rounds))
+    failures = []
+    if import_ms > args.import_budget_ms:
+        failures.append(f"import took {import_ms} ms, budget {args.import_budget_ms} ms")
+    if startup_ms > args.startup_budget_ms:
+        failures.append(f"startup took {startup_ms} ms, budget {args.startup_budget_ms} ms")
+    for result in rounds:
+        if result["import_side_effects"]["connections"]:
+            failures.append(f"importing api.main opened {result['import_side_effects']['connections']} connections")
+        if result["ready_status"] != 200:
+            failures.append(f"/health/ready answered {result['ready_status']} after startup")
+
+    print(json.dumps({
+        "rounds": args.rounds,
+        "import_ms": {"median": import_ms, "max": _ms(max(result["import_seconds"] for result in rounds))},
+        "startup_ms": {"median": startup_ms, "max": _ms(max(result["startup_seconds"] for result in rounds))},
+        "shutdown_ms": {"median": _ms(statistics.median(result["shutdown_seconds"] for result in rounds))},
+        "import_side_effects": rounds[-1]["import_side_effects"],
+        "warmup": rounds[-1]["warmup"],
+        "failures": sorted(set(failures)),
+    }, indent=2))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--import-budget-ms", type=float, default=2000)
+    parser.add_argument("--startup-budget-ms", type=float, default=3000)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _child()
+    else:
+        sys.exit(main(args))
@@ -0,0 +1,126 @@
+"""Check that creating and updating a task runs a fixed number of statements.
+
+    python -m benchmarks.statement_count --rounds 5
+
+create_task and update_task each run as one transaction: the task is only
+flushed to get its id, and the attachments, the history entry and the outbox
+row are written by the single commit. This script counts the statements of
+both flows with a before_cursor_execute listener on the database configured
+by DATABASE_URL (migrated, with at least one activity type), after the
+reference cache is warm as it is once the app has started, and with the
+default HISTORY_WRITE_MODE=sync. The exit status
+is 1 when a count moves off the expected range, e.g. a refresh or a per-row
+statement sneaking back in. The user and tasks it creates are deleted at the
+end.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, event, select
+
+from api.database import AsyncSessionLocal, async_engine
+from api.models import ActivityType, Attachment, EmailOutbox, TaskActivity, User
+from api.reference_cache import reference_cache
+from api.schemas import AttachmentCreate, TaskActivityCreate, UserPrincipal
+from api.task_service import TaskActivityImpl
+
+# Statements of each flow as inclusive ranges. BEGIN and COMMIT are not cursor executes and not counted
+EXPECTED = {
+    "create": (5, 5),
+    "create_with_attachments": (7, 7),
+    "update": (5, 5),
+}
+
+
+class StatementCounter:
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def reset(self):
+        self.statements = []
+
+
+async def _create_user(suffix: str) -> UserPrincipal:
+    async with AsyncSessionLocal() as db:
+        user = User(username=f"statement-count-{suffix}", email=f"statement-count-{suffix}@benchmark.local",
+                    hashed_password="!", is_active=True, is_admin=False)
+        db.add(user)
+        await db.commit()
+        return UserPrincipal(id=user.id, username=user.username, email=user.email)
+
+
+async def _cleanup(principal: UserPrincipal):
+    async with AsyncSessionLocal() as db:
+        task_ids = select(TaskActivity.task_id).where(TaskActivity.created_by_id == principal.id).scalar_subquery()
+        await db.execute(delete(Attachment).where(Attachment.task_id.in_(task_ids)))
+        # The history entries go with their task (ON DELETE CASCADE)
+        await db.execute(delete(TaskActivity).where(TaskActivity.created_by_id == principal.id))
+        await db.execute(delete(EmailOutbox).where(EmailOutbox.to_email == principal.email))
+        await db.execute(delete(User).where(User.id == principal.id))
+        await db.commit()
+
+
+async def run(rounds: int) -> dict:
+    service = TaskActivityImpl()
+    counter = StatementCounter()
+    async with AsyncSessionLocal() as db:
+        activity_type_id = (await db.execute(select(ActivityType.id).limit(1))).scalar()
+        await reference_cache.load_all(db)
+    if activity_type_id is None:
+        raise SystemExit("No activity type found, run the migrations and add reference data first")
+
+    principal = await _create_user(uuid.uuid4().hex[:12])
+    counts = {flow: [] for flow in EXPECTED}
+    samples = {}
+    event.listen(async_engine.sync_engine, "before_cursor_execute", counter)
+    try:
+        for index in range(rounds):
+            due_date = datetime.utcnow() + timedelta(days=7)
+            for flow, attachments in (("create", None),
+                                      ("create_with_attachments", [AttachmentCreate(file_name=f"{index}-{n}.txt")
+                                                                   for n in range(3)])):
+                task_data = TaskActivityCreate(task_name=f"Statement count {index}", activity_type_id=activity_type_id,
+                                               due_date=due_date, assigned_to_id=principal.id, attachments=attachments)
+                async with AsyncSessionLocal() as db:
+                    counter.reset()
+                    created = await service.create_task(db, task_data, principal)
+                    counts[flow].append(len(counter.statements))
+                    samples[flow] = list(counter.statements)
+
+            async with AsyncSessionLocal() as db:
+                counter.reset()
+                await service.update_task(db, created.values.task_id,
+                                          {"task_name": f"Statement count {index} updated", "notes": "updated"},
+                                          principal)
+                counts["update"].append(len(counter.statements))
+                samples["update"] = list(counter.statements)
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", counter)
+        await _cleanup(principal)
+        await async_engine.dispose()
+
+    failures = []
+    for flow, (low, high) in EXPECTED.items():
+        off = sorted({count for count in counts[flow] if not low <= count <= high})
+        if off:
+            failures.append({"flow": flow, "expected": [low, high], "counts": off,
+                             "statements": [statement[:200] for statement in samples[flow]]})
+    return {"rounds": rounds, "counts": {flow: sorted(set(values)) for flow, values in counts.items()},
+            "failures": failures}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args.rounds))
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if report["failures"] else 0)